@@ -1,47 +1,64 @@
 import os
-import sys
-import subprocess
+import asyncio
+import threading
 import pandas as pd
 import re
-import duckdb
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from dotenv import load_dotenv
 
+from sql_executor import get_pool, db_version, get_schema, get_table_comments, is_transient_error
+import db_snapshot
+from question_cache import get_question_cache
+from sql_preflight import SQLPreflight
+from schema_selector import SchemaSelector
+from term_index import get_term_index
+from llm_client import get_llm_client
+import tracing
+
 load_dotenv()
 
 # --- КОНФИГУРАЦИЯ ---
-SCRIPTS_DIR = "scripts_db"
-REQUEST_FILE = os.path.join(SCRIPTS_DIR, "request.sql")
-ANSWER_FILE = os.path.join(SCRIPTS_DIR, "answer.csv")
-RUNNER_SCRIPT = "run_sql_safe.py"
 DB_PATH = "db/medinsight.duckdb"
+SQL_CANDIDATES = int(os.getenv("SQL_CANDIDATES", "3"))                  # сколько вариантов SQL запрашивать параллельно
+CANDIDATE_CONCURRENCY = int(os.getenv("SQL_CANDIDATE_CONCURRENCY", "3"))  # бюджет одновременных LLM+SQL задач
+# Строк результата: LLM видит первые 50, а график строится по всем (большие прореживает viz.py)
+RESULT_ROWS = int(os.getenv("AGENT_MAX_ROWS", "200000"))
+
+# Разные "подсказки" и температуры, чтобы кандидаты не совпадали
+CANDIDATE_VARIANTS = [
+    (0.1, ""),
+    (0.5, "ПОДСКАЗКА: если вопрос можно решить через ВИТРИНУ (insight_...), используй именно её."),
+    (0.8, "ПОДСКАЗКА: построй запрос по сырым таблицам (prescriptions + JOIN справочников), без витрин."),
+]
+
+# Описания таблиц для промпта
+TABLE_DESCRIPTIONS = {
+    "insight_cost_by_disease": "ВИТРИНА (20 строк). Агрегаты: стоимость лечения по группам болезней.",
+    "insight_gender_disease": "ВИТРИНА (72 строки). Агрегаты: демография (пол, возраст) и болезни.",
+    "insight_region_drug_choice": "ВИТРИНА (150k строк). Агрегаты: популярность лекарств по районам (region = район_проживания пациента).",
+    "insight_monthly_disease": "ВИТРИНА (месяц x группа болезней). Агрегаты: число рецептов и пациентов по месяцам.",
+    "prescriptions": "СЫРЫЕ ДАННЫЕ (1 млн строк). Факты выдачи рецептов. Главная таблица.",
+    "prescriptions_fact": "СЫРЫЕ ДАННЫЕ (1 млн строк), компактно: дата_рецепта + целочисленные ключи patient_key/diagnosis_key/drug_key. Те же рецепты, что prescriptions, но JOIN быстрее.",
+    "patients": "Справочник (379k строк). Данные о пациентах (пол, дата рождения, район).",
+    "drugs": "Справочник (3k строк). Лекарства (торговое название, стоимость, дозировка).",
+    "diagnoses": "Справочник (14k строк). МКБ-10 (расшифровка диагнозов и классы)."
+}
 
 def get_smart_schema(db_path, explicit_relationships=None):
-    if not os.path.exists(db_path):
+    db_file = db_snapshot.resolve(db_path)  # текущий снимок базы
+    if not os.path.exists(db_file):
         return f"Error: Database file not found at {db_path}"
 
-    con = duckdb.connect(db_path, read_only=True)
     schema_prompt = "### TABLES & COLUMNS:\n"
-    
-    # 1. СПИСОК ТАБЛИЦ И ОПИСАНИЯ
-    table_descriptions = {
-        "insight_cost_by_disease": "ВИТРИНА (20 строк). Агрегаты: стоимость лечения по группам болезней.",
-        "insight_gender_disease": "ВИТРИНА (72 строки). Агрегаты: демография (пол, возраст) и болезни.",
-        "insight_region_drug_choice": "ВИТРИНА (150k строк). Агрегаты: популярность лекарств по регионам.",
-        "prescriptions": "СЫРЫЕ ДАННЫЕ (1 млн строк). Факты выдачи рецептов. Главная таблица.",
-        "patients": "Справочник (379k строк). Данные о пациентах (пол, дата рождения, район).",
-        "drugs": "Справочник (3k строк). Лекарства (торговое название, стоимость, дозировка).",
-        "diagnoses": "Справочник (14k строк). МКБ-10 (расшифровка диагнозов и классы)."
-    }
 
     try:
-        tables = con.execute("SHOW TABLES").fetchall()
-        table_names = [t[0] for t in tables]
-        
-        for table in table_names:
-            columns_info = con.execute(f"DESCRIBE {table}").fetchall()
-            columns_str = ", ".join([f"{col[0]} ({col[1]})" for col in columns_info])
+        # Читаем через общий пул: второе соединение к тому же файлу с другой конфигурацией DuckDB не откроет
+        schema = get_schema(db_path)  # без служебных таблиц
+        # 1. СПИСОК ТАБЛИЦ И ОПИСАНИЯ (+ витрины insight_auto_* из mart_advisor.py — COMMENT ON TABLE в каталоге)
+        table_descriptions = {**get_table_comments(db_path), **TABLE_DESCRIPTIONS}
+
+        for table, columns in schema.items():
+            columns_str = ", ".join([f"{col} ({dtype})" for col, dtype in columns])
             desc = table_descriptions.get(table, "Таблица данных")
             
             schema_prompt += f"- Table '{table}':\n"
@@ -50,8 +67,6 @@ def get_smart_schema(db_path, explicit_relationships=None):
             
     except Exception as e:
         schema_prompt += f"Error reading schema: {e}"
-    finally:
-        con.close()
 
     if explicit_relationships:
         schema_prompt += "### RELATIONSHIPS (JOINS):\n"
@@ -65,6 +80,10 @@ MY_RELATIONSHIPS = [
     "JOIN patients ON prescriptions.id_пациента = patients.id_пациента",
     "JOIN drugs ON prescriptions.код_препарата = drugs.код_препарата",
     "JOIN diagnoses ON prescriptions.код_диагноза = diagnoses.код_мкб",
+    "JOIN patients ON prescriptions_fact.patient_key = patients.patient_key",
+    "JOIN drugs ON prescriptions_fact.drug_key = drugs.drug_key",
+    "JOIN diagnoses ON prescriptions_fact.diagnosis_key = diagnoses.diagnosis_key",
+    "ЕСЛИ ЕСТЬ 'prescriptions_fact' -> для JOIN со справочниками бери её и ключи *_key (а не строковые коды из prescriptions)",
     "ЕСЛИ НУЖЕН ПОЛ/ВОЗРАСТ/РЕГИОН ПАЦИЕНТА -> делай JOIN patients.",
     "ЕСЛИ НУЖНО НАЗВАНИЕ ДИАГНОЗА (текст) -> делай JOIN diagnoses и ищи по полю 'название_диагноза'.",
     "ЕСЛИ НУЖНО НАЗВАНИЕ ЛЕКАРСТВА (текст) -> делай JOIN drugs и ищи по полю 'Торговое название'.",
@@ -88,16 +107,13 @@ SQL: SELECT "Торговое название", стоимость FROM drugs O
 # --- АГЕНТ ---
 class OpenRouterSQLAgent:
     def __init__(self, api_key: str):
-        self.llm = ChatOpenAI(
-            model="meta-llama/llama-3.3-70b-instruct", 
-            openai_api_key=api_key,
-            openai_api_base="https://openrouter.ai/api/v1",
-            temperature=0.1,
-            request_timeout=60, # <--- ВАЖНО: Тайм-аут API запроса (чтобы не висело 4 минуты)
-            max_retries=2,
-            default_headers={"HTTP-Referer": "https://medinsight.com", "X-Title": "Medical Agent"}
-        )
-        self.db_schema = get_smart_schema(DB_PATH, MY_RELATIONSHIPS)
+        # Общий на процесс клиент: пул соединений, лимиты RPM/TPM и приоритеты этапов (см. llm_client.py)
+        self.llm = get_llm_client(api_key)
+        # Вместо полной схемы (get_smart_schema) в каждый промпт идут только нужные вопросу таблицы
+        self.schema_selector = SchemaSelector(DB_PATH, MY_RELATIONSHIPS, TABLE_DESCRIPTIONS)
+        self.sql_cache = get_question_cache()
+        self.preflight = SQLPreflight(DB_PATH, MY_RELATIONSHIPS)
+        self.term_index = get_term_index(DB_PATH)
     
     def _clean_sql(self, text: str) -> str:
         match = re.search(r'```sql(.*?)```', text, re.DOTALL)
@@ -107,27 +123,53 @@ class OpenRouterSQLAgent:
         text = re.sub(r'^```', '', text)
         return text.strip()
 
-    def _execute_sql(self, sql_query: str):
-        if not os.path.exists(SCRIPTS_DIR): os.makedirs(SCRIPTS_DIR, exist_ok=True)
-        with open(REQUEST_FILE, "w", encoding="utf-8") as f: f.write(sql_query)
-        
-        try:
-            # <--- ВАЖНО: Добавил timeout=30, чтобы SQL не зависал навечно
-            result = subprocess.run(
-                [sys.executable, RUNNER_SCRIPT, "request.sql"],
-                cwd=SCRIPTS_DIR, capture_output=True, text=True, timeout=30
-            )
-            if result.returncode != 0:
-                return None, result.stderr.strip()
-            
-            if not os.path.exists(ANSWER_FILE) or os.path.getsize(ANSWER_FILE) == 0:
-                return pd.DataFrame(), None
-                
-            return pd.read_csv(ANSWER_FILE), None
-        except subprocess.TimeoutExpired:
-            return None, "SQL Query Timed Out (более 30 сек)."
-        except Exception as e:
-            return None, str(e)
+    def _schema_for(self, question: str) -> str:
+        with tracing.span("prompt.schema") as span:
+            try:
+                schema = self.schema_selector.build(question)
+            except Exception as e:
+                print(f"🔸 SCHEMA SELECTOR FAILED: {e}")
+                schema = get_smart_schema(DB_PATH, MY_RELATIONSHIPS)
+                span.set(fallback=True)
+            span.set(chars=len(schema))
+            return schema
+
+    def _term_codes(self, question: str) -> str:
+        """Термины вопроса -> готовые списки кодов МКБ/препаратов (вместо ILIKE-сканов по названиям)"""
+        with tracing.span("prompt.terms") as span:
+            try:
+                hint = self.term_index.prompt_hint(question)
+            except Exception as e:
+                print(f"🔸 TERM INDEX SKIPPED: {e}")
+                return "Не найдено."
+            span.set(found=bool(hint))
+            return hint or "Не найдено."
+
+    def _preflight(self, sql_query: str) -> str:
+        """Локальная проверка через EXPLAIN и детерминированная починка — до любых вызовов LLM"""
+        with tracing.span("sql.preflight") as span:
+            try:
+                fixed, error, fixes = self.preflight.repair(sql_query)
+            except Exception as e:
+                print(f"🔸 PREFLIGHT SKIPPED: {e}")
+                return sql_query
+            if fixes:
+                print(f"🛠 PREFLIGHT FIXES: {', '.join(fixes)}")
+            span.set(fixes=", ".join(fixes) if fixes else None, valid=error is None)
+            return fixed
+
+    def _execute_sql(self, sql_query: str, cancel_event: threading.Event = None):
+        # Выполняем в процессе через пул read-only соединений (те же правила, что у run_sql_safe.py)
+        with tracing.span("sql.execute", sql=sql_query[:1000]) as span:
+            try:
+                df, error = get_pool(DB_PATH).execute(sql_query, cancel_event=cancel_event, limit=RESULT_ROWS,
+                                                        source="agent")
+            except Exception as e:
+                df, error = None, str(e)
+            span.set(rows=len(df) if df is not None else None)
+            if error:
+                span.error = error[:500]
+            return df, error
     
     def _format_history(self, history: list) -> str:
         """Превращает список сообщений в строку диалога для контекста"""
@@ -142,18 +184,43 @@ class OpenRouterSQLAgent:
             formatted.append(f"{role}: {content}")
         return "\n".join(formatted)
 
+    def _cache_context(self, history: list) -> str:
+        """Контекст для ключа кэша: только предыдущие вопросы пользователя (ответы LLM недетерминированы)"""
+        if not history:
+            return ""
+        questions = [str(msg["content"]) for msg in history[-4:] if msg["role"] == "user"]
+        return " | ".join(questions)
+
     def _generate_initial_sql(self, question: str, history_context: str) -> str:
         """Этап 1: Генерация с учетом истории"""
+        prompt = self._initial_sql_prompt(question, history_context)
+        response = self.llm.invoke(prompt.format_messages(), lane="pipeline")
+        return self._preflight(self._clean_sql(response.content))
+
+    async def _agenerate_initial_sql(self, question: str, history_context: str, temperature: float, hint: str,
+                                     lane: str = "pipeline") -> str:
+        """Этап 1 (async): один из кандидатов для гонки"""
+        prompt = self._initial_sql_prompt(question, history_context, hint)
+        response = await self.llm.ainvoke(prompt.format_messages(), lane=lane, temperature=temperature)
+        return self._clean_sql(response.content)
+
+    def _initial_sql_prompt(self, question: str, history_context: str, hint: str = "") -> ChatPromptTemplate:
+        with tracing.span("prompt.build"):
+            return self._build_initial_sql_prompt(question, history_context, hint)
 
+    def _build_initial_sql_prompt(self, question: str, history_context: str, hint: str) -> ChatPromptTemplate:
         system_message = f"""
         Ты — эксперт SQL-аналитик на DuckDB.
         Твоя задача — генерировать SQL-запросы для медицинской базы данных.
 
         === DATABASE SCHEMA ===
-        {self.db_schema}
+        {self._schema_for(question + ' ' + history_context)}
 
         === FEW-SHOT EXAMPLES ===
         {FEW_SHOT_EXAMPLES}
+
+        === НАЙДЕННЫЕ КОДЫ (индекс терминов) ===
+        {self._term_codes(question)}
         
         === CONVERSATION HISTORY ===
         {history_context}
@@ -164,24 +231,79 @@ class OpenRouterSQLAgent:
         2. CONTEXT AWARENESS: Если пользователь задает уточняющий вопрос (например, "А для женщин?", "А в 2023 году?"), ты должен понять контекст из предыдущих сообщений и модифицировать предыдущий логический запрос.
         3. Если это новый вопрос, игнорируй историю и генерируй запрос с нуля.
         4. Приоритет #1: ВСЕГДА проверяй, можно ли ответить через таблицы 'ВИТРИНА' (insight_...). Они быстрее и содержат готовые агрегаты.
-        5. Используй ILIKE '%...%' для поиска текста (DuckDB case-insensitive).
-        6. МЕДИЦИНСКИЙ ИНТЕЛЛЕКТ (Синонимы и Точность):
+        5. Если для термина есть НАЙДЕННЫЕ КОДЫ — фильтруй ровно так, как там указано (`... IN (...)`), без JOIN со справочником только ради фильтра и без ILIKE. Синонимы в этих списках уже учтены.
+           Иначе используй ILIKE '%...%' для поиска текста (DuckDB case-insensitive).
+        6. МЕДИЦИНСКИЙ ИНТЕЛЛЕКТ (Синонимы и Точность, если кодов не нашлось):
            - Если пользователь называет орган или симптом простым языком (например, "нос", "рот", "живот", "сердце"), ты ОБЯЗАН расширить поиск научными терминами.
            - ПРИМЕР: Для запроса "нос" ищи: `название_диагноза ILIKE '%нос%' OR название_диагноза ILIKE '%ринит%' OR название_диагноза ILIKE '%синусит%'`.
            - ПРИМЕР: Для запроса "рот" добавь: `OR название_диагноза ILIKE '%стоматит%' OR название_диагноза ILIKE '%гингивит%'`.
            - ПРИМЕР: Для запроса "сердце" добавь: `OR название_диагноза ILIKE '%карди%' OR название_диагноза ILIKE '%инфаркт%'`.
            - ОСТОРОЖНО С КОРНЯМИ: Поиск по коротким корням (типа `%нос%`) может дать ложные срабатывания (например, слово "диагНОСтика"). Приоритет отдавай полным медицинским названиям болезней.
+        7. Период фильтруй диапазоном по самой колонке: `дата_рецепта >= '2023-03-01' AND дата_рецепта < '2023-04-01'`, а не `strftime(...) = ...` или `year(...) = ...`.
+           Рецепты отсортированы по дате, и по диапазону DuckDB пропускает ненужные блоки (strftime в SELECT/GROUP BY — можно).
+        {hint}
         """
         user_message = f"Напиши SQL запрос для вопроса: {question}"
 
-        prompt_template = ChatPromptTemplate.from_messages([
+        return ChatPromptTemplate.from_messages([
             ("system", system_message),
             ("human", user_message)
         ])
-        
-        chain = prompt_template | self.llm
-        response = chain.invoke({})
-        return self._clean_sql(response.content)
+
+    async def _race_candidates(self, question: str, history_context: str):
+        """Гонка кандидатов: N вариантов SQL генерируются и выполняются параллельно.
+
+        Возвращает (sql, df, error) первого успешного (без ошибки и не пустого) кандидата,
+        остальные отменяются. Если успешных нет — первый по времени неудачный.
+        """
+        semaphore = asyncio.Semaphore(CANDIDATE_CONCURRENCY)
+        cancel_events = [threading.Event() for _ in range(SQL_CANDIDATES)]
+
+        async def run_candidate(i):
+            temperature, hint = CANDIDATE_VARIANTS[i % len(CANDIDATE_VARIANTS)]
+            # Основной кандидат — в полосе пайплайна, запасные — фоновые: под нагрузкой уступают анализу
+            lane = "pipeline" if i == 0 else "background"
+            async with semaphore:
+                with tracing.span("sql.candidate", index=i, lane=lane, temperature=temperature) as span:
+                    sql = await self._agenerate_initial_sql(question, history_context, temperature, hint, lane)
+                    sql = await asyncio.to_thread(self._preflight, sql)
+                    df, error = await asyncio.to_thread(self._execute_sql, sql, cancel_events[i])
+                    span.set(outcome="error" if error else "empty" if df.empty else "ok")
+                    return sql, df, error
+
+        tasks = [asyncio.create_task(run_candidate(i)) for i in range(SQL_CANDIDATES)]
+        first_failure = None
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    sql, df, error = await next_done
+                except Exception as e:
+                    print(f"🔸 CANDIDATE FAILED: {e}")
+                    continue
+                if not error and df is not None and not df.empty:
+                    return sql, df, None
+                print(f"🔸 CANDIDATE {'ERROR' if error else 'EMPTY'}: {sql}")
+                if first_failure is None:
+                    first_failure = (sql, df, error)
+        finally:
+            # Отменяем проигравших: LLM-запросы через cancel(), SQL — через interrupt()
+            for event in cancel_events:
+                event.set()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if first_failure is None:
+            raise RuntimeError("Ни один кандидат SQL не был сгенерирован.")
+        return first_failure
+
+    def _generate_and_execute(self, question: str, history_context: str):
+        """Генерация + первое выполнение: гонкой кандидатов или одним запросом (SQL_CANDIDATES=1)"""
+        if SQL_CANDIDATES <= 1:
+            sql = self._generate_initial_sql(question, history_context)
+            df, error = self._execute_sql(sql)
+            return sql, df, error
+        return asyncio.run(self._race_candidates(question, history_context))
 
     def _fix_sql_error(self, question: str, bad_sql: str, error_msg: str) -> str:
         """Этап 2: Самокоррекция (Self-Correction Loop)"""
@@ -189,7 +311,7 @@ class OpenRouterSQLAgent:
         system_message = f"""
         Ты — SQL-дебаггер. Твоя задача — исправить ошибку в запросе.
         === SCHEMA ===
-        {self.db_schema}
+        {self._schema_for(question)}
         """
         user_message = f"""
         У меня проблема с ответом на вопрос: "{question}"
@@ -202,9 +324,8 @@ class OpenRouterSQLAgent:
         ЗАДАЧА: Исправь SQL запрос. Верни ТОЛЬКО исправленный SQL код.
         """
         prompt = ChatPromptTemplate.from_messages([("system", system_message), ("human", user_message)])
-        chain = prompt | self.llm
-        response = chain.invoke({})
-        return self._clean_sql(response.content)
+        response = self.llm.invoke(prompt.format_messages(), lane="pipeline")
+        return self._preflight(self._clean_sql(response.content))
     
     def _fix_empty_result(self, question: str, bad_sql: str) -> str:
         """Этап 2: Self-Correction Loop (Empty Result)"""
@@ -213,7 +334,9 @@ class OpenRouterSQLAgent:
         Ты — опытный SQL-аналитик / Data Detective.
         Твоя задача — найти данные, которые "потерялись" из-за слишком строгих фильтров.
         === DATABASE SCHEMA ===
-        {self.db_schema}
+        {self._schema_for(question)}
+        === НАЙДЕННЫЕ КОДЫ (индекс терминов) ===
+        {self._term_codes(question)}
         """
         user_message = f"""
         У меня проблема с ответом на вопрос: "{question}"
@@ -222,21 +345,30 @@ class OpenRouterSQLAgent:
         {bad_sql}
         ```
         Результат: 0 строк (EMPTY RESULT). Но данные в базе точно должны быть.
-        ЗАДАЧА: Перепиши SQL запрос так, чтобы найти данные (используй ILIKE, синонимы).
+        ЗАДАЧА: Перепиши SQL запрос так, чтобы найти данные (используй НАЙДЕННЫЕ КОДЫ, иначе ILIKE и синонимы).
         Верни ТОЛЬКО исправленный SQL код.
         """
         prompt = ChatPromptTemplate.from_messages([("system", system_message), ("human", user_message)])
-        chain = prompt | self.llm
-        response = chain.invoke({})
-        return self._clean_sql(response.content)
+        response = self.llm.invoke(prompt.format_messages(), lane="pipeline")
+        return self._preflight(self._clean_sql(response.content))
 
     def _analyze_data(self, question: str, df: pd.DataFrame) -> str:
         """Этап 3: Интерпретация результата"""
+        return "".join(self._analyze_data_stream(question, df))
+
+    def _analyze_data_stream(self, question: str, df: pd.DataFrame):
+        """Этап 3 (потоково): отдаёт ответ по кусочкам по мере генерации LLM"""
 
-        if df is None: return "⚠️ Ошибка выполнения запроса."
-        if df.empty: return "Данных не найдено даже после нескольких попыток."
+        if df is None:
+            yield "⚠️ Ошибка выполнения запроса."
+            return
+        if df.empty:
+            yield "Данных не найдено даже после нескольких попыток."
+            return
 
-        df_head = df.head(50).to_markdown(index=False)
+        # Таблица для промпта (раньше здесь был разбор CSV из run_sql_safe.py)
+        with tracing.span("analysis.format", rows=len(df)):
+            df_head = df.head(50).to_markdown(index=False)
         system_message = """
         Ты — профессиональный медицинский аналитик.
         Твоя задача — ответить на вопрос пользователя, опираясь ИСКЛЮЧИТЕЛЬНО на предоставленные данные.
@@ -247,45 +379,140 @@ class OpenRouterSQLAgent:
         """
         user_message = f"""
         Вопрос пользователя: "{question}"
-        Полученные данные из БД:
+        Полученные данные из БД{f" (первые 50 из {len(df)} строк)" if len(df) > 50 else ""}:
         {df_head}
         Сделай вывод на основе этих данных.
         """
         prompt_template = ChatPromptTemplate.from_messages([("system", system_message), ("human", user_message)])
-        chain = prompt_template | self.llm
-        response = chain.invoke({})
-        return response.content
+        # Ответ ждёт пользователь — интерактивная полоса, вне очереди фоновых запросов
+        with tracing.span("analysis") as span:
+            chars = 0
+            for token in self.llm.stream(prompt_template.format_messages(), lane="interactive"):
+                chars += len(token)
+                yield token
+            span.set(chars=chars)
 
     def answer(self, user_question: str, chat_history: list = None):
-        try:
-            # 1. Формируем контекст истории
-            history_context = self._format_history(chat_history) if chat_history else "No history."
+        return self.answer_with_data(user_question, chat_history)[0]
+
+    def answer_with_data(self, user_question: str, chat_history: list = None):
+        """Возвращает (текст ответа, DataFrame) — данные принадлежат только этому запросу"""
+        parts, df = [], None
+        for event in self.stream_answer(user_question, chat_history):
+            if event["type"] == "rows":
+                df = event["df"]
+            elif event["type"] == "token":
+                parts.append(event["text"])
+            elif event["type"] == "error":
+                return event["text"], None
+        return "".join(parts), df
 
-            current_sql = self._generate_initial_sql(user_question, history_context)
+    def stream_answer(self, user_question: str, chat_history: list = None):
+        """Генератор событий для UI.
+
+        Сначала этапы пайплайна ({"type": "sql"}, {"type": "retry"}, {"type": "rows"}),
+        затем ответ по токенам ({"type": "token"}); при неудаче — {"type": "error"}.
+        """
+        # Корневой спан вопроса: этапы ниже (промпт, LLM, SQL, анализ) пишутся его детьми в logs/traces.jsonl
+        with tracing.span("agent.answer", question=user_question[:500]) as root:
+            try:
+                df, retries = None, 0
+                for event in self._sql_pipeline(user_question, chat_history):
+                    yield event
+                    if event["type"] == "sql" and event["cached"]:
+                        root.set(sql_cache_hit=True)
+                    elif event["type"] == "retry":
+                        retries += 1
+                        root.set(retries=retries)
+                    elif event["type"] == "error":
+                        root.set(outcome="error")
+                        root.error = event["text"][:500]
+                        return
+                    elif event["type"] == "rows":
+                        df = event["df"]
+                        root.set(rows=len(df), sql=event["sql"][:1000])
+
+                for token in self._analyze_data_stream(user_question, df):
+                    yield {"type": "token", "text": token}
+                root.set(outcome="ok")
+            except Exception as e:
+                root.error = str(e)[:500]
+                yield {"type": "error", "text": f"Критическая ошибка агента: {str(e)}"}
+
+    def _sql_pipeline(self, user_question: str, chat_history: list = None):
+        """Этапы 1-2: генерация SQL, выполнение и самокоррекция. Заканчивается событием rows или error"""
+        # 1. Формируем контекст истории
+        history_context = self._format_history(chat_history) if chat_history else "No history."
+        cache_context = self._cache_context(chat_history)
+        version = db_version(DB_PATH)
+
+        # 2. Проверенный SQL из кэша — сразу к выполнению, без LLM
+        with tracing.span("sql.cache_lookup") as span:
+            current_sql = self.sql_cache.get(user_question, cache_context, version)
+            span.set(hit=current_sql is not None)
+        from_cache = current_sql is not None
+        rejected = False
+        if from_cache:
+            print(f"💾 CACHED SQL: {current_sql}")
+            yield {"type": "sql", "sql": current_sql, "cached": True}
+            df, error = self._execute_sql(current_sql)
+            # Ошибка нагрузки (очередь, таймаут, отмена) не повод выкидывать проверенный SQL — её покажет цикл ниже
+            if not is_transient_error(error) and (error or df.empty):
+                self.sql_cache.invalidate(user_question, cache_context)
+                from_cache = False
+                if error and error.startswith("Query Guard"):
+                    # Отказ Query Guard: причину получает исправление SQL в цикле ниже
+                    print("🔸 CACHED SQL REJECTED BY QUERY GUARD, FIXING")
+                    rejected = True
+                else:
+                    # Закэшированный SQL больше не работает — выкидываем и генерируем заново
+                    print("🔸 CACHED SQL FAILED, REGENERATING")
+
+        # 3. Несколько кандидатов параллельно, берём первый успешный
+        if not from_cache and not rejected:
+            with tracing.span("sql.generate", candidates=SQL_CANDIDATES):
+                current_sql, df, error = self._generate_and_execute(user_question, history_context)
             print(f"🔹 GENERATED SQL: {current_sql}")
+            yield {"type": "sql", "sql": current_sql, "cached": False}
 
-            MAX_RETRIES = 3 
-            
-            for attempt in range(MAX_RETRIES + 1):
+        MAX_RETRIES = 3 
+        
+        for attempt in range(MAX_RETRIES + 1):
+            if attempt > 0:
                 df, error = self._execute_sql(current_sql)
-                
-                if error:
-                    print(f"🔸 ATTEMPT {attempt+1} SQL ERROR: {error}")
-                    if attempt < MAX_RETRIES:
+
+            if is_transient_error(error):
+                # Нагрузка, а не ошибка в SQL: переписывать рабочий запрос через LLM бессмысленно
+                print(f"🔸 ATTEMPT {attempt+1} SQL NOT EXECUTED: {error}")
+                yield {"type": "error", "text": f"🚫 Не удалось выполнить запрос. Ошибка: {error}"}
+                return
+
+            if error:
+                print(f"🔸 ATTEMPT {attempt+1} SQL ERROR: {error}")
+                if attempt < MAX_RETRIES:
+                    yield {"type": "retry", "attempt": attempt + 1, "reason": error}
+                    with tracing.span("sql.fix", attempt=attempt + 1, reason="error", sql_error=error[:500]):
                         current_sql = self._fix_sql_error(user_question, current_sql, error)
-                        continue
-                    else:
-                        return f"🚫 Не удалось выполнить запрос. Ошибка: {error}"
+                    yield {"type": "sql", "sql": current_sql, "cached": False}
+                    continue
+                else:
+                    yield {"type": "error", "text": f"🚫 Не удалось выполнить запрос. Ошибка: {error}"}
+                    return
 
-                if df.empty:
-                    print(f"🔸 ATTEMPT {attempt+1} EMPTY RESULT (0 rows).")
-                    if attempt < MAX_RETRIES:
+            if df.empty:
+                print(f"🔸 ATTEMPT {attempt+1} EMPTY RESULT (0 rows).")
+                if attempt < MAX_RETRIES:
+                    yield {"type": "retry", "attempt": attempt + 1, "reason": "Пустой результат"}
+                    with tracing.span("sql.fix", attempt=attempt + 1, reason="empty"):
                         current_sql = self._fix_empty_result(user_question, current_sql)
-                        continue
-                    else:
-                        return "По вашему запросу данных не найдено."
-
-                print(f"✅ SUCCESS ({len(df)} rows)")
-                return self._analyze_data(user_question, df)
-        except Exception as e:
-            return f"Критическая ошибка агента: {str(e)}"
\ No newline at end of file
+                    yield {"type": "sql", "sql": current_sql, "cached": False}
+                    continue
+                else:
+                    yield {"type": "error", "text": "По вашему запросу данных не найдено."}
+                    return
+
+            print(f"✅ SUCCESS ({len(df)} rows)")
+            if not from_cache:
+                self.sql_cache.put(user_question, cache_context, current_sql, version)
+            yield {"type": "rows", "df": df, "sql": current_sql}
+            return
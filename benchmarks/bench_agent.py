@@ -0,0 +1,288 @@
+# benchmarks/bench_agent.py
+# Офлайн-прогон агента по золотому набору вопросов (gold_questions.json): без сети и без OpenRouter.
+# Фикстура — небольшая синтетическая база из CSV (тот же 01_setup_db.py, что и для настоящих данных),
+# LLM — локальная заглушка: по сценарию из набора (детерминированно) или из записанных ответов (--replay).
+# Отчёт: задержки этапов (p50/p95), повторы SQL, токены на вопрос и совпадение результата с эталонным SQL.
+# Запуск из корня проекта: python benchmarks/bench_agent.py --repeat 3 --llm-latency 0.2
+#   записать ответы настоящей модели (нужны сеть и OPENROUTER_API_KEY): ... --record benchmarks/recorded.jsonl
+#   прогнать записанное без сети:                                       ... --replay benchmarks/recorded.jsonl
+#   как проверка в CI: ... --min-accuracy 1.0 --max-p95-ms 3000 (код возврата 1, если порог не выдержан)
+import argparse
+import importlib.util
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(Path(__file__).parent))
+
+import agent as agent_module
+from sql_executor import get_pool
+from llm_client import BASE_URL, MODEL, LLMClient, RateLimiter
+from mock_llm import MockLLM, Recorder, Replay
+
+# 01_setup_db.py не импортируется обычным import (имя начинается с цифры)
+_spec = importlib.util.spec_from_file_location("setup_db", PROJECT_ROOT / "scripts_db" / "01_setup_db.py")
+setup_db = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(setup_db)
+
+GOLD_PATH = Path(__file__).parent / "gold_questions.json"
+DB_PATH = "db/medinsight.duckdb"   # относительно временной папки прогона, как у агента
+# Этапы по событиям stream_answer: SQL готов, данные получены (с повторами), первый токен анализа, конец
+STAGES = {"sql": "SQL", "rows": "данные", "first_token": "1-й токен", "total": "всего"}
+
+# --- ФИКСТУРА ---
+DIAGNOSES = [
+    ("E10", "Сахарный диабет 1 типа", "Болезни эндокринной системы"),
+    ("E11", "Сахарный диабет 2 типа", "Болезни эндокринной системы"),
+    ("E03", "Гипотиреоз", "Болезни эндокринной системы"),
+    ("I10", "Эссенциальная гипертензия", "Болезни системы кровообращения"),
+    ("I20", "Стенокардия", "Болезни системы кровообращения"),
+    ("I21", "Острый инфаркт миокарда", "Болезни системы кровообращения"),
+    ("J06", "Острая инфекция верхних дыхательных путей", "Болезни органов дыхания"),
+    ("J10", "Грипп, вызванный идентифицированным вирусом гриппа", "Болезни органов дыхания"),
+    ("J30", "Вазомоторный и аллергический ринит", "Болезни органов дыхания"),
+    ("J45", "Астма", "Болезни органов дыхания"),
+    ("K29", "Гастрит и дуоденит", "Болезни органов пищеварения"),
+    ("K80", "Желчнокаменная болезнь", "Болезни органов пищеварения"),
+    ("M17", "Гонартроз", "Болезни костно-мышечной системы"),
+    ("M54", "Дорсалгия", "Болезни костно-мышечной системы"),
+    ("F32", "Депрессивный эпизод", "Психические расстройства"),
+]
+# код -> (торговое название, дозировка, стоимость, диагнозы, при которых назначают)
+DRUGS = {
+    "1001": ("Метформин", "500 мг", 150.0, ["E11"]),
+    "1002": ("Инсулин гларгин", "100 ЕД/мл", 3500.0, ["E10", "E11"]),
+    "1003": ("Эутирокс", "50 мкг", 220.0, ["E03"]),
+    "1004": ("Лизиноприл", "10 мг", 180.0, ["I10"]),
+    "1005": ("Амлодипин", "5 мг", 160.0, ["I10", "I20"]),
+    "1006": ("Нитроглицерин", "0.5 мг", 90.0, ["I20", "I21"]),
+    "1007": ("Клопидогрел", "75 мг", 640.0, ["I21"]),
+    "1008": ("Осельтамивир", "75 мг", 1200.0, ["J10"]),
+    "1009": ("Ингавирин", "90 мг", 520.0, ["J06", "J10"]),
+    "1010": ("Сальбутамол", "100 мкг/доза", 310.0, ["J45"]),
+    "1011": ("Мометазон", "50 мкг/доза", 780.0, ["J30", "J45"]),
+    "1012": ("Омепразол", "20 мг", 120.0, ["K29"]),
+    "1013": ("Урсодезоксихолевая кислота", "250 мг", 1650.0, ["K80"]),
+    "1014": ("Ибупрофен", "400 мг", 110.0, ["J06", "M17", "M54"]),
+    "1015": ("Сертралин", "50 мг", 870.0, ["F32"]),
+}
+DISTRICTS = ["Адмиралтейский", "Василеостровский", "Выборгский", "Калининский", "Кировский",
+             "Колпинский", "Красногвардейский", "Московский", "Невский", "Приморский"]
+
+
+def write_fixture(data_dir: Path, patients: int, prescriptions: int, seed: int = 0):
+    """CSV в формате выгрузки (данные_*.csv) с фиксированным seed — база одинакова при каждом прогоне"""
+    rng = np.random.default_rng(seed)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(DIAGNOSES, columns=["код_мкб", "название_диагноза", "класс_заболевания"]).to_csv(
+        data_dir / "данные_диагнозы.csv", index=False)
+    pd.DataFrame([(code, dose, name, cost, f"{name} {dose}") for code, (name, dose, cost, _) in DRUGS.items()],
+                 columns=["код_препарата", "дозировка", "Торговое название", "стоимость", "Полное_название"]).to_csv(
+        data_dir / "данные_препараты.csv", index=False)
+
+    ids = [f"P{i:08d}" for i in range(patients)]
+    pd.DataFrame({
+        "id_пациента": ids,
+        "дата_рождения": pd.Timestamp("1940-01-01") + pd.to_timedelta(rng.integers(0, 75 * 365, patients), unit="D"),
+        "пол": rng.choice(["М", "Ж"], patients, p=[0.45, 0.55]),
+        "район_проживания": rng.choice(DISTRICTS, patients),
+        "регион": rng.choice(["Санкт-Петербург", "Ленинградская область"], patients, p=[0.85, 0.15]),
+    }).to_csv(data_dir / "данные_пациентов.csv", index=False)
+
+    weights = rng.dirichlet(np.ones(len(DIAGNOSES)) * 2)
+    codes = rng.choice([code for code, _, _ in DIAGNOSES], prescriptions, p=weights)
+    by_code = {code: [d for d, (_, _, _, uses) in DRUGS.items() if code in uses] for code, _, _ in DIAGNOSES}
+    by_code = {code: drugs or list(DRUGS) for code, drugs in by_code.items()}
+    pd.DataFrame({
+        "id_пациента": "x",   # в выгрузке настоящий id — в последней колонке
+        "дата_рецепта": pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 730 * 24 * 60, prescriptions), unit="min"),
+        "код_диагноза": codes,
+        "код_препарата": [by_code[code][rng.integers(len(by_code[code]))] for code in codes],
+        "id_пациента_1": rng.choice(ids, prescriptions),
+    }).to_csv(data_dir / "данные_рецептов.csv", index=False)
+
+
+# --- ЗАГЛУШКА LLM ---
+def scripted(gold: list):
+    """Детерминированная «модель»: первый SQL — mock_initial (ошибка/пустой результат для проверки повторов)
+    или эталон, исправление — эталон, анализ — короткий шаблонный текст"""
+    def respond(messages: list) -> str:
+        prompt = messages[-1]["content"]
+        matches = [q for q in gold if q["question"] in prompt]
+        if not matches:
+            return "SELECT 1"
+        q = max(matches, key=lambda q: len(q["question"]))
+        if "Напиши SQL запрос" in prompt:
+            return f"```sql\n{q.get('mock_initial', q['sql'])}\n```"
+        if "У меня проблема с ответом" in prompt:
+            return f"```sql\n{q['sql']}\n```"
+        return f"По данным выборки: ответ на вопрос «{q['question']}» приведён в таблице выше."
+    return respond
+
+
+# --- СРАВНЕНИЕ РЕЗУЛЬТАТОВ ---
+def _cell(value) -> str:
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ""
+    if isinstance(value, (float, np.floating)):
+        return f"{round(float(value), 2):g}"
+    return str(value)
+
+
+def same_result(expected: pd.DataFrame, got: pd.DataFrame) -> bool:
+    """Одинаковые строки (без учёта имён и порядка колонок и порядка строк, числа — до 0.01)"""
+    if got is None or expected.shape != got.shape:
+        return False
+    rows = lambda df: sorted(tuple(sorted(map(_cell, row))) for row in df.itertuples(index=False))
+    return rows(expected) == rows(got)
+
+
+# --- ПРОГОН ---
+def total_tokens(client: LLMClient) -> int:
+    return sum(lane["tokens"] for lane in client.stats()["lanes"].values())
+
+
+def ask(agent, question: str) -> dict:
+    """Один вопрос через stream_answer: отметки этапов (мс от начала), повторы, результат"""
+    result = {"marks": {}, "retries": 0, "cached": False, "df": None, "error": None}
+    tokens = total_tokens(agent.llm)
+    start = time.perf_counter()
+    with redirect_stdout(StringIO()):
+        for event in agent.stream_answer(question):
+            now = (time.perf_counter() - start) * 1000
+            if event["type"] == "sql":
+                result["marks"].setdefault("sql", now)
+                result["cached"] = result["cached"] or event["cached"]
+            elif event["type"] == "retry":
+                result["retries"] += 1
+            elif event["type"] == "rows":
+                result["marks"]["rows"], result["df"] = now, event["df"]
+            elif event["type"] == "token":
+                result["marks"].setdefault("first_token", now)
+            elif event["type"] == "error":
+                result["error"] = event["text"]
+    result["marks"]["total"] = (time.perf_counter() - start) * 1000
+    result["tokens"] = total_tokens(agent.llm) - tokens
+    return result
+
+
+def percentile(values: list, share: float) -> float:
+    values = sorted(values)
+    return values[max(math.ceil(len(values) * share) - 1, 0)] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gold", type=Path, default=GOLD_PATH)
+    parser.add_argument("--repeat", type=int, default=3, help="прогонов набора (каждый — без кэша вопросов)")
+    parser.add_argument("--patients", type=int, default=3000)
+    parser.add_argument("--prescriptions", type=int, default=30000)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="задержка заглушки на запрос, сек")
+    parser.add_argument("--candidates", type=int, default=agent_module.SQL_CANDIDATES)
+    parser.add_argument("--replay", type=Path, help="JSONL с записанными ответами модели")
+    parser.add_argument("--record", type=Path, help="записать ответы настоящей модели в JSONL")
+    parser.add_argument("--min-accuracy", type=float, help="порог доли верных ответов (0..1)")
+    parser.add_argument("--max-p95-ms", type=float, help="порог p95 полного ответа, мс")
+    parser.add_argument("--report", type=Path, help="сохранить сводку в JSON (для сравнения прогонов)")
+    args = parser.parse_args()
+
+    gold = json.loads(args.gold.read_text(encoding="utf-8"))
+    if args.record:
+        api_key = os.getenv("OPENROUTER_API_KEY")
+        if not api_key:
+            sys.exit("Для --record нужен OPENROUTER_API_KEY")
+        respond = Recorder(args.record.resolve(), BASE_URL, api_key, MODEL)
+    elif args.replay:
+        respond = Replay(args.replay)
+    else:
+        respond = scripted(gold)
+    agent_module.SQL_CANDIDATES = args.candidates
+
+    cwd = os.getcwd()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        # Агент, кэш вопросов и индекс терминов работают с относительным db/ — вся фикстура во временной папке
+        os.chdir(tmp)
+        try:
+            start = time.perf_counter()
+            write_fixture(Path(tmp) / "data", args.patients, args.prescriptions)
+            with redirect_stdout(StringIO()):
+                setup_db.full_rebuild(Path(DB_PATH), Path(tmp) / "data")
+            print(f"Фикстура: {args.patients:,} пациентов, {args.prescriptions:,} рецептов, "
+                  f"{time.perf_counter() - start:.1f} сек")
+
+            expected = {}
+            for q in gold:
+                df, error = get_pool(DB_PATH).execute(q["sql"], limit=None, use_cache=False)
+                if error:
+                    sys.exit(f"Эталонный SQL {q['id']} не выполняется: {error}")
+                expected[q["id"]] = df
+
+            mock = MockLLM(respond, latency=args.llm_latency).start()
+            with redirect_stdout(StringIO()):
+                agent = agent_module.OpenRouterSQLAgent("sk-mock")
+            # Свой клиент на заглушку, без лимитов провайдера: меряем агента, а не ограничитель
+            agent.llm = LLMClient("sk-mock", base_url=mock.base_url, limiter=RateLimiter(rpm=10**6, tpm=10**9))
+            for run in range(args.repeat):
+                for q in gold:
+                    agent.sql_cache.invalidate(q["question"], "")  # каждый прогон холодный: SQL пишет «модель»
+                    result = ask(agent, q["question"])
+                    result.update(id=q["id"], run=run, correct=same_result(expected[q["id"]], result["df"]))
+                    results.append(result)
+            mock.stop()
+        finally:
+            os.chdir(cwd)
+
+    # По вопросам: медиана по прогонам
+    print(f"\nLLM: {'запись' if args.record else 'replay' if args.replay else 'сценарий'}, "
+          f"задержка {args.llm_latency * 1000:.0f} мс, кандидатов SQL: {args.candidates}, прогонов: {args.repeat}\n")
+    print(f"{'вопрос':<7} {'верно':>6} {'повторов':>9} {'токенов':>8} "
+          + " ".join(f"{title + ', мс':>14}" for title in STAGES.values()))
+    for q in gold:
+        runs = [r for r in results if r["id"] == q["id"]]
+        verdict = f"{sum(r['correct'] for r in runs)}/{len(runs)}"
+        timings = [statistics.median(r["marks"].get(stage, float("nan")) for r in runs) for stage in STAGES]
+        print(f"{q['id']:<7} {verdict:>6} {statistics.mean(r['retries'] for r in runs):>9.1f} "
+              f"{statistics.mean(r['tokens'] for r in runs):>8.0f} " + " ".join(f"{t:>14.0f}" for t in timings))
+
+    summary = {"questions": len(results), "accuracy": sum(r["correct"] for r in results) / len(results),
+               "retries_per_question": statistics.mean(r["retries"] for r in results),
+               "tokens_per_question": statistics.mean(r["tokens"] for r in results), "stages": {}}
+    print(f"\n{'этап':<12} {'p50, мс':>9} {'p95, мс':>9} {'макс, мс':>9}")
+    for stage, title in STAGES.items():
+        values = [r["marks"][stage] for r in results if stage in r["marks"]]
+        summary["stages"][stage] = {"p50_ms": percentile(values, 0.5), "p95_ms": percentile(values, 0.95),
+                                    "max_ms": max(values, default=0.0)}
+        print(f"{title:<12} {percentile(values, 0.5):>9.0f} {percentile(values, 0.95):>9.0f} {max(values, default=0):>9.0f}")
+    print(f"\nВерных ответов: {summary['accuracy']:.0%} · повторов SQL на вопрос: {summary['retries_per_question']:.2f} · "
+          f"токенов на вопрос: {summary['tokens_per_question']:.0f}")
+    failed = sorted({r["id"] for r in results if not r["correct"]})
+    if failed:
+        print(f"Неверно: {', '.join(failed)}")
+    if args.report:
+        args.report.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    # Пороги для проверки изменений производительности
+    problems = []
+    if args.min_accuracy is not None and summary["accuracy"] < args.min_accuracy:
+        problems.append(f"точность {summary['accuracy']:.0%} < {args.min_accuracy:.0%}")
+    if args.max_p95_ms is not None and summary["stages"]["total"]["p95_ms"] > args.max_p95_ms:
+        problems.append(f"p95 ответа {summary['stages']['total']['p95_ms']:.0f} мс > {args.max_p95_ms:.0f} мс")
+    if problems:
+        sys.exit("❌ " + "; ".join(problems))
+
+
+if __name__ == "__main__":
+    main()
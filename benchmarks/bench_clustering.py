@@ -0,0 +1,114 @@
+# benchmarks/bench_clustering.py
+# Рецепты в порядке поступления CSV vs кластеризованные по (период, диагноз, дата_рецепта).
+# Для типовых фильтров по окну дат и префиксу МКБ: время, прочитанные строки (профайлер DuckDB)
+# и сколько групп строк можно пропустить по min/max (scripts_db/storage_report.py).
+# Запуск из корня проекта: python benchmarks/bench_clustering.py --data-dir data
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import duckdb
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+
+def load_script(name: str):
+    # скрипты из scripts_db/ не пакет (а 01_setup_db ещё и начинается с цифры)
+    spec = importlib.util.spec_from_file_location(name.lstrip("0123456789_"), PROJECT_ROOT / "scripts_db" / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+setup_db = load_script("01_setup_db")
+storage_report = load_script("storage_report")
+
+# (название, WHERE, (колонка, low, high) для оценки пропуска по min/max или None)
+QUERIES = [
+    ("месяц (диапазон дат)",
+     "дата_рецепта >= '2023-03-01' AND дата_рецепта < '2023-04-01'",
+     ("дата_рецепта", "2023-03-01", "2023-04-01")),
+    ("квартал (диапазон дат)",
+     "дата_рецепта >= '2023-10-01' AND дата_рецепта < '2024-01-01'",
+     ("дата_рецепта", "2023-10-01", "2024-01-01")),
+    ("месяц через strftime",
+     "strftime(дата_рецепта, '%Y-%m') = '2023-03'",
+     None),
+    ("ОРВИ J00-J06 (диапазон кодов)",
+     "код_диагноза >= 'J00' AND код_диагноза < 'J07'",
+     ("код_диагноза", "J00", "J07")),
+    ("ОРВИ J00-J06 (ILIKE)",
+     "код_диагноза ILIKE 'J0[0-6]%'",
+     None),
+    ("ОРВИ за месяц",
+     "дата_рецепта >= '2023-03-01' AND дата_рецепта < '2023-04-01' AND код_диагноза >= 'J00' AND код_диагноза < 'J07'",
+     ("дата_рецепта", "2023-03-01", "2023-04-01")),
+]
+
+
+def rows_scanned(con, sql: str, profile: str) -> int:
+    con.execute("PRAGMA enable_profiling = 'json'")
+    con.execute(f"PRAGMA profiling_output = '{profile}'")
+    con.execute(sql).fetchall()
+    con.execute("PRAGMA disable_profiling")
+    with open(profile, encoding="utf-8") as f:
+        return json.load(f)["cumulative_rows_scanned"]
+
+
+def timeit(con, sql: str, repeat: int) -> float:
+    con.execute(sql).fetchall()  # прогрев
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        con.execute(sql).fetchall()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data-dir", type=Path, default=setup_db.DATA_DIR)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        con = duckdb.connect(os.path.join(tmp, "bench.duckdb"))
+        source = setup_db.prescriptions_select(args.data_dir)
+        con.execute(f"CREATE TABLE arrival AS {source}")
+        con.execute(f"CREATE TABLE clustered AS {source} ORDER BY {setup_db.cluster_order('код_диагноза')}")
+        con.execute("CHECKPOINT")  # без него статистики групп строк ещё нет в файле
+
+        groups = {t: storage_report.row_groups(con, t, ["дата_рецепта", "код_диагноза"]) for t in ("arrival", "clustered")}
+        total = len(groups["arrival"])
+        print(f"Групп строк: {total}; перекрытие min/max (1.0 — идеально):")
+        for table, g in groups.items():
+            print(f"   {table:<10} дата_рецепта {storage_report.overlap(g, 'дата_рецепта'):.1f}, "
+                  f"код_диагноза {storage_report.overlap(g, 'код_диагноза'):.1f}")
+        print()
+
+        profile = os.path.join(tmp, "profile.json")
+        print(f"{'запрос':<32} {'CSV, мс':>8} {'кластер, мс':>12} {'строк CSV':>10} {'строк кластер':>14} {'пропуск групп':>14}")
+        for name, where, bounds in QUERIES:
+            sql = "SELECT COUNT(*) FROM {} WHERE " + where
+            old_ms = timeit(con, sql.format("arrival"), args.repeat)
+            new_ms = timeit(con, sql.format("clustered"), args.repeat)
+            old_rows = rows_scanned(con, sql.format("arrival"), profile)
+            new_rows = rows_scanned(con, sql.format("clustered"), profile)
+            if bounds:
+                skipped = "/".join(str(storage_report.skippable(groups[t], *bounds)) for t in ("arrival", "clustered"))
+                skipped = f"{skipped} из {total}"
+            else:
+                skipped = "нельзя"  # функция от колонки: min/max не применимы
+            print(f"{name:<32} {old_ms:>8.1f} {new_ms:>12.1f} {old_rows:>10,} {new_rows:>14,} {skipped:>14}")
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# benchmarks/bench_dashboard.py
+# Один рендер вкладки «Дашборд»: старые GROUP BY к базе (без кэша результатов) vs срезы куба в памяти.
+# Срез куба — первый вызов и повторный (из кэша срезов: так работает смена значения в другом виджете).
+# Плюс точность HyperLogLog: уникальные пациенты по классу и полу против COUNT(DISTINCT).
+# Запуск из корня проекта: python benchmarks/bench_dashboard.py --db db/medinsight.duckdb
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from sql_executor import get_pool
+from dashboard_cube import get_dashboard_cube
+
+# Запросы прежнего дашборда (load_dashboard_data + блоки статистики заболеваний)
+QUERIES = {
+    "пол": "SELECT пол, COUNT(*) as count FROM patients GROUP BY пол",
+    "возраст": "SELECT date_diff('year', дата_рождения, CURRENT_DATE) as age FROM patients WHERE дата_рождения IS NOT NULL",
+    "районы": "SELECT район_проживания, COUNT(*) as count FROM patients WHERE район_проживания IS NOT NULL GROUP BY 1 ORDER BY count DESC",
+    "сезонность": "SELECT strftime(дата_рецепта, '%Y-%m') as month_year, COUNT(*) as cases FROM prescriptions GROUP BY 1 ORDER BY 1",
+    "топ-20 классов": "SELECT класс_заболевания, COUNT(*) AS cases FROM prescriptions p JOIN diagnoses d ON p.код_диагноза = d.код_мкб GROUP BY 1 ORDER BY cases DESC LIMIT 20",
+    "диагнозы класса": "SELECT d.название_диагноза, COUNT(*) AS cnt FROM prescriptions p JOIN diagnoses d ON p.код_диагноза = d.код_мкб WHERE d.класс_заболевания = ? GROUP BY 1 ORDER BY cnt DESC",
+    "пол × класс": "SELECT d.класс_заболевания, pa.пол, COUNT(DISTINCT p.id_пациента) AS patients FROM prescriptions p JOIN patients pa ON p.id_пациента = pa.id_пациента JOIN diagnoses d ON p.код_диагноза = d.код_мкб GROUP BY 1, 2",
+    "стоимость на пациента": "SELECT disease_group, avg_cost_per_patient FROM insight_cost_by_disease ORDER BY 2 DESC LIMIT 10",
+}
+
+
+def slices(cube, cls: str) -> dict:
+    return {
+        "пол": lambda: cube.patients(["sex"]),
+        "возраст": lambda: cube.patients(["age"]),
+        "районы": lambda: cube.patients(["district"]),
+        "сезонность": lambda: cube.prescriptions(["month"]),
+        "топ-20 классов": lambda: cube.prescriptions(["disease_class"]).nlargest(20, "prescriptions"),
+        "диагнозы класса": lambda: cube.diagnoses(disease_class=cls),
+        "пол × класс": lambda: cube.distinct_patients(["disease_class", "sex"]),
+        "стоимость на пациента": lambda: cube.prescriptions(["disease_class"]).merge(
+            cube.distinct_patients(["disease_class"]), on="disease_class"),
+    }
+
+
+def timeit(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default="db/medinsight.duckdb")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pool = get_pool(args.db)
+
+    def run(sql, params=None):
+        df, error = pool.execute(sql, limit=None, use_cache=False, params=params)
+        if error:
+            raise RuntimeError(error)
+        return df
+
+    start = time.perf_counter()
+    cube, error = get_dashboard_cube(args.db)
+    if error:
+        sys.exit(error)
+    stats = cube.stats()
+    print(f"Куб: {stats['cells']:,} ячеек, {stats['registers']:,} HLL-регистров, "
+          f"{stats['bytes'] / 2**20:.1f} МБ, загрузка {time.perf_counter() - start:.2f} сек\n")
+
+    cls = str(cube.prescriptions(["disease_class"]).nlargest(1, "prescriptions")["disease_class"].iloc[0])
+    cube_slices = slices(cube, cls)
+    totals = [0.0, 0.0, 0.0]
+    print(f"{'график':<24} {'SQL, мс':>9} {'куб, мс':>9} {'повтор, мс':>11}")
+    for name, sql in QUERIES.items():
+        timings = (
+            timeit(lambda: run(sql, [cls] if "?" in sql else None), args.repeat),
+            timeit(cube_slices[name], 1),
+            timeit(cube_slices[name], args.repeat),
+        )
+        totals = [t + x for t, x in zip(totals, timings)]
+        print(f"{name:<24} {timings[0]:>9.1f} {timings[1]:>9.1f} {timings[2]:>11.2f}")
+    print(f"{'весь дашборд':<24} {totals[0]:>9.1f} {totals[1]:>9.1f} {totals[2]:>11.2f}")
+
+    # Точность уникальных пациентов по скетчам
+    exact = run(QUERIES["пол × класс"]).rename(columns={"класс_заболевания": "disease_class", "пол": "sex"})
+    estimate = cube.distinct_patients(["disease_class", "sex"]).astype({"disease_class": str, "sex": str})
+    merged = exact.astype({"disease_class": str, "sex": str}).merge(estimate, on=["disease_class", "sex"], suffixes=("", "_hll"))
+    errors = (merged["patients_hll"] / merged["patients"] - 1).abs()
+    print(f"\nHLL, пациенты по классу и полу: {len(merged)} групп, ошибка средняя {errors.mean():.2%}, макс. {errors.max():.2%}")
+
+
+if __name__ == "__main__":
+    main()
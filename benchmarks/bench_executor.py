@@ -0,0 +1,82 @@
+# benchmarks/bench_executor.py
+# Сравнение: старый путь (subprocess + run_sql_safe.py + answer.csv) vs пул соединений в процессе.
+# Колонка «пул» — без кэша результатов (каждый повтор выполняется), «кэш» — повтор из result_cache.
+# Запуск из корня проекта: python benchmarks/bench_executor.py --repeat 5
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from sql_executor import DuckDBPool
+
+RUNNER_SCRIPT = PROJECT_ROOT / "scripts_db" / "run_sql_safe.py"
+
+QUERIES = [
+    "SELECT пол, COUNT(*) as count FROM patients GROUP BY пол",
+    "SELECT \"Торговое название\", стоимость FROM drugs ORDER BY стоимость DESC LIMIT 5",
+    "SELECT strftime(дата_рецепта, '%Y-%m') as month, COUNT(*) as cnt FROM prescriptions GROUP BY month ORDER BY month",
+    "SELECT d.класс_заболевания, COUNT(*) AS cases FROM prescriptions p JOIN diagnoses d ON p.код_диагноза = d.код_мкб GROUP BY 1 ORDER BY cases DESC",
+]
+
+def run_subprocess(sql: str, workdir: Path):
+    """Старый путь агента: request.sql -> новый интерпретатор -> answer.csv -> pd.read_csv"""
+    (workdir / "request.sql").write_text(sql, encoding="utf-8")
+    result = subprocess.run(
+        [sys.executable, str(RUNNER_SCRIPT), "request.sql"],
+        cwd=workdir, capture_output=True, text=True, timeout=30
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    return pd.read_csv(workdir / "answer.csv")
+
+def timeit(fn, repeat: int) -> list:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # run_sql_safe.py всегда читает db/medinsight.duckdb относительно себя
+    db_path = str(PROJECT_ROOT / "db" / "medinsight.duckdb")
+    pool = DuckDBPool(db_path)
+
+    print(f"{'запрос':<60} {'subprocess, мс':>15} {'пул, мс':>10} {'ускорение':>10} {'кэш, мс':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        for sql in QUERIES:
+            old = timeit(lambda: run_subprocess(sql, workdir), args.repeat)
+
+            def run_pool(use_cache: bool):
+                df, error = pool.execute(sql, use_cache=use_cache)
+                if error:
+                    raise RuntimeError(error)
+            new = timeit(lambda: run_pool(False), args.repeat)
+            run_pool(True)  # прогрев кэша: дальше повторы — попадания
+            cached = timeit(lambda: run_pool(True), args.repeat)
+
+            old_ms, new_ms, cached_ms = statistics.median(old), statistics.median(new), statistics.median(cached)
+            print(f"{sql[:58]:<60} {old_ms:>15.1f} {new_ms:>10.1f} {old_ms / new_ms:>9.1f}x {cached_ms:>10.2f}")
+
+        # Типы колонок: CSV теряет их, пул — нет
+        sql = "SELECT дата_рецепта, код_препарата FROM prescriptions LIMIT 5"
+        print("\nТипы колонок (subprocess):", dict(run_subprocess(sql, workdir).dtypes.astype(str)))
+        print("Типы колонок (пул):       ", dict(pool.execute(sql)[0].dtypes.astype(str)))
+
+    pool.close()
+
+if __name__ == "__main__":
+    main()
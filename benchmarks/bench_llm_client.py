@@ -0,0 +1,84 @@
+# benchmarks/bench_llm_client.py
+# Общий LLM-клиент против локальной заглушки (сеть не нужна): переиспользование соединений,
+# очередь с приоритетами под всплеском (фоновые кандидаты vs интерактивный анализ) и общая пауза на 429.
+# Запуск из корня проекта: python benchmarks/bench_llm_client.py --background 30 --interactive 5 --rpm 120
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+
+from langchain_core.messages import HumanMessage
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from llm_client import LLMClient, RateLimiter
+from mock_llm import MockLLM
+
+
+def burst(client: LLMClient, background: int, interactive: int):
+    """Все фоновые заявки приходят раньше интерактивных — и всё равно должны их пропустить"""
+    def call(lane, i):
+        if lane == "interactive":
+            "".join(client.stream([HumanMessage(f"Проанализируй результат {i}")], lane=lane))
+        else:
+            client.invoke([HumanMessage(f"Сгенерируй SQL-кандидат {i}")], lane=lane)
+
+    threads = [threading.Thread(target=call, args=("background", i)) for i in range(background)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    late = [threading.Thread(target=call, args=("interactive", i)) for i in range(interactive)]
+    for t in late:
+        t.start()
+    for t in threads + late:
+        t.join()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--background", type=int, default=30)
+    parser.add_argument("--interactive", type=int, default=5)
+    parser.add_argument("--rpm", type=int, default=120)
+    parser.add_argument("--in-flight", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.1)
+    args = parser.parse_args()
+
+    # 1. Последовательные вызовы: сколько TCP-соединений открыто
+    mock = MockLLM(latency=0.01).start()
+    client = LLMClient("sk-mock", base_url=mock.base_url, limiter=RateLimiter(rpm=6000, tpm=10**7))
+    for i in range(20):
+        client.invoke([HumanMessage(f"вопрос {i}")])
+    print(f"Keep-alive: {mock.requests} запросов через {len(mock.connections)} соединений")
+    mock.stop()
+
+    # 2. Всплеск: фоновые заявки в очереди раньше интерактивных
+    mock = MockLLM(latency=args.latency).start()
+    client = LLMClient("sk-mock", base_url=mock.base_url,
+                       limiter=RateLimiter(rpm=args.rpm, tpm=10**7, max_in_flight=args.in_flight))
+    client.limiter._requests = args.in_flight  # без накопленного запаса: сразу упираемся в лимит
+    start = time.perf_counter()
+    burst(client, args.background, args.interactive)
+    print(f"\nВсплеск: {args.background} фоновых + {args.interactive} интерактивных, "
+          f"RPM {args.rpm}, одновременно {args.in_flight}: {time.perf_counter() - start:.1f} сек")
+    print(f"{'полоса':<12} {'запросов':>9} {'ожидание сред., мс':>19} {'p95, мс':>9} {'токенов':>8}")
+    for lane, m in client.stats()["lanes"].items():
+        if m["requests"]:
+            print(f"{lane:<12} {m['requests']:>9} {m['avg_wait_ms']:>19.0f} {m['p95_wait_ms']:>9.0f} {m['tokens']:>8}")
+    mock.stop()
+
+    # 3. Провайдер отвечает 429 на каждый 7-й запрос: общая пауза вместо ретраев каждого вызова
+    mock = MockLLM(latency=0.01, rate_limit_every=7).start()
+    client = LLMClient("sk-mock", base_url=mock.base_url, limiter=RateLimiter(rpm=6000, tpm=10**7))
+    start = time.perf_counter()
+    burst(client, 15, 0)
+    stats = client.stats()["lanes"]["background"]
+    print(f"\n429: {mock.rate_limited} отказов, {stats['requests'] - stats['errors']} успешных вызовов, "
+          f"{time.perf_counter() - start:.1f} сек")
+    mock.stop()
+
+
+if __name__ == "__main__":
+    main()
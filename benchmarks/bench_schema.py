@@ -0,0 +1,58 @@
+# benchmarks/bench_schema.py
+# Размер схемы в промпте: полная get_smart_schema vs SchemaSelector на фиксированном наборе вопросов.
+# Запуск из корня проекта: python benchmarks/bench_schema.py
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from agent import DB_PATH, MY_RELATIONSHIPS, TABLE_DESCRIPTIONS, get_smart_schema
+from schema_selector import SchemaSelector
+
+QUESTIONS = [
+    "Топ 5 дорогих лекарств",
+    "Динамика заболеваемости гриппом по месяцам",
+    "В каком районе больше всего пациентов с диабетом?",
+    "Сколько рецептов выписано женщинам старше 60 лет?",
+    "Средняя стоимость лечения по группам болезней",
+    "Какие препараты чаще всего назначают в Выборгском районе?",
+    "Разница между мужчинами и женщинами по болезням сердца",
+    "Сколько всего пациентов в базе?",
+]
+
+# Схема входит в system prompt трёх вызовов: generate, fix error, fix empty
+SCHEMA_CALLS_PER_QUESTION = 3
+
+def count_tokens(text: str) -> int:
+    try:
+        import tiktoken
+        return len(tiktoken.get_encoding("cl100k_base").encode(text))
+    except Exception:
+        # Нет tiktoken или словаря (офлайн) — грубая оценка для кириллицы
+        return len(text) // 3
+
+def main():
+    full_schema = get_smart_schema(DB_PATH, MY_RELATIONSHIPS)
+    full_tokens = count_tokens(full_schema)
+    selector = SchemaSelector(DB_PATH, MY_RELATIONSHIPS, TABLE_DESCRIPTIONS)
+    selector.build("прогрев")  # профили таблиц строятся один раз на версию базы
+
+    print(f"{'вопрос':<60} {'до':>6} {'после':>6} {'экономия':>9} {'мс':>6}")
+    total_before = total_after = 0
+    for question in QUESTIONS:
+        start = time.perf_counter()
+        compact = selector.build(question)
+        elapsed = (time.perf_counter() - start) * 1000
+        tokens = count_tokens(compact)
+        total_before += full_tokens
+        total_after += tokens
+        print(f"{question[:58]:<60} {full_tokens:>6} {tokens:>6} {1 - tokens / full_tokens:>8.0%} {elapsed:>6.1f}")
+
+    print(f"\nИтого токенов схемы на {len(QUESTIONS)} вопросов (x{SCHEMA_CALLS_PER_QUESTION} вызова LLM): "
+          f"{total_before * SCHEMA_CALLS_PER_QUESTION} -> {total_after * SCHEMA_CALLS_PER_QUESTION} "
+          f"({1 - total_after / total_before:.0%} меньше)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# benchmarks/bench_storage.py
+# Схема хранения: старая (VARCHAR-коды в рецептах) vs компактная (целочисленные ключи + ENUM).
+# Собирает обе базы из одних и тех же CSV во временной папке и сравнивает размер файла и время запросов.
+# Запуск из корня проекта: python benchmarks/bench_storage.py --data-dir data --repeat 5
+import argparse
+import importlib.util
+import os
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+
+import duckdb
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import db_snapshot
+
+# 01_setup_db.py не импортируется обычным import (имя начинается с цифры)
+_spec = importlib.util.spec_from_file_location("setup_db", PROJECT_ROOT / "scripts_db" / "01_setup_db.py")
+setup_db = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(setup_db)
+
+# Набор запросов дашборда и типовых JOIN агента: (название, SQL старой схемы, SQL компактной схемы)
+QUERIES = [
+    ("пол пациентов",
+     "SELECT пол, COUNT(*) FROM patients GROUP BY пол",
+     "SELECT пол, COUNT(*) FROM patients GROUP BY пол"),
+    ("пациенты по районам",
+     "SELECT район_проживания, COUNT(*) AS c FROM patients WHERE район_проживания IS NOT NULL GROUP BY 1 ORDER BY c DESC",
+     "SELECT район_проживания, COUNT(*) AS c FROM patients WHERE район_проживания IS NOT NULL GROUP BY 1 ORDER BY c DESC"),
+    ("сезонность",
+     "SELECT strftime(дата_рецепта, '%Y-%m') AS m, COUNT(*) FROM prescriptions GROUP BY m ORDER BY m",
+     "SELECT strftime(дата_рецепта, '%Y-%m') AS m, COUNT(*) FROM prescriptions_fact GROUP BY m ORDER BY m"),
+    ("классы заболеваний",
+     "SELECT класс_заболевания, COUNT(*) AS c FROM prescriptions p JOIN diagnoses d ON p.код_диагноза = d.код_мкб GROUP BY 1 ORDER BY c DESC LIMIT 20",
+     "SELECT класс_заболевания, COUNT(*) AS c FROM prescriptions_fact p JOIN diagnoses d ON p.diagnosis_key = d.diagnosis_key GROUP BY 1 ORDER BY c DESC LIMIT 20"),
+    ("рецепты по районам",
+     "SELECT pa.район_проживания, COUNT(*) FROM prescriptions p JOIN patients pa ON p.id_пациента = pa.id_пациента GROUP BY 1",
+     "SELECT pa.район_проживания, COUNT(*) FROM prescriptions_fact p JOIN patients pa ON p.patient_key = pa.patient_key GROUP BY 1"),
+    ("затраты по препаратам",
+     "SELECT dr.\"Торговое название\", SUM(dr.стоимость) AS s FROM prescriptions p JOIN drugs dr ON p.код_препарата = dr.код_препарата GROUP BY 1 ORDER BY s DESC LIMIT 10",
+     "SELECT dr.\"Торговое название\", SUM(dr.стоимость) AS s FROM prescriptions_fact p JOIN drugs dr ON p.drug_key = dr.drug_key GROUP BY 1 ORDER BY s DESC LIMIT 10"),
+    ("три JOIN: пол x класс x стоимость",
+     "SELECT pa.пол, d.класс_заболевания, SUM(dr.стоимость) FROM prescriptions p JOIN patients pa ON p.id_пациента = pa.id_пациента "
+     "JOIN diagnoses d ON p.код_диагноза = d.код_мкб JOIN drugs dr ON p.код_препарата = dr.код_препарата GROUP BY 1, 2",
+     "SELECT pa.пол, d.класс_заболевания, SUM(dr.стоимость) FROM prescriptions_fact p JOIN patients pa ON p.patient_key = pa.patient_key "
+     "JOIN diagnoses d ON p.diagnosis_key = d.diagnosis_key JOIN drugs dr ON p.drug_key = dr.drug_key GROUP BY 1, 2"),
+]
+
+
+def build(db_path: Path, data_dir: Path, legacy: bool) -> str:
+    with redirect_stdout(StringIO()):
+        setup_db.full_rebuild(db_path, data_dir, legacy=legacy)
+    return db_snapshot.resolve(db_path)
+
+
+def timeit(con, sql: str, repeat: int) -> float:
+    con.execute(sql).fetchall()  # прогрев
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        con.execute(sql).fetchall()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data-dir", type=Path, default=setup_db.DATA_DIR)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_file = build(Path(tmp) / "legacy.duckdb", args.data_dir, legacy=True)
+        keyed_file = build(Path(tmp) / "keyed.duckdb", args.data_dir, legacy=False)
+
+        legacy_mb = os.path.getsize(legacy_file) / 2**20
+        keyed_mb = os.path.getsize(keyed_file) / 2**20
+        print(f"Размер файла: {legacy_mb:.1f} МБ -> {keyed_mb:.1f} МБ ({keyed_mb / legacy_mb - 1:+.0%})\n")
+
+        legacy = duckdb.connect(legacy_file, read_only=True)
+        keyed = duckdb.connect(keyed_file, read_only=True)
+        print(f"{'запрос':<36} {'старая, мс':>11} {'ключи, мс':>10} {'ускорение':>10} {'через view, мс':>15}")
+        for name, legacy_sql, keyed_sql in QUERIES:
+            old = timeit(legacy, legacy_sql, args.repeat)
+            new = timeit(keyed, keyed_sql, args.repeat)
+            # Старый SQL агента на новой базе (совместимое представление prescriptions)
+            compat = timeit(keyed, legacy_sql, args.repeat)
+            print(f"{name:<36} {old:>11.1f} {new:>10.1f} {old / new:>9.1f}x {compat:>15.1f}")
+        legacy.close()
+        keyed.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# benchmarks/bench_terms.py
+# Фильтр по диагнозу: цепочка ILIKE внутри JOIN vs IN-список кодов из индекса терминов.
+# Запуск из корня проекта: python benchmarks/bench_terms.py
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from sql_executor import DB_PATH, get_pool
+from term_index import get_term_index
+
+RUNS = 5
+# Термин вопроса -> корни, которыми LLM раньше расширял ILIKE
+CASES = {
+    "нос": ["нос", "ринит", "синусит"],
+    "грипп": ["грипп"],
+    "диабет": ["диабет", "эндокрин"],
+}
+
+
+def timed(sql: str):
+    pool = get_pool(DB_PATH)
+    best = float("inf")
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        df, error = pool.execute(sql, limit=None, use_cache=False)
+        best = min(best, time.perf_counter() - start)
+        if error:
+            raise RuntimeError(error)
+    return best * 1000, int(df.iloc[0, 0])
+
+
+def main():
+    index = get_term_index(DB_PATH)
+    start = time.perf_counter()
+    index.resolve("прогрев")
+    print(f"Построение индекса: {(time.perf_counter() - start) * 1000:.1f} мс\n")
+
+    print(f"{'термин':<10} {'ILIKE мс':>9} {'строк':>9} {'IN мс':>7} {'строк':>9} {'кодов':>6}")
+    for term, roots in CASES.items():
+        ilike = " OR ".join(f"d.название_диагноза ILIKE '%{r}%'" for r in roots)
+        ilike_sql = f"SELECT COUNT(*) FROM prescriptions p JOIN diagnoses d ON p.код_диагноза = d.код_мкб WHERE {ilike}"
+        codes = sorted(index.search("diagnoses", term))
+        in_list = ", ".join(f"'{c}'" for c in codes) or "NULL"
+        in_sql = f"SELECT COUNT(*) FROM prescriptions WHERE код_диагноза IN ({in_list})"
+
+        ilike_ms, ilike_rows = timed(ilike_sql)
+        in_ms, in_rows = timed(in_sql)
+        print(f"{term:<10} {ilike_ms:>9.1f} {ilike_rows:>9} {in_ms:>7.1f} {in_rows:>9} {len(codes):>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# benchmarks/bench_viz.py
+# Автографик большого ответа агента: время подготовки (роли колонок + прореживание), число точек,
+# сохранность выброса и повторная перерисовка из кэша спецификаций.
+# Запуск из корня проекта: python benchmarks/bench_viz.py --rows 100000 1000000
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import viz
+
+
+def series(rows: int) -> pd.DataFrame:
+    """Поминутный ряд с одним выбросом — его прореживание не должно потерять"""
+    rng = np.random.default_rng(0)
+    values = np.sin(np.arange(rows) / (rows / 50)) * 100 + rng.normal(0, 10, rows) + 500
+    values[rows // 3] = 2000
+    return pd.DataFrame({"дата_рецепта": pd.date_range("2023-01-01", periods=rows, freq="min"), "cases": values})
+
+
+def categories(rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({"код_диагноза": [f"D{i:05d}" for i in range(rows)], "cases": rng.integers(1, 1000, rows)})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'данные':<28} {'строк':>10} {'точек':>7} {'подготовка, мс':>15} {'из кэша, мс':>12} {'выброс':>7}")
+    for rows in args.rows:
+        for name, df in (("ряд, lttb", series(rows)), ("ряд, minmax", series(rows)), ("категории", categories(rows))):
+            viz.DOWNSAMPLE = "minmax" if "minmax" in name else "lttb"
+            viz._cache.clear()
+            start = time.perf_counter()
+            spec, plot_df = viz.prepare(df)
+            cold = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            viz.prepare(df)
+            warm = (time.perf_counter() - start) * 1000
+            kept = "—" if spec["kind"] != "line" else ("да" if plot_df["cases"].max() == df["cases"].max() else "нет")
+            print(f"{name:<28} {rows:>10,} {len(plot_df):>7,} {cold:>15.1f} {warm:>12.1f} {kept:>7}")
+
+
+if __name__ == "__main__":
+    main()
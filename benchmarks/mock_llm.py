@@ -0,0 +1,182 @@
+# benchmarks/mock_llm.py
+# Локальная заглушка OpenAI-совместимого API (/v1/chat/completions) для прогонов без сети:
+# фиксированная задержка, потоковые ответы (SSE), usage в ответе и 429 по расписанию.
+# Ответы — функцией от сообщений, из записи (Replay) или из настоящего API с записью (Recorder).
+# Агент и llm_client направляются на неё через OPENROUTER_BASE_URL=http://127.0.0.1:PORT/v1.
+# Запуск отдельно: python benchmarks/mock_llm.py --port 8765 --latency 0.2
+import argparse
+import hashlib
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+
+def _tokens(text: str) -> int:
+    return max(len(text) // 3, 1)
+
+
+def message_key(messages: list) -> str:
+    """Ключ записи: роли и тексты сообщений (температура и модель не учитываются)"""
+    payload = json.dumps([[m.get("role"), m.get("content")] for m in messages], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class Replay:
+    """Ответы из записанного JSONL ({"key", "text"}); на промах — fallback или ошибка"""
+
+    def __init__(self, path, fallback=None):
+        self.fallback = fallback
+        self.misses = 0
+        with open(path, encoding="utf-8") as f:
+            self.completions = {r["key"]: r["text"] for r in map(json.loads, f) if r}
+
+    def __call__(self, messages: list) -> str:
+        text = self.completions.get(message_key(messages))
+        if text is not None:
+            return text
+        self.misses += 1
+        if self.fallback is None:
+            raise KeyError("Нет записанного ответа на этот промпт (перезапишите --record)")
+        return self.fallback(messages)
+
+
+class Recorder:
+    """Проксирует запросы в настоящий API и дописывает ответы в JSONL для последующего Replay"""
+
+    def __init__(self, path, upstream: str, api_key: str, model: str):
+        self.path, self.upstream, self.model = path, upstream.rstrip("/"), model
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+        self._lock = threading.Lock()
+
+    def __call__(self, messages: list) -> str:
+        response = httpx.post(f"{self.upstream}/chat/completions", headers=self.headers, timeout=120,
+                              json={"model": self.model, "messages": messages, "temperature": 0})
+        response.raise_for_status()
+        text = response.json()["choices"][0]["message"]["content"]
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"key": message_key(messages), "text": text}, ensure_ascii=False) + "\n")
+        return text
+
+
+class MockLLM:
+    """Сервер-заглушка: respond(messages) -> текст ответа (по умолчанию SELECT 1)"""
+
+    def __init__(self, respond=None, latency: float = 0.0, rate_limit_every: int = 0, port: int = 0):
+        self.respond = respond or (lambda messages: "SELECT 1")
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every    # каждый N-й запрос получает 429 (0 — никогда)
+        self.requests = self.rate_limited = 0
+        self.connections = set()                    # (адрес, порт) клиентов: сколько TCP-соединений открыто
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # keep-alive: клиент переиспользует соединения
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: dict, headers: dict = None):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def handle(self):
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # клиент отменил запрос (проигравший кандидат гонки)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with mock._lock:
+                    mock.requests += 1
+                    mock.connections.add(self.client_address)
+                    limited = mock.rate_limit_every and mock.requests % mock.rate_limit_every == 0
+                    mock.rate_limited += bool(limited)
+                if limited:
+                    self._send(429, {"error": {"message": "Rate limit exceeded", "code": 429}}, {"Retry-After": "1"})
+                    return
+                time.sleep(mock.latency)
+                messages = request.get("messages", [])
+                try:
+                    text = mock.respond(messages)
+                except Exception as e:
+                    self._send(500, {"error": {"message": str(e), "code": 500}})
+                    return
+                usage = {"prompt_tokens": sum(_tokens(str(m.get("content", ""))) for m in messages),
+                         "completion_tokens": _tokens(text)}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+                model = request.get("model", "mock")
+                if request.get("stream"):
+                    self._stream(completion_id, model, text, usage, request.get("stream_options") or {})
+                    return
+                self._send(200, {
+                    "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+
+            def _stream(self, completion_id: str, model: str, text: str, usage: dict, options: dict):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")   # длина заранее неизвестна — конец потока = закрытие
+                self.end_headers()
+                words = text.split(" ")
+                for i, word in enumerate(words):
+                    chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": model, "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word},
+                                                          "finish_reason": "stop" if i == len(words) - 1 else None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                if options.get("include_usage"):
+                    chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": model, "choices": [], "usage": usage}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--replay", help="JSONL с записанными ответами")
+    args = parser.parse_args()
+    respond = Replay(args.replay) if args.replay else None
+    mock = MockLLM(respond, latency=args.latency, rate_limit_every=args.rate_limit_every, port=args.port).start()
+    print(f"Заглушка LLM: {mock.base_url} (Ctrl+C — остановить)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
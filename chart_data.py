@@ -0,0 +1,145 @@
+import threading
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+
+from sql_executor import DB_PATH, get_pool
+
+# --- КОНФИГУРАЦИЯ ---
+# Данные для графиков: бины гистограммы, топ-N + «Остальные» и временные корзины считаются в DuckDB,
+# наружу отдаются только готовые к отрисовке агрегаты (десятки строк вместо исходных).
+# Источник — таблица базы (запрос через общий пул) или DataFrame (например, срез куба дашборда).
+DEFAULT_BINS = 30
+OTHER_LABEL = "Остальные"
+TIME_GRAINS = {"day", "week", "month", "quarter", "year"}
+
+
+def _quote(column: str) -> str:
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _integral(df: pd.DataFrame, column: str) -> pd.DataFrame:
+    """SUM по BIGINT приходит из DuckDB как HUGEINT -> float64; целые счётчики возвращаем целыми"""
+    if pd.api.types.is_float_dtype(df[column]) and (df[column] % 1 == 0).all():
+        df[column] = df[column].astype("int64")
+    return df
+
+
+def _arrow(df: pd.DataFrame):
+    """Строки pandas DuckDB читает поштучно, Arrow — буферами (на 1 млн строк в разы быстрее)"""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return df  # смешанные типы в колонке — читаем DataFrame как есть
+
+
+# DataFrame читается DuckDB через локальную in-memory базу
+_memory = None
+_memory_lock = threading.Lock()
+
+def _run(sql: str, source, db_path: str):
+    """(DataFrame, ошибка): {source} в SQL — таблица базы или переданный DataFrame"""
+    if not isinstance(source, pd.DataFrame):
+        return get_pool(db_path).execute(sql.format(source=source), limit=None, source="dashboard")
+    global _memory
+    with _memory_lock:
+        if _memory is None:
+            _memory = duckdb.connect()
+        con = _memory.cursor()  # у каждого вызова свой курсор: сессии Streamlit работают в разных потоках
+    try:
+        con.register("chart_source", _arrow(source))
+        return con.execute(sql.format(source="chart_source")).df(), None
+    except duckdb.Error as e:
+        return None, str(e)
+    finally:
+        con.close()
+
+
+def histogram(source, column: str, bins: int = DEFAULT_BINS, width: float = None, weight: str = None,
+              db_path: str = DB_PATH):
+    """(DataFrame[bin, bin_start, bin_end, count], ошибка) — гистограмма с равными бинами.
+
+    width — фиксированная ширина бина с началом от 0 (для целых значений вроде возраста), иначе
+    диапазон min..max делится на bins частей. weight — колонка с числом объектов в строке (для агрегатов).
+    """
+    value = _quote(column)
+    if width:
+        bin_expr = f"floor(x / {float(width)}) * {float(width)}"
+        bounds = f"SELECT {float(width)} AS width"
+    else:
+        bin_expr = f"lo + least(floor((x - lo) / width), {int(bins) - 1}) * width"
+        bounds = f"SELECT min(x) AS lo, greatest((max(x) - min(x)) / {int(bins)}, 1e-9) AS width FROM src"
+    sql = f"""
+        WITH src AS (
+            SELECT {value}::DOUBLE AS x, {_quote(weight) if weight else 1} AS w
+            FROM {{source}} WHERE {value} IS NOT NULL
+        ),
+        bounds AS ({bounds})
+        SELECT {bin_expr} AS bin_start, {bin_expr} + width AS bin_end, SUM(w) AS count
+        FROM src, bounds
+        GROUP BY ALL
+        ORDER BY bin_start
+    """
+    df, error = _run(sql, source, db_path)
+    if error:
+        return None, error
+    df["bin"] = [f"{s:g}–{e:g}" for s, e in zip(df["bin_start"], df["bin_end"])]
+    return _integral(df, "count")[["bin", "bin_start", "bin_end", "count"]], None
+
+
+def top_n(source, label: str, value: str = None, n: int = 10, other_label: str = OTHER_LABEL,
+          db_path: str = DB_PATH):
+    """(DataFrame[label, value, доля], ошибка) — n крупнейших значений и строка «Остальные».
+
+    value — колонка, которую суммируем (по умолчанию считаем строки). other_label может содержать {},
+    туда подставится число свёрнутых значений. доля — процент от общего итога.
+    """
+    name, amount = _quote(label), _quote(value or "count")
+    # Топ — через ORDER BY ... LIMIT (куча на n строк), а не оконную сортировку всех значений
+    sql = f"""
+        WITH totals AS MATERIALIZED (
+            SELECT {name} AS label, {f"SUM({_quote(value)})" if value else "COUNT(*)"} AS amount
+            FROM {{source}}
+            GROUP BY 1
+        ),
+        top AS MATERIALIZED (
+            SELECT label, amount FROM totals ORDER BY amount DESC, label LIMIT {int(n)}
+        ),
+        summary AS (
+            SELECT SUM(amount) AS total, COUNT(*) AS labels FROM totals
+        )
+        SELECT label AS {name}, amount AS {amount}, round(amount * 100.0 / total, 2) AS доля,
+               1 AS members, row_number() OVER (ORDER BY amount DESC, label) AS rank
+        FROM top, summary
+        UNION ALL
+        SELECT NULL, total - rest.amount, round((total - rest.amount) * 100.0 / total, 2),
+               labels - rest.members, {int(n) + 1}
+        FROM summary, (SELECT COALESCE(SUM(amount), 0) AS amount, COUNT(*) AS members FROM top) AS rest
+        WHERE labels > rest.members
+        ORDER BY rank
+    """
+    df, error = _run(sql, source, db_path)
+    if error:
+        return None, error
+    others = df["rank"] > n
+    if others.any():
+        df[label] = df[label].astype(object)
+        df.loc[others, label] = other_label.format(int(df.loc[others, "members"].iloc[0]))
+    return _integral(df, value or "count").drop(columns=["members", "rank"]), None
+
+
+def time_buckets(source, column: str, grain: str = "month", value: str = None, db_path: str = DB_PATH):
+    """(DataFrame[bucket, value], ошибка) — сумма value (или число строк) по периодам date_trunc(grain)"""
+    if grain not in TIME_GRAINS:
+        return None, f"Неизвестный период {grain!r} (есть: {', '.join(sorted(TIME_GRAINS))})"
+    amount = _quote(value or "count")
+    sql = f"""
+        SELECT date_trunc('{grain}', {_quote(column)}) AS bucket,
+               {f"SUM({_quote(value)})" if value else "COUNT(*)"} AS {amount}
+        FROM {{source}}
+        WHERE {_quote(column)} IS NOT NULL
+        GROUP BY 1
+        ORDER BY 1
+    """
+    return _run(sql, source, db_path)
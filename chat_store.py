@@ -0,0 +1,237 @@
+import io
+import os
+import re
+import time
+import uuid
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# --- КОНФИГУРАЦИЯ ---
+# Чаты агента живут в SQLite (переживают перезапуск), таблицы ответов — там же в Parquet.
+# В памяти сессии держатся только открытые таблицы, и не больше FRAME_CACHE_MB (LRU).
+STORE_PATH = os.getenv("CHAT_STORE_PATH", "db/chat_store.sqlite")
+FRAME_CACHE_MB = int(os.getenv("CHAT_FRAME_CACHE_MB", "64"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id    TEXT PRIMARY KEY,
+    name       TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    owner      TEXT NOT NULL DEFAULT ''  -- чей чат: хранилище общее на процесс, сессии видят только свои
+);
+CREATE TABLE IF NOT EXISTS messages (
+    message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id    TEXT NOT NULL REFERENCES chats(chat_id) ON DELETE CASCADE,
+    role       TEXT NOT NULL,
+    content    TEXT NOT NULL,
+    frame      BLOB,              -- результат запроса в Parquet (NULL — без таблицы)
+    frame_rows INTEGER,
+    frame_bytes INTEGER,          -- размер в памяти после загрузки (для лимита кэша)
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_chat ON messages(chat_id, message_id);
+CREATE INDEX IF NOT EXISTS chats_by_owner ON chats(owner, updated_at);
+-- Поиск по тексту вопросов и ответов (unicode61 приводит к нижнему регистру и кириллицу)
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='message_id', tokenize='unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, content) VALUES (new.message_id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.message_id, old.content);
+END;
+"""
+
+
+def _to_parquet(df: pd.DataFrame) -> bytes:
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Смешанные типы в object-колонке (1 и 'b') Arrow не сводит к одному — такие колонки храним строками
+        mixed = {c: "string" for c in df.columns if df[c].dtype == object}
+        table = pa.Table.from_pandas(df.astype(mixed), preserve_index=False)
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression="zstd")
+    return buffer.getvalue()
+
+
+def _from_parquet(blob: bytes) -> pd.DataFrame:
+    return pq.read_table(io.BytesIO(blob)).to_pandas()
+
+
+class FrameCache:
+    """Загруженные таблицы ответов одной сессии: LRU по байтам"""
+
+    def __init__(self, max_bytes: int = FRAME_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._frames = OrderedDict()   # message_id -> (DataFrame, bytes)
+        self.bytes = 0
+        self.loads = self.hits = 0
+
+    def get(self, message_id: int):
+        item = self._frames.get(message_id)
+        if item is None:
+            return None
+        self._frames.move_to_end(message_id)
+        self.hits += 1
+        return item[0]
+
+    def put(self, message_id: int, df: pd.DataFrame, size: int):
+        self.loads += 1
+        if size > self.max_bytes:
+            return  # больше всего лимита — отдаём, но не держим
+        self._frames[message_id] = (df, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self._frames.popitem(last=False)
+            self.bytes -= evicted
+
+    def stats(self) -> dict:
+        return {"frames": len(self._frames), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                "loads": self.loads, "hits": self.hits}
+
+
+class ChatStore:
+    """Чаты и сообщения в SQLite; таблицы ответов читаются по одной, когда сообщение показывают.
+
+    Все операции с чатами — от имени владельца (owner): чужие чаты не видны, не ищутся и не удаляются.
+    """
+
+    def __init__(self, path: str = STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Одно соединение на процесс: сессии Streamlit работают в разных потоках, доступ — под замком
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        self._con.execute("PRAGMA journal_mode = WAL")
+        self._con.execute("PRAGMA foreign_keys = ON")
+        columns = [row[1] for row in self._con.execute("PRAGMA table_info(chats)")]
+        if columns and "owner" not in columns:
+            # Хранилище из версии без владельцев: старые чаты остаются ничьими (owner = '') и никому не видны
+            self._con.execute("ALTER TABLE chats ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+        self._con.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def _execute(self, sql: str, params=()):
+        with self._lock, self._con:
+            return self._con.execute(sql, params).fetchall()
+
+    # --- ЧАТЫ ---
+    def create_chat(self, owner: str, name: str = None) -> str:
+        chat_id = str(uuid.uuid4())[:8]
+        now = time.time()
+        with self._lock, self._con:
+            count = self._con.execute("SELECT COUNT(*) FROM chats WHERE owner = ?", (owner,)).fetchone()[0]
+            self._con.execute(
+                "INSERT INTO chats (chat_id, name, created_at, updated_at, owner) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, name or f"Чат {count + 1}", now, now, owner)
+            )
+        return chat_id
+
+    def list_chats(self, owner: str) -> list:
+        """[{chat_id, name, updated_at}] чатов владельца — последние изменённые сверху"""
+        rows = self._execute(
+            "SELECT chat_id, name, updated_at FROM chats WHERE owner = ? ORDER BY updated_at DESC", (owner,)
+        )
+        return [{"chat_id": c, "name": n, "updated_at": u} for c, n, u in rows]
+
+    def chat_exists(self, owner: str, chat_id: str) -> bool:
+        return bool(self._execute("SELECT 1 FROM chats WHERE chat_id = ? AND owner = ?", (chat_id, owner)))
+
+    def rename_chat(self, owner: str, chat_id: str, name: str):
+        self._execute("UPDATE chats SET name = ? WHERE chat_id = ? AND owner = ?", (name, chat_id, owner))
+
+    def delete_chat(self, owner: str, chat_id: str):
+        self._execute("DELETE FROM chats WHERE chat_id = ? AND owner = ?", (chat_id, owner))
+
+    # --- СООБЩЕНИЯ ---
+    def add_message(self, owner: str, chat_id: str, role: str, content: str, df: pd.DataFrame = None):
+        """message_id нового сообщения (None — чата нет или он чужой)"""
+        blob = rows = size = None
+        if df is not None and not df.empty:
+            try:
+                blob, rows, size = _to_parquet(df), len(df), int(df.memory_usage(deep=True).sum())
+            except (pa.ArrowException, ValueError, TypeError):
+                pass  # таблицу сохранить не удалось — текст ответа важнее, сообщение пишется без неё
+        now = time.time()
+        with self._lock, self._con:
+            cur = self._con.execute(
+                "INSERT INTO messages (chat_id, role, content, frame, frame_rows, frame_bytes, created_at) "
+                "SELECT chat_id, ?, ?, ?, ?, ?, ? FROM chats WHERE chat_id = ? AND owner = ?",
+                (role, content, blob, rows, size, now, chat_id, owner)
+            )
+            if not cur.rowcount:
+                return None
+            self._con.execute("UPDATE chats SET updated_at = ? WHERE chat_id = ?", (now, chat_id))
+            return cur.lastrowid
+
+    def messages(self, owner: str, chat_id: str) -> list:
+        """Сообщения чата без таблиц: [{message_id, role, content, frame_rows}]"""
+        rows = self._execute(
+            "SELECT m.message_id, m.role, m.content, m.frame_rows FROM messages m "
+            "JOIN chats c ON c.chat_id = m.chat_id WHERE m.chat_id = ? AND c.owner = ? ORDER BY m.message_id",
+            (chat_id, owner)
+        )
+        return [{"message_id": m, "role": r, "content": c, "frame_rows": n} for m, r, c, n in rows]
+
+    def frame(self, owner: str, message_id: int, cache: FrameCache = None):
+        """Таблица ответа: из кэша сессии или из Parquet в базе (None, если таблицы нет или чат чужой)"""
+        if cache is not None:
+            df = cache.get(message_id)
+            if df is not None:
+                return df
+        rows = self._execute(
+            "SELECT m.frame, m.frame_bytes FROM messages m JOIN chats c ON c.chat_id = m.chat_id "
+            "WHERE m.message_id = ? AND c.owner = ?", (message_id, owner)
+        )
+        if not rows or rows[0][0] is None:
+            return None
+        df = _from_parquet(rows[0][0])
+        if cache is not None:
+            cache.put(message_id, df, rows[0][1] or int(df.memory_usage(deep=True).sum()))
+        return df
+
+    # --- ПОИСК ---
+    def search(self, owner: str, text: str, limit: int = 20) -> list:
+        """Чаты владельца, где в вопросах или ответах есть все слова запроса (по префиксу): [{chat_id, name, snippet}]"""
+        words = re.findall(r"\w+", text.lower())
+        if not words:
+            return []
+        query = " ".join(f'"{w}"*' for w in words)
+        rows = self._execute("""
+            SELECT m.chat_id, c.name, snippet(messages_fts, 0, '**', '**', '…', 12), bm25(messages_fts) AS score
+            FROM messages_fts
+            JOIN messages m ON m.message_id = messages_fts.rowid
+            JOIN chats c ON c.chat_id = m.chat_id
+            WHERE messages_fts MATCH ? AND c.owner = ?
+            ORDER BY score
+            LIMIT ?
+        """, (query, owner, limit * 5))
+        found = {}
+        for chat_id, name, snippet, _ in rows:
+            found.setdefault(chat_id, {"chat_id": chat_id, "name": name, "snippet": snippet})
+        return list(found.values())[:limit]
+
+    def stats(self) -> dict:
+        chats, messages, frame_bytes = self._execute(
+            "SELECT (SELECT COUNT(*) FROM chats), COUNT(*), COALESCE(SUM(length(frame)), 0) FROM messages"
+        )[0]
+        return {"chats": chats, "messages": messages, "parquet_bytes": frame_bytes}
+
+
+# --- ОБЩЕЕ ХРАНИЛИЩЕ НА ПРОЦЕСС ---
+_store = None
+_store_lock = threading.Lock()
+
+def get_chat_store() -> ChatStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ChatStore()
+        return _store
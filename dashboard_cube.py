@@ -0,0 +1,190 @@
+import time
+import threading
+import functools
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from sql_executor import DB_PATH, get_pool, db_version
+
+# --- КОНФИГУРАЦИЯ ---
+# Куб собирается при загрузке данных (scripts_db/marts/dashboard_cube.sql) и читается в память один раз
+# на версию базы; графики дашборда — срезы и группировки pandas без запросов к DuckDB.
+HLL_P = 14                    # как в dashboard_cube.sql: 2^14 регистров, стандартная ошибка 1.04/√2^14 ≈ 0.81%
+REGISTERS = 1 << HLL_P
+CELL_DIMENSIONS = ["month", "district", "region", "sex", "age_group", "disease_class"]
+MEMO_SIZE = 256               # срезов в памяти куба (виджет × значение параметра)
+TABLES = {
+    "cells": "SELECT * FROM _cube_cells ORDER BY cell",
+    "sketches": "SELECT cell, register, rank FROM _cube_sketches",
+    "diagnoses": "SELECT * FROM _cube_diagnoses",
+    "patients": "SELECT * FROM _cube_patients",
+}
+
+
+def _compact(df: pd.DataFrame) -> pd.DataFrame:
+    """Строковые измерения — в category (десятки значений на сотни тысяч строк)"""
+    for column in df.select_dtypes(object).columns:
+        df[column] = df[column].astype("category")
+    return df
+
+
+def _mask(df: pd.DataFrame, filters: dict) -> np.ndarray:
+    """Фильтр вида колонка=значение или колонка=[значения]"""
+    mask = np.ones(len(df), dtype=bool)
+    for column, value in filters.items():
+        if isinstance(value, (list, tuple, set)):
+            mask &= df[column].isin(list(value)).to_numpy()
+        else:
+            mask &= (df[column] == value).to_numpy()
+    return mask
+
+
+def hll_estimate(registers: np.ndarray) -> np.ndarray:
+    """Оценка HyperLogLog числа уникальных пациентов по матрице регистров (группа × 2^HLL_P)"""
+    zeros = (registers == 0).sum(axis=1)
+    alpha = 0.7213 / (1 + 1.079 / REGISTERS)
+    raw = alpha * REGISTERS ** 2 / np.exp2(-registers.astype(float)).sum(axis=1)
+    # Мало пациентов: по числу пустых регистров оценка точнее (linear counting)
+    linear = REGISTERS * np.log(REGISTERS / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * REGISTERS) & (zeros > 0), linear, raw).round().astype(np.int64)
+
+
+def _freeze(value):
+    """Ключ кэша из аргументов среза: списки -> кортежи"""
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _memoized(method):
+    """Срез кэшируется по (метод, измерения, фильтры). Куб живёт одну версию базы, поэтому
+    кэш сбрасывается вместе с ним, а смена фильтра одного виджета не пересчитывает остальные."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **filters):
+        key = (method.__name__, _freeze(args), tuple(sorted((k, _freeze(v)) for k, v in filters.items())))
+        with self._memo_lock:
+            df = self._memo.get(key)
+            if df is not None:
+                self._memo.move_to_end(key)
+                self._memo_hits += 1
+                return df.copy()
+            self._memo_misses += 1
+        df = method(self, *args, **filters)
+        with self._memo_lock:
+            self._memo[key] = df
+            if len(self._memo) > MEMO_SIZE:
+                self._memo.popitem(last=False)
+        return df.copy()  # вызывающий код дописывает колонки — кэш не должен меняться
+    return wrapper
+
+
+class DashboardCube:
+    """Куб дашборда в памяти.
+
+    prescriptions() — рецепты и стоимость, distinct_patients() — уникальные пациенты (HLL),
+    diagnoses() — рецепты по диагнозам, patients() — демография справочника пациентов.
+    """
+
+    def __init__(self, frames: dict, version: str = None):
+        self.version = version
+        self._cells = _compact(frames["cells"])
+        self._sketches = frames["sketches"].astype({"cell": "int32", "register": "uint16", "rank": "uint8"})
+        self._diagnoses = _compact(frames["diagnoses"])
+        self._patients = _compact(frames["patients"])
+        # Строка ячейки для каждого регистра: cell — номер по порядку (1..N), ячейки загружены по порядку
+        self._sketch_rows = np.searchsorted(self._cells["cell"].to_numpy(), self._sketches["cell"].to_numpy())
+        self.loaded_at = time.time()
+        self._memo = OrderedDict()
+        self._memo_lock = threading.Lock()
+        self._memo_hits = self._memo_misses = 0
+
+    @classmethod
+    def load(cls, db_path: str = DB_PATH):
+        """(куб, ошибка): все таблицы куба из текущего снимка"""
+        version = db_version(db_path)
+        pool = get_pool(db_path)
+        frames = {}
+        for name, sql in TABLES.items():
+            # Куб читается один раз — в общий кэш результатов его не кладём
+            df, error = pool.execute(sql, limit=None, use_cache=False, guard=False, source="dashboard")
+            if error:
+                return None, (f"Куб дашборда не найден в базе ({error.splitlines()[0]}). "
+                              "Соберите его: python scripts_db/build_marts.py dashboard_cube")
+            frames[name] = df
+        return cls(frames, version), None
+
+    # --- СРЕЗЫ ---
+    @_memoized
+    def prescriptions(self, by: list, **filters) -> pd.DataFrame:
+        """Число рецептов и стоимость по измерениям by (месяц, район, регион, пол, возраст, класс)"""
+        cells = self._cells[_mask(self._cells, filters)]
+        if not by:
+            return pd.DataFrame({"prescriptions": [int(cells["prescriptions"].sum())], "cost": [cells["cost"].sum()]})
+        return cells.groupby(by, observed=True, as_index=False)[["prescriptions", "cost"]].sum()
+
+    @_memoized
+    def distinct_patients(self, by: list, **filters) -> pd.DataFrame:
+        """Уникальные пациенты по измерениям by — объединение (max) HLL-регистров выбранных ячеек"""
+        if by:
+            grouped = self._cells.groupby(by, observed=True)
+            groups = grouped.ngroup().fillna(-1).to_numpy(dtype=np.int64)  # -1 — ячейки с NULL в by
+            keys = grouped.size().reset_index()[by]
+        else:
+            groups = np.zeros(len(self._cells), dtype=np.int64)
+            keys = pd.DataFrame(index=[0])
+        cell_groups = np.where(_mask(self._cells, filters), groups, -1)[self._sketch_rows]
+        selected = cell_groups >= 0
+        registers = np.zeros((len(keys), REGISTERS), dtype=np.uint8)
+        np.maximum.at(registers, (cell_groups[selected], self._sketches["register"].to_numpy()[selected]),
+                      self._sketches["rank"].to_numpy()[selected])
+        result = keys.assign(patients=hll_estimate(registers))
+        return result[registers.any(axis=1)].reset_index(drop=True)
+
+    @_memoized
+    def diagnoses(self, by: list = ("название_диагноза",), **filters) -> pd.DataFrame:
+        """Рецепты по диагнозам (фильтры: month, disease_class, код_мкб)"""
+        by = list(by)
+        df = self._diagnoses[_mask(self._diagnoses, filters)]
+        return df.groupby(by, observed=True, as_index=False)[["prescriptions", "cost"]].sum()
+
+    def patients(self, by: list, **filters) -> pd.DataFrame:
+        """Пациенты справочника по sex / district / region / age (возраст на сегодня, как date_diff('year'))"""
+        # Без кэша: возраст зависит от текущего года, а срез пары тысяч строк и так ~1 мс
+        df = self._patients[_mask(self._patients, filters)]
+        if "age" in by:
+            df = df[df["birth_year"].notna()].assign(age=lambda d: pd.Timestamp.now().year - d["birth_year"].astype(int))
+        if not by:
+            return pd.DataFrame({"patients": [int(df["patients"].sum())]})
+        return df.groupby(list(by), observed=True, as_index=False)["patients"].sum()
+
+    def stats(self) -> dict:
+        frames = (self._cells, self._sketches, self._diagnoses, self._patients)
+        return {
+            "cells": len(self._cells),
+            "registers": len(self._sketches),
+            "bytes": sum(int(df.memory_usage(deep=True).sum()) for df in frames) + self._sketch_rows.nbytes,
+            "version": self.version,
+            "memo_entries": len(self._memo),
+            "memo_hit_rate": self._memo_hits / max(self._memo_hits + self._memo_misses, 1),
+        }
+
+
+# --- ОБЩИЙ КУБ НА ПРОЦЕСС ---
+_cubes = {}
+_cubes_lock = threading.Lock()
+
+def get_dashboard_cube(db_path: str = DB_PATH):
+    """(куб, ошибка) для текущей версии базы; после публикации нового снимка куб перечитывается"""
+    version = db_version(db_path)
+    if version is None:
+        return None, f"База данных не найдена по пути: {db_path}."
+    with _cubes_lock:
+        cube = _cubes.get(db_path)
+        if cube is not None and cube.version == version:
+            return cube, None
+        cube, error = DashboardCube.load(db_path)
+        if cube is not None:
+            _cubes[db_path] = cube
+        return cube, error
@@ -0,0 +1,94 @@
+import os
+import time
+import shutil
+from contextlib import contextmanager
+
+# --- КОНФИГУРАЦИЯ ---
+# Логический путь базы (как раньше). Если рядом есть указатель <имя>.current,
+# реальный файл — версионированный снимок из db/snapshots/, иначе сам этот файл.
+DB_PATH = "db/medinsight.duckdb"
+KEEP_SNAPSHOTS = int(os.getenv("DB_KEEP_SNAPSHOTS", "3"))  # сколько последних снимков хранить на диске
+
+
+def _layout(db_path) -> tuple:
+    """(файл-указатель, папка снимков, префикс имени снимка) для логического пути"""
+    db_path = str(db_path)
+    folder = os.path.dirname(db_path)
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    return os.path.join(folder, f"{stem}.current"), os.path.join(folder, "snapshots"), stem
+
+
+def resolve(db_path=DB_PATH) -> str:
+    """Физический файл текущей версии базы"""
+    pointer, snapshot_dir, _ = _layout(db_path)
+    try:
+        with open(pointer, "r", encoding="utf-8") as f:
+            name = f.read().strip()
+    except OSError:
+        return str(db_path)
+    snapshot = os.path.join(snapshot_dir, name)
+    # Битый указатель не должен ронять приложение — откатываемся на старый файл
+    return snapshot if name and os.path.exists(snapshot) else str(db_path)
+
+
+def new_snapshot_path(db_path=DB_PATH) -> str:
+    _, snapshot_dir, stem = _layout(db_path)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return os.path.join(snapshot_dir, f"{stem}-{stamp}-{os.getpid()}.duckdb")
+
+
+def publish(db_path, snapshot: str):
+    """Атомарно переключает указатель на готовый снимок: читатели видят либо старую, либо новую версию"""
+    pointer, _, _ = _layout(db_path)
+    tmp = f"{pointer}.tmp-{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(os.path.basename(snapshot))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, pointer)
+    prune(db_path)
+
+
+def prune(db_path=DB_PATH, keep: int = KEEP_SNAPSHOTS):
+    """Удаляет старые снимки (текущий не трогаем никогда)"""
+    _, snapshot_dir, stem = _layout(db_path)
+    current = os.path.basename(resolve(db_path))
+    try:
+        names = sorted(n for n in os.listdir(snapshot_dir) if n.startswith(stem + "-") and n.endswith(".duckdb"))
+    except OSError:
+        return
+    for name in names[:-keep] if keep > 0 else names:
+        if name == current:
+            continue
+        _remove(os.path.join(snapshot_dir, name))
+
+
+def _remove(path: str):
+    for file in (path, path + ".wal"):
+        try:
+            os.remove(file)
+        except OSError:
+            pass  # снимок ещё открыт (Windows) — удалим при следующей публикации
+
+
+@contextmanager
+def build(db_path=DB_PATH, from_current: bool = False):
+    """Сборка новой версии в отдельный файл с публикацией только при успехе.
+
+    from_current=True — начать с копии текущей версии (инкрементальные изменения, DDL витрин).
+    Живая база при этом не блокируется и не удаляется.
+    """
+    snapshot = new_snapshot_path(db_path)
+    if from_current:
+        current = resolve(db_path)
+        if os.path.exists(current):
+            shutil.copy2(current, snapshot)
+            if os.path.exists(current + ".wal"):
+                shutil.copy2(current + ".wal", snapshot + ".wal")
+    try:
+        yield snapshot
+    except BaseException:
+        _remove(snapshot)
+        raise
+    publish(db_path, snapshot)
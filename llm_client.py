@@ -0,0 +1,346 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from collections import deque
+
+import httpx
+import openai
+from langchain_openai import ChatOpenAI
+
+import tracing
+
+# --- КОНФИГУРАЦИЯ ---
+# Один клиент LLM на процесс (на API-ключ): keep-alive пул HTTP-соединений, общий на все сессии,
+# token bucket на запросы и токены в минуту и очередь с приоритетами вместо слепых ретраев на 429.
+BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")   # для заглушки: http://127.0.0.1:PORT/v1
+MODEL = os.getenv("LLM_MODEL", "meta-llama/llama-3.3-70b-instruct")
+REQUESTS_PER_MINUTE = int(os.getenv("LLM_RPM", "60"))
+TOKENS_PER_MINUTE = int(os.getenv("LLM_TPM", "200000"))
+MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))     # одновременных запросов к провайдеру
+REQUEST_TIMEOUT = 60                                        # сек (чтобы не висело 4 минуты)
+RATE_LIMIT_RETRIES = 3                                      # повторов после 429 (пауза — по Retry-After)
+EXPECTED_COMPLETION_TOKENS = 512                            # резерв под ответ, уточняется по usage
+CHARS_PER_TOKEN = 3                                         # грубая оценка для кириллицы
+
+# Полосы по приоритету: меньше — раньше. Анализ ждёт пользователь, фоновые кандидаты гонки — нет
+LANES = {"interactive": 0, "pipeline": 1, "background": 2}
+
+
+def estimate_tokens(messages) -> int:
+    return sum(len(str(m.content)) for m in messages) // CHARS_PER_TOKEN + EXPECTED_COMPLETION_TOKENS
+
+
+class _Ticket:
+    __slots__ = ("lane", "tokens", "enqueued_at", "granted")
+
+    def __init__(self, lane: str, tokens: int):
+        self.lane, self.tokens = lane, tokens
+        self.enqueued_at = time.perf_counter()
+        self.granted = False
+
+    def __lt__(self, other):
+        return False  # порядок задаёт (приоритет, номер) в куче
+
+
+class RateLimiter:
+    """Token bucket на запросы и токены в минуту + лимит одновременных запросов.
+
+    Разрешение получает только голова очереди (самая приоритетная и самая ранняя заявка),
+    поэтому фоновая работа не обгоняет интерактивную, даже когда ёмкости хватает на неё.
+    """
+
+    def __init__(self, rpm: int = REQUESTS_PER_MINUTE, tpm: int = TOKENS_PER_MINUTE, max_in_flight: int = MAX_IN_FLIGHT):
+        self.rpm, self.tpm, self.max_in_flight = rpm, tpm, max_in_flight
+        self._requests, self._tokens = float(rpm), float(tpm)   # вёдра полные на старте
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0                                 # после 429 ждут все полосы
+        self._in_flight = 0
+        self._queue = []                                         # куча (приоритет, номер, заявка)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float):
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def enqueue(self, lane: str, tokens: int) -> _Ticket:
+        if lane not in LANES:
+            raise ValueError(f"Неизвестная полоса {lane!r} (есть: {', '.join(LANES)})")
+        ticket = _Ticket(lane, min(tokens, self.tpm))  # огромный промпт не должен ждать вечно
+        with self._cond:
+            heapq.heappush(self._queue, (LANES[lane], next(self._seq), ticket))
+        return ticket
+
+    def try_grant(self, ticket: _Ticket) -> float:
+        """0 — разрешение получено, иначе сколько секунд подождать до следующей попытки"""
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self._queue[0][2] is not ticket or self._in_flight >= self.max_in_flight:
+                return 0.05  # разбудит notify при освобождении
+            if self._requests < 1 or self._tokens < ticket.tokens:
+                return max((1 - self._requests) * 60 / self.rpm, (ticket.tokens - self._tokens) * 60 / self.tpm, 0.001)
+            self._requests -= 1
+            self._tokens -= ticket.tokens
+            self._in_flight += 1
+            heapq.heappop(self._queue)
+            ticket.granted = True
+            self._cond.notify_all()  # следующая заявка стала головой очереди
+            return 0.0
+
+    def acquire(self, lane: str, tokens: int) -> _Ticket:
+        ticket = self.enqueue(lane, tokens)
+        try:
+            while (delay := self.try_grant(ticket)) > 0:
+                with self._cond:
+                    self._cond.wait(delay)
+        except BaseException:
+            self.cancel(ticket)
+            raise
+        return ticket
+
+    async def aacquire(self, lane: str, tokens: int) -> _Ticket:
+        """То же для asyncio: ждём без блокировки цикла, отмена задачи снимает заявку"""
+        ticket = self.enqueue(lane, tokens)
+        try:
+            while (delay := self.try_grant(ticket)) > 0:
+                await asyncio.sleep(min(delay, 0.05))
+        except BaseException:
+            self.cancel(ticket)
+            raise
+        return ticket
+
+    def cancel(self, ticket: _Ticket):
+        with self._cond:
+            if ticket.granted:
+                return
+            self._queue = [item for item in self._queue if item[2] is not ticket]
+            heapq.heapify(self._queue)
+            self._cond.notify_all()
+
+    def release(self, ticket: _Ticket, used_tokens: int = None):
+        """Запрос завершён: освобождаем слот и возвращаем в ведро разницу между резервом и usage"""
+        with self._cond:
+            self._in_flight -= 1
+            if used_tokens is not None:
+                self._tokens = min(self.tpm, self._tokens + ticket.tokens - used_tokens)
+            self._cond.notify_all()
+
+    def pause(self, seconds: float):
+        """429 от провайдера: останавливаем все полосы, а не только упавший запрос"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._requests = 0.0
+
+    def state(self) -> dict:
+        with self._cond:
+            self._refill(time.monotonic())
+            return {"queued": len(self._queue), "in_flight": self._in_flight,
+                    "requests_available": int(self._requests), "tokens_available": int(self._tokens),
+                    "paused_sec": max(self._paused_until - time.monotonic(), 0.0)}
+
+
+def _p95(values: list) -> float:
+    """95-й перцентиль отсортированного списка (ближайший ранг: ceil(0.95 * n))"""
+    return values[max(math.ceil(len(values) * 0.95) - 1, 0)] if values else 0.0
+
+
+def _retry_after(error: openai.RateLimitError) -> float:
+    try:
+        return float(error.response.headers.get("retry-after", 2))
+    except (AttributeError, TypeError, ValueError):
+        return 2.0
+
+
+def _usage(message) -> int:
+    usage = getattr(message, "usage_metadata", None)
+    return usage["total_tokens"] if usage else None
+
+
+# Async-клиент httpx привязан к циклу событий, а агент запускает asyncio.run на каждый вопрос,
+# поэтому общий async-пул живёт в своём фоновом цикле, а вызовы передаются туда
+_loop = None
+_loop_lock = threading.Lock()
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-client-loop", daemon=True).start()
+        return _loop
+
+
+class LLMClient:
+    """Вызовы чат-модели через общий пул соединений и ограничитель с полосами приоритета"""
+
+    def __init__(self, api_key: str, base_url: str = BASE_URL, limiter: RateLimiter = None):
+        limits = httpx.Limits(max_connections=MAX_IN_FLIGHT * 2, max_keepalive_connections=MAX_IN_FLIGHT,
+                              keepalive_expiry=120)
+        timeout = httpx.Timeout(REQUEST_TIMEOUT, connect=5)
+        self.limiter = limiter or RateLimiter()
+        self.llm = ChatOpenAI(
+            model=MODEL,
+            openai_api_key=api_key,
+            openai_api_base=base_url,
+            temperature=0.1,
+            request_timeout=REQUEST_TIMEOUT,
+            max_retries=0,   # 429 обрабатывает ограничитель (общая пауза), а не каждый вызов сам по себе
+            stream_usage=True,
+            http_client=httpx.Client(limits=limits, timeout=timeout),
+            http_async_client=httpx.AsyncClient(limits=limits, timeout=timeout),
+            default_headers={"HTTP-Referer": "https://medinsight.com", "X-Title": "Medical Agent"}
+        )
+        self._lock = threading.Lock()
+        self._lanes = {lane: {"requests": 0, "errors": 0, "cancelled": 0, "rate_limited": 0, "tokens": 0,
+                              "waits": deque(maxlen=500), "latencies": deque(maxlen=500)} for lane in LANES}
+
+    def _model(self, temperature: float = None):
+        return self.llm if temperature is None else self.llm.bind(temperature=temperature)
+
+    def _record(self, ticket: _Ticket, waited: float, started: float, tokens: int = None, error: bool = False):
+        with self._lock:
+            lane = self._lanes[ticket.lane]
+            lane["requests"] += 1
+            lane["errors"] += error
+            lane["tokens"] += tokens or 0
+            lane["waits"].append(waited * 1000)
+            lane["latencies"].append((time.perf_counter() - started) * 1000)
+        tracing.set_attributes(queue_wait_ms=round(waited * 1000, 1), tokens=tokens)
+
+    def _rate_limited(self, lane: str, error: openai.RateLimitError, attempt: int, retry: bool = True):
+        with self._lock:
+            self._lanes[lane]["rate_limited"] += 1
+        tracing.set_attributes(rate_limited=attempt + 1)
+        self.limiter.pause(_retry_after(error))
+        if not retry or attempt >= RATE_LIMIT_RETRIES:
+            raise error
+        print(f"🔸 LLM 429, пауза {_retry_after(error):.0f} сек")
+
+    # --- ВЫЗОВЫ ---
+    def invoke(self, messages, lane: str = "pipeline", temperature: float = None):
+        """AIMessage ответа; ждёт своей очереди в полосе lane"""
+        with tracing.span("llm.call", lane=lane, model=MODEL):
+            return self._invoke(messages, lane, temperature)
+
+    def _invoke(self, messages, lane: str, temperature: float):
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            ticket = self.limiter.acquire(lane, estimate_tokens(messages))
+            waited, started = time.perf_counter() - ticket.enqueued_at, time.perf_counter()
+            try:
+                response = self._model(temperature).invoke(messages)
+            except openai.RateLimitError as e:
+                self.limiter.release(ticket)
+                self._record(ticket, waited, started, error=True)
+                self._rate_limited(lane, e, attempt)
+                continue
+            except BaseException:
+                self.limiter.release(ticket)
+                self._record(ticket, waited, started, error=True)
+                raise
+            self.limiter.release(ticket, _usage(response))
+            self._record(ticket, waited, started, _usage(response))
+            return response
+
+    async def ainvoke(self, messages, lane: str = "pipeline", temperature: float = None):
+        """Async-вариант для гонки кандидатов: отмена задачи отменяет и HTTP-запрос"""
+        with tracing.span("llm.call", lane=lane, model=MODEL):
+            return await self._ainvoke(messages, lane, temperature)
+
+    async def _ainvoke(self, messages, lane: str, temperature: float):
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            ticket = await self.limiter.aacquire(lane, estimate_tokens(messages))
+            waited, started = time.perf_counter() - ticket.enqueued_at, time.perf_counter()
+            future = asyncio.run_coroutine_threadsafe(self._model(temperature).ainvoke(messages), _background_loop())
+            try:
+                response = await asyncio.wrap_future(future)
+            except openai.RateLimitError as e:
+                self.limiter.release(ticket)
+                self._record(ticket, waited, started, error=True)
+                self._rate_limited(lane, e, attempt)
+                continue
+            except asyncio.CancelledError:
+                # Проигравший кандидат гонки: запрос обрывается, это не ошибка
+                future.cancel()
+                self.limiter.release(ticket)
+                with self._lock:
+                    self._lanes[lane]["cancelled"] += 1
+                raise
+            except BaseException:
+                self.limiter.release(ticket)
+                self._record(ticket, waited, started, error=True)
+                raise
+            self.limiter.release(ticket, _usage(response))
+            self._record(ticket, waited, started, _usage(response))
+            return response
+
+    def stream(self, messages, lane: str = "interactive", temperature: float = None):
+        """Текст ответа по кусочкам; слот занят, пока поток не дочитан"""
+        with tracing.span("llm.stream", lane=lane, model=MODEL):
+            yield from self._stream(messages, lane, temperature)
+
+    def _stream(self, messages, lane: str, temperature: float):
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            ticket = self.limiter.acquire(lane, estimate_tokens(messages))
+            waited, started = time.perf_counter() - ticket.enqueued_at, time.perf_counter()
+            tokens, error, first = None, True, True
+            try:
+                for chunk in self._model(temperature).stream(messages):
+                    tokens = _usage(chunk) or tokens
+                    if chunk.content:
+                        if first:
+                            tracing.set_attributes(first_token_ms=round((time.perf_counter() - started) * 1000, 1))
+                            first = False
+                        yield chunk.content
+                error = False
+                return
+            except openai.RateLimitError as e:
+                # Часть ответа уже отдана: повтор с начала задублировал бы текст у потребителя
+                self._rate_limited(lane, e, attempt, retry=first)
+            finally:
+                self.limiter.release(ticket, tokens)
+                self._record(ticket, waited, started, tokens, error)
+
+    # --- МЕТРИКИ ---
+    def stats(self) -> dict:
+        """Состояние ограничителя и метрики по полосам: запросы, токены, ожидание в очереди, задержка"""
+        stats = self.limiter.state()
+        with self._lock:
+            lanes = {lane: (dict(m), sorted(m["waits"]), sorted(m["latencies"])) for lane, m in self._lanes.items()}
+        stats["lanes"] = {}
+        for lane, (m, waits, latencies) in lanes.items():
+            stats["lanes"][lane] = {
+                "requests": m["requests"], "errors": m["errors"], "cancelled": m["cancelled"],
+                "rate_limited": m["rate_limited"], "tokens": m["tokens"],
+                "avg_wait_ms": sum(waits) / len(waits) if waits else 0.0,
+                "p95_wait_ms": _p95(waits),
+                "avg_latency_ms": sum(latencies) / len(latencies) if latencies else 0.0,
+                "p95_latency_ms": _p95(latencies),
+            }
+        return stats
+
+
+# --- ОБЩИЙ КЛИЕНТ НА ПРОЦЕСС ---
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_llm_client(api_key: str) -> LLMClient:
+    with _clients_lock:
+        if api_key not in _clients:
+            _clients[api_key] = LLMClient(api_key)
+        return _clients[api_key]
+
+
+def llm_stats():
+    """Метрики последнего созданного клиента (для сайдбара); None, если к LLM ещё не обращались"""
+    with _clients_lock:
+        clients = list(_clients.values())
+    return clients[-1].stats() if clients else None
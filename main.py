@@ -1,29 +1,27 @@
 import os
+import re
 import uuid
 from dotenv import load_dotenv
 import pandas as pd
 import streamlit as st
 from streamlit_option_menu import option_menu
 import plotly.express as px
-import duckdb
-import uuid
 
 from agent import OpenRouterSQLAgent
+from sql_executor import get_pool
+from question_cache import get_question_cache
+from result_cache import get_result_cache
+from sql_preflight import preflight_stats
+from dashboard_cube import get_dashboard_cube
+from chat_store import FrameCache, get_chat_store
+from llm_client import llm_stats
+import chart_data
+import viz
+import tracing
+import workload_log
+import mart_advisor
 
 load_dotenv()
-def create_new_chat():
-    new_id = str(uuid.uuid4())[:8]
-    st.session_state.chat_histories[new_id] = {
-        "name": f"Чат {len(st.session_state.chat_histories) + 1}",
-        "messages": [
-            {"role": "assistant", "content": "Новый чат открыт. Чем могу помочь?"}
-        ]
-    }
-    st.session_state.current_chat_id = new_id
-
-def delete_chat(chat_id):
-    if chat_id in st.session_state.chat_histories:
-        del st.session_state.chat_histories[chat_id]
 
 # ==========================================
 # 🛠 ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ (Кэш и Визуал)
@@ -36,58 +34,44 @@ def get_agent(api_key_val):
 
 # 2. Функция Авто-визуализации
 def auto_visualize_data(df: pd.DataFrame):
-    """Автоматически строит график по DataFrame"""
-    if df is None or df.empty or len(df.columns) < 2: return None
-    
-    # Определяем типы колонок
-    num_cols = df.select_dtypes(include=['number']).columns.tolist()
-    cat_cols = df.select_dtypes(include=['object', 'string']).columns.tolist()
-    date_cols = [col for col in df.columns if any(x in col.lower() for x in ['date', 'time', 'year', 'month', 'day', 'дата', 'год', 'месяц'])]
-    
-    fig = None
+    """Автоматически строит график по DataFrame: роли колонок и прорежённые данные — из кэша viz"""
     try:
-        # Линейный график (Временной ряд)
-        if len(date_cols) > 0 and len(num_cols) > 0:
-            x_col = date_cols[0]; y_col = num_cols[0]
-            df = df.sort_values(by=x_col)
-            fig = px.line(df, x=x_col, y=y_col, markers=True, title=f"Динамика: {y_col}", template="plotly_white")
-        
-        # Бар-чарт или Пай-чарт (Категории)
-        elif len(cat_cols) > 0 and len(num_cols) > 0:
-            x_col = cat_cols[0]; y_col = num_cols[0]
-            # Если мало категорий и это похоже на доли -> Pie Chart
-            if len(df) <= 6 and any(x in y_col.lower() for x in ['share', 'доля', 'процент']): 
-                fig = px.pie(df, names=x_col, values=y_col, title=f"Распределение: {x_col}")
-            else:
-                fig = px.bar(df, x=x_col, y=y_col, title=f"{y_col} по {x_col}", color=y_col, template="plotly_white", color_continuous_scale="Blues")
+        # График — дополнение к ответу: ошибка подготовки данных не должна ронять ответ целиком
+        spec, plot_df = viz.prepare(df)
+        if spec is None:
+            return None
+        if spec["kind"] == "line":
+            fig = px.line(plot_df, x=spec["x"], y=spec["y"], color=spec["color"], title=spec["title"],
+                          markers=spec["points"] <= 200, template="plotly_white")
+        elif spec["kind"] == "pie":
+            fig = px.pie(plot_df, names=spec["x"], values=spec["y"], title=spec["title"])
+        else:
+            fig = px.bar(plot_df, x=spec["x"], y=spec["y"], title=spec["title"], color=spec["y"],
+                         template="plotly_white", color_continuous_scale="Blues")
     except Exception:
         return None
         
     return fig
 
-# 3. Управление чатами
+# 3. Управление чатами (чаты и таблицы ответов хранятся в SQLite, см. chat_store.py)
 def create_new_chat():
-    new_id = str(uuid.uuid4())[:8]
-    st.session_state.chat_histories[new_id] = {
-        "name": f"Чат {len(st.session_state.chat_histories) + 1}",
-        "messages": [
-            {"role": "assistant", "content": "Новый чат открыт. Чем могу помочь?"}
-        ]
-    }
+    new_id = chat_store.create_chat(chat_owner)
+    chat_store.add_message(chat_owner, new_id, "assistant", "Новый чат открыт. Чем могу помочь?")
     st.session_state.current_chat_id = new_id
 
 def delete_chat(chat_id):
-    if chat_id in st.session_state.chat_histories:
-        del st.session_state.chat_histories[chat_id]
+    chat_store.delete_chat(chat_owner, chat_id)
 
     if st.session_state.current_chat_id == chat_id:
-        if st.session_state.chat_histories:
-            st.session_state.current_chat_id = next(iter(st.session_state.chat_histories))
+        chats = chat_store.list_chats(chat_owner)
+        if chats:
+            st.session_state.current_chat_id = chats[0]["chat_id"]
         else:
             create_new_chat()
 
 def switch_chat(chat_id):
     st.session_state.current_chat_id = chat_id
+    st.session_state.history_limit = HISTORY_PAGE
 
 # 4. CSS Стили
 def local_css():
@@ -109,50 +93,45 @@ def local_css():
 
 # --- КОНФИГУРАЦИЯ ---
 DB_PATH = "db/medinsight.duckdb"
+HISTORY_PAGE = 20    # сообщений чата на экране, ранние — по кнопке
+EAGER_FRAMES = 3     # графики последних ответов загружаются сразу, остальные — по переключателю
 st.set_page_config(layout="wide", page_title="Medical Insight", page_icon="🏥")
 local_css()
 
-# --- ЗАГРУЗКА ДАННЫХ ---
-@st.cache_data
-def load_dashboard_data():
-    if not os.path.exists(DB_PATH):
-        return None, None, None, None, None, None
-
-    con = duckdb.connect(DB_PATH, read_only=True)
-    
-    # Запросы к БД (как в твоем коде)
-    df_gender = con.execute("SELECT пол, COUNT(*) as count FROM patients GROUP BY пол").df()
-    df_age = con.execute("SELECT date_diff('year', дата_рождения, CURRENT_DATE) as age FROM patients WHERE дата_рождения IS NOT NULL").df()
-    df_district_patients = con.execute("SELECT район_проживания, COUNT(*) as count FROM patients WHERE район_проживания IS NOT NULL GROUP BY район_проживания ORDER BY count DESC").df()
-    df_finance = con.execute("SELECT disease_group, avg_cost_per_prescription, avg_cost_per_patient FROM insight_cost_by_disease ORDER BY avg_cost_per_patient DESC LIMIT 10").df()
-    df_geo_drugs = con.execute("SELECT region, SUM(prescriptions_count) as total_prescriptions FROM insight_region_drug_choice GROUP BY region ORDER BY total_prescriptions DESC").df()
-    df_season = con.execute("SELECT strftime(дата_рецепта, '%Y-%m') as month_year, COUNT(*) as cases FROM prescriptions GROUP BY month_year ORDER BY month_year").df()
-
-    con.close()
-    return df_gender, df_age, df_district_patients, df_finance, df_geo_drugs, df_season
-
 # --- ИНИЦИАЛИЗАЦИЯ СОСТОЯНИЯ ---
-if "chat_histories" not in st.session_state:
-    st.session_state.chat_histories = {} 
+chat_store = get_chat_store()
+if "chat_owner" not in st.session_state:
+    # Входа в приложение нет: владелец чатов — случайный ключ в адресе страницы.
+    # Та же ссылка (перезагрузка, закладка) открывает свои чаты, другие сессии их не видят
+    owner = st.query_params.get("owner", "")
+    st.session_state.chat_owner = owner if re.fullmatch(r"[0-9a-f]{32}", owner) else uuid.uuid4().hex
+    st.query_params["owner"] = st.session_state.chat_owner
+chat_owner = st.session_state.chat_owner
 if "current_chat_id" not in st.session_state:
-    st.session_state.current_chat_id = None
+    # После перезапуска продолжаем свой последний чат
+    chats = chat_store.list_chats(chat_owner)
+    st.session_state.current_chat_id = chats[0]["chat_id"] if chats else None
+if "frame_cache" not in st.session_state:
+    # Загруженные таблицы ответов этой сессии, не больше CHAT_FRAME_CACHE_MB
+    st.session_state.frame_cache = FrameCache()
+if "history_limit" not in st.session_state:
+    st.session_state.history_limit = HISTORY_PAGE
 
 # --- ГЛАВНЫЙ ИНТЕРФЕЙС ---
 
-# Загрузка
-data = load_dashboard_data()
-df_gender, df_age, df_district_patients, df_finance, df_geo_drugs, df_season = data
+# Загрузка: куб дашборда читается один раз на версию базы, графики — его срезы в памяти
+cube, cube_error = get_dashboard_cube(DB_PATH)
 
-if df_gender is None:
-    st.error(f"❌ База данных не найдена по пути: {DB_PATH}.")
+if cube is None:
+    st.error(f"❌ {cube_error}")
     st.stop()
 
 # САЙДБАР
 with st.sidebar:
     selected = option_menu(
         menu_title="Меню",
-        options=["Дашборд", "AI Агент"],
-        icons=["bar-chart-fill", "chat-left-text-fill"],
+        options=["Дашборд", "AI Агент", "Производительность"],
+        icons=["bar-chart-fill", "chat-left-text-fill", "speedometer2"],
         menu_icon="cast",
         default_index=0,
         styles={
@@ -167,13 +146,26 @@ with st.sidebar:
         st.divider()
         st.subheader("🗂 Чаты")
         
-        # Если нет активного чата — создаем
-        if st.session_state.current_chat_id is None:
+        # Если нет активного чата (или его удалили в другой вкладке) — создаем
+        if st.session_state.current_chat_id is None or not chat_store.chat_exists(chat_owner, st.session_state.current_chat_id):
             create_new_chat()
-            
+
+        # Поиск по тексту вопросов и ответов
+        search_text = st.text_input("🔍 Поиск по чатам", placeholder="например: диабет 2023")
+        if search_text:
+            found = chat_store.search(chat_owner, search_text)
+            if not found:
+                st.caption("Ничего не найдено")
+            for hit in found:
+                if st.button(hit["name"], key=f"found_{hit['chat_id']}", use_container_width=True):
+                    switch_chat(hit["chat_id"])
+                    st.rerun()
+                st.caption(hit["snippet"])
+            st.divider()
+
         # Список чатов
-        for cid in list(st.session_state.chat_histories.keys()):
-            chat_data = st.session_state.chat_histories[cid]
+        for chat_data in chat_store.list_chats(chat_owner):
+            cid = chat_data["chat_id"]
             is_active = (cid == st.session_state.current_chat_id)
             
             col1, col2 = st.columns([4, 1])
@@ -191,17 +183,94 @@ with st.sidebar:
             create_new_chat()
             st.rerun()
 
+        # Нагрузка на общий пул SQL-воркеров
+        with st.expander("⚙️ Очередь SQL"):
+            q_stats = get_pool(DB_PATH).stats()
+            c1, c2 = st.columns(2)
+            c1.metric("В очереди", q_stats["queue_depth"])
+            c2.metric("Выполняется", f"{q_stats['in_flight']}/{q_stats['workers']}")
+            c1.metric("Ожидание (сред.)", f"{q_stats['avg_wait_ms']:.0f} мс")
+            c2.metric("Ожидание (p95)", f"{q_stats['p95_wait_ms']:.0f} мс")
+            st.caption(f"Выполнено: {q_stats['completed']} · Отклонено: {q_stats['rejected']}")
+            st.caption(f"Снимок базы: {q_stats['snapshot']}")
+
+        # Эффективность кэша "вопрос -> SQL"
+        with st.expander("💾 Кэш вопросов"):
+            c_stats = get_question_cache().stats()
+            c1, c2 = st.columns(2)
+            c1.metric("Hit rate", f"{c_stats['hit_rate']:.0%}")
+            c2.metric("Записей", c_stats["size"])
+            st.caption(f"Попаданий: {c_stats['hits']} · Промахов: {c_stats['misses']}")
+
+        # Локальная починка SQL до LLM
+        with st.expander("🛠 Pre-flight SQL"):
+            p_stats = preflight_stats()
+            c1, c2 = st.columns(2)
+            c1.metric("LLM-вызовов сэкономлено", p_stats["llm_calls_avoided"])
+            c2.metric("Проверено", p_stats["checked"])
+            st.caption(f"Без ошибок: {p_stats['valid']} · Починено: {p_stats['repaired']} · Ушло в LLM: {p_stats['residual_errors']}")
+
+        # Общий LLM-клиент: лимиты провайдера и очередь по полосам приоритета
+        with st.expander("🌐 LLM"):
+            l_stats = llm_stats()
+            if l_stats is None:
+                st.caption("Запросов к LLM ещё не было")
+            else:
+                c1, c2 = st.columns(2)
+                c1.metric("В очереди", l_stats["queued"])
+                c2.metric("Выполняется", l_stats["in_flight"])
+                if l_stats["paused_sec"]:
+                    st.caption(f"⏸ Пауза после 429: {l_stats['paused_sec']:.0f} сек")
+                st.dataframe(pd.DataFrame(l_stats["lanes"]).T[["requests", "rate_limited", "tokens", "p95_wait_ms", "p95_latency_ms"]].round(0))
+
+        # История чатов: на диске всё, в памяти сессии — только открытые таблицы
+        with st.expander("💬 История чатов"):
+            h_stats = chat_store.stats()
+            f_stats = st.session_state.frame_cache.stats()
+            c1, c2 = st.columns(2)
+            c1.metric("Таблиц в памяти", f_stats["frames"])
+            c2.metric("Память", f"{f_stats['bytes'] / 2**20:.1f} / {f_stats['max_bytes'] / 2**20:.0f} МБ")
+            st.caption(f"Чатов: {h_stats['chats']} · Сообщений: {h_stats['messages']} · "
+                       f"Parquet на диске: {h_stats['parquet_bytes'] / 2**20:.1f} МБ")
+
+    # Общий на все сессии кэш результатов SQL (агент + дашборд)
+    st.divider()
+    with st.expander("🗄 Кэш результатов SQL"):
+        r_stats = get_result_cache().stats()
+        c1, c2 = st.columns(2)
+        c1.metric("Hit rate", f"{r_stats['hit_rate']:.0%}")
+        c2.metric("Память", f"{r_stats['bytes'] / 2**20:.1f} МБ")
+        st.caption(f"В памяти: {r_stats['entries']} · На диске: {r_stats['spilled']}")
+        df_entries = get_result_cache().entry_stats()
+        if not df_entries.empty:
+            st.dataframe(df_entries[["sql", "hits", "bytes", "on_disk"]].head(20), hide_index=True)
+
+    # Куб дашборда: графики — срезы в памяти, повторные срезы берутся из его кэша
+    with st.expander("🧊 Куб дашборда"):
+        k_stats = cube.stats()
+        c1, c2 = st.columns(2)
+        c1.metric("Hit rate срезов", f"{k_stats['memo_hit_rate']:.0%}")
+        c2.metric("Память", f"{k_stats['bytes'] / 2**20:.1f} МБ")
+        st.caption(f"Ячеек: {k_stats['cells']:,} · Срезов в кэше: {k_stats['memo_entries']}")
+
 
 # === ВКЛАДКА 1: ДАШБОРД ===
 if selected == "Дашборд":
     st.title("📊 Аналитический Дашборд")
+
+    # Демография — из справочника пациентов (срезы куба, без запросов к базе)
+    df_gender = cube.patients(["sex"]).rename(columns={"sex": "пол", "patients": "count"})
+    df_age = cube.patients(["age"]).rename(columns={"patients": "count"})
+    df_district_patients = (cube.patients(["district"])
+                            .rename(columns={"district": "район_проживания", "patients": "count"})
+                            .sort_values("count", ascending=False))
     
     # KPI
     col1, col2, col3, col4 = st.columns(4)
     col1.metric("Всего пациентов", f"{df_gender['count'].sum():,.0f}")
-    col2.metric("Средний возраст", f"{df_age['age'].mean():.1f} лет")
+    col2.metric("Средний возраст", f"{(df_age['age'] * df_age['count']).sum() / df_age['count'].sum():.1f} лет")
     col3.metric("Самый населенный район", df_district_patients.iloc[0]['район_проживания'])
-    col4.metric("Всего рецептов", f"{df_season['cases'].sum():,.0f}")
+    col4.metric("Всего рецептов", f"{cube.prescriptions([])['prescriptions'].iloc[0]:,.0f}")
     st.divider()
 
     # Графики демографии
@@ -220,12 +289,17 @@ if selected == "Дашборд":
         st.plotly_chart(fig_gender, use_container_width=True)
         
     with c2:
-        fig_age = px.histogram(
-            df_age, 
-            x="age", 
-            nbins=30,
+        # Бины считает DuckDB по срезу куба (возраст × число пациентов): в Plotly уходят ~30 столбцов
+        df_age_bins, error = chart_data.histogram(df_age, "age", width=3, weight="count")
+        if error:
+            st.error(f"❌ {error}")
+            st.stop()
+        fig_age = px.bar(
+            df_age_bins,
+            x="bin",
+            y="count",
             title="Возрастная структура пациентов",
-            labels={'age': 'Возраст', 'count': 'Количество пациентов'},
+            labels={'bin': 'Возраст', 'count': 'Количество пациентов'},
             color_discrete_sequence=['#00CC96']
         )
         fig_age.update_layout(bargap=0.1)
@@ -263,7 +337,6 @@ if selected == "Дашборд":
 
     # Статистика заболеваний (Твой блок)
     st.subheader("📈 Статистика заболеваний")
-    con = duckdb.connect(DB_PATH, read_only=True)
 
     # --- 1. Топ-20 классов заболеваний ---
     short_names = {
@@ -274,17 +347,10 @@ if selected == "Дашборд":
         "Болезни мочеполовой системы": "Мочеполовая система",
         "Болезни органов пищеварения": "Пищеварение"
     }
-    df_top_classes = con.execute("""
-        SELECT 
-            класс_заболевания,
-            COUNT(*) AS cases
-        FROM prescriptions p
-        JOIN diagnoses d ON p.код_диагноза = d.код_мкб
-        GROUP BY класс_заболевания
-        ORDER BY cases DESC
-        LIMIT 20
-    """).df()
-    df_top_classes["класс_заболевания"] = df_top_classes["класс_заболевания"].replace(short_names)
+    df_top_classes = (cube.prescriptions(["disease_class"])
+                      .rename(columns={"disease_class": "класс", "prescriptions": "cases"})
+                      .nlargest(20, "cases"))
+    df_top_classes["класс_заболевания"] = df_top_classes["класс"].astype(str).replace(short_names)
 
     fig_top_classes = px.bar(
         df_top_classes,
@@ -303,44 +369,25 @@ if selected == "Дашборд":
     # --- 2. Частота заболеваний внутри выбранного класса ---
     st.markdown("### 🧬 Частота заболеваний внутри класса")
 
-    classes_list = df_top_classes["класс_заболевания"].unique().tolist()
-    selected_class = st.selectbox("Выберите класс заболевания:", classes_list)
-
-    # Получаем детальную статистику по всем заболеваниям в классе
-    df_group_detail = con.execute(f"""
-        SELECT 
-            d.название_диагноза,
-            COUNT(*) AS cnt
-        FROM prescriptions p
-        JOIN diagnoses d ON p.код_диагноза = d.код_мкб
-        WHERE d.класс_заболевания = '{selected_class}'
-        GROUP BY d.название_диагноза
-        ORDER BY cnt DESC
-    """).df()
-
-    # Рассчитываем долю каждого заболевания
+    # В списке короткие названия, а фильтруем куб по полному названию класса
+    classes_list = df_top_classes["класс"].astype(str).tolist()
+    selected_class = st.selectbox("Выберите класс заболевания:", classes_list,
+                                  format_func=lambda c: short_names.get(c, c))
+
+    # Детальная статистика по всем заболеваниям в классе
+    df_group_detail = cube.diagnoses(disease_class=selected_class).rename(columns={"prescriptions": "cnt"})
+
     total_cases = df_group_detail['cnt'].sum()
-    df_group_detail['доля'] = (df_group_detail['cnt'] / total_cases * 100).round(2)
-    df_group_detail['процент'] = df_group_detail['доля'].astype(str) + '%'
 
-    # Ограничиваем количество отображаемых заболеваний (топ-6 + остальные для компактности)
+    # Топ-6 + «Остальные» считает DuckDB (chart_data): на график уходят только готовые строки
     top_n = 6  # Уменьшили для компактной легенды
-    if len(df_group_detail) > top_n:
-        top_diseases = df_group_detail.head(top_n).copy()
-        other_cases = df_group_detail.iloc[top_n:]['cnt'].sum()
-        other_share = (other_cases / total_cases * 100).round(2)
-        
-        # Создаем строку для "Остальных"
-        other_row = pd.DataFrame({
-            'название_диагноза': [f'Остальные ({len(df_group_detail) - top_n} диагнозов)'],
-            'cnt': [other_cases],
-            'доля': [other_share],
-            'процент': [f'{other_share}%']
-        })
-        
-        df_plot = pd.concat([top_diseases, other_row], ignore_index=True)
-    else:
-        df_plot = df_group_detail.copy()
+    df_plot, error = chart_data.top_n(df_group_detail, "название_диагноза", "cnt", n=top_n,
+                                      other_label="Остальные ({} диагнозов)")
+    if error:
+        st.error(f"❌ {error}")
+        st.stop()
+    df_plot['процент'] = df_plot['доля'].astype(str) + '%'
+    most_common = df_plot.iloc[0]
 
     # Сортируем по убыванию для лучшей читаемости
     df_plot = df_plot.sort_values('доля', ascending=True)
@@ -445,7 +492,6 @@ if selected == "Дашборд":
         with col2:
             st.metric("Всего случаев", f"{total_cases:,}")
         with col3:
-            most_common = df_group_detail.iloc[0]
             st.metric("Самый частый диагноз", 
                      f"{most_common['название_диагноза'][:30]}...", 
                      f"{most_common['доля']}%")
@@ -455,15 +501,15 @@ if selected == "Дашборд":
     # --- 3. Половые различия ---
     st.subheader("🚻 Половые различия по группам заболеваний")
 
-    df_gender_diff = con.execute("""
-        SELECT 
-            disease_group AS группа_заболеваний,
-            male_patients AS мужчины,
-            female_patients AS женщины,
-            female_minus_male AS разница
-        FROM insight_gender_disease
-        ORDER BY разница DESC
-    """).df()
+    # Уникальные пациенты по классу и полу — объединение HLL-скетчей ячеек куба (оценка, стандартная ошибка ~0.81%)
+    df_gender_diff = (cube.distinct_patients(["disease_class", "sex"])
+                      .pivot(index="disease_class", columns="sex", values="patients")
+                      .reindex(columns=["М", "Ж"]).fillna(0).astype(int)
+                      .rename(columns={"М": "мужчины", "Ж": "женщины"})
+                      .rename_axis(index="группа_заболеваний", columns=None)
+                      .reset_index())
+    df_gender_diff["группа_заболеваний"] = df_gender_diff["группа_заболеваний"].astype(str)
+    df_gender_diff["разница"] = df_gender_diff["женщины"] - df_gender_diff["мужчины"]
     df_gender_diff["короткое_название"] = df_gender_diff["группа_заболеваний"].replace(short_names)
     df_gender_diff = df_gender_diff.sort_values("разница", ascending=False)
 
@@ -485,14 +531,11 @@ if selected == "Дашборд":
     # --- 4. Топ-10 заболеваний по стоимости лечения ---
     st.subheader("💰 Топ-10 заболеваний по стоимости лечения пациента")
 
-    df_cost_top10 = con.execute("""
-        SELECT 
-            disease_group AS группа,
-            avg_cost_per_patient AS стоимость
-        FROM insight_cost_by_disease
-        ORDER BY avg_cost_per_patient DESC
-        LIMIT 10
-    """).df()
+    # Стоимость на пациента = вся стоимость рецептов класса / уникальные пациенты класса
+    df_cost_top10 = cube.prescriptions(["disease_class"]).merge(cube.distinct_patients(["disease_class"]), on="disease_class")
+    df_cost_top10["стоимость"] = df_cost_top10["cost"] / df_cost_top10["patients"]
+    df_cost_top10["группа"] = df_cost_top10["disease_class"].astype(str)
+    df_cost_top10 = df_cost_top10.nlargest(10, "стоимость")
     df_cost_top10["короткое"] = df_cost_top10["группа"].replace(short_names)
     df_cost_top10 = df_cost_top10.sort_values("стоимость", ascending=False)
 
@@ -509,8 +552,6 @@ if selected == "Дашборд":
 
     st.plotly_chart(fig_cost_top10, use_container_width=True)
 
-    con.close()
-
 
 # === ВКЛАДКА 2: AI АГЕНТ (ИСПРАВЛЕННАЯ) ===
 elif selected == "AI Агент":
@@ -523,32 +564,46 @@ elif selected == "AI Агент":
         if not api_key: st.stop()
 
     # Получаем текущий чат
-    if st.session_state.current_chat_id is None:
+    if st.session_state.current_chat_id is None or not chat_store.chat_exists(chat_owner, st.session_state.current_chat_id):
         create_new_chat()
     chat_id = st.session_state.current_chat_id
-    messages = st.session_state.chat_histories[chat_id]["messages"]
+    messages = chat_store.messages(chat_owner, chat_id)
 
     # 2. ИСТОРИЯ СООБЩЕНИЙ (С ГРАФИКАМИ)
-    for msg in messages:
+    # Таблицы ответов лежат на диске: сразу читаются только последние EAGER_FRAMES,
+    # остальные — когда пользователь раскрывает график (в пределах лимита памяти сессии)
+    hidden = max(len(messages) - st.session_state.history_limit, 0)
+    if hidden:
+        if st.button(f"⬆️ Показать ранние сообщения ({hidden})"):
+            st.session_state.history_limit += HISTORY_PAGE
+            st.rerun()
+    with_frames = [m["message_id"] for m in messages if m["frame_rows"]]
+    eager = set(with_frames[-EAGER_FRAMES:])
+
+    for msg in messages[hidden:]:
         with st.chat_message(msg["role"]):
             st.markdown(msg["content"])
-            # ВАЖНО: Если есть сохраненный DataFrame, рисуем его
-            if "dataframe" in msg and msg["dataframe"] is not None:
-                fig = auto_visualize_data(msg["dataframe"])
-                if fig:
-                    st.plotly_chart(fig, use_container_width=True)
-                else:
-                    with st.expander("Показать данные"):
-                        st.dataframe(msg["dataframe"])
+            if not msg["frame_rows"]:
+                continue
+            mid = msg["message_id"]
+            if mid not in eager and not st.toggle(f"📈 График ({msg['frame_rows']:,} строк)", key=f"frame_{mid}"):
+                continue
+            df_msg = chat_store.frame(chat_owner, mid, st.session_state.frame_cache)
+            fig = auto_visualize_data(df_msg)
+            if fig:
+                st.plotly_chart(fig, use_container_width=True)
+            else:
+                with st.expander("Показать данные"):
+                    st.dataframe(df_msg)
 
     # 3. ОБРАБОТКА НОВОГО ВОПРОСА
     if prompt := st.chat_input("Ваш вопрос к базе данных..."):
         # Обновляем имя чата
         if len(messages) <= 2:
-            st.session_state.chat_histories[chat_id]["name"] = " ".join(prompt.split()[:4]) + "..."
+            chat_store.rename_chat(chat_owner, chat_id, " ".join(prompt.split()[:4]) + "...")
 
         # Добавляем вопрос пользователя
-        st.session_state.chat_histories[chat_id]["messages"].append({"role": "user", "content": prompt})
+        chat_store.add_message(chat_owner, chat_id, "user", prompt)
         with st.chat_message("user"):
             st.markdown(prompt)
 
@@ -557,31 +612,135 @@ elif selected == "AI Агент":
                 # Используем кэшированного агента (быстро!)
                 agent = get_agent(api_key)
                 
-                with st.spinner("🤖 Анализирую данные..."):
-                    answer = agent.answer(prompt)
-                
-                # Выводим текст
-                st.markdown(answer)
-                
-                # Подготовка сообщения для сохранения
-                msg_data = {"role": "assistant", "content": answer}
-
-                # ПРОВЕРЯЕМ ФАЙЛ CSV ДЛЯ ГРАФИКА
-                csv_path = "scripts_db/answer.csv"
-                if os.path.exists(csv_path) and os.path.getsize(csv_path) > 0:
-                    try:
-                        df_result = pd.read_csv(csv_path)
-                        # Если данные ок — визуализируем и сохраняем
-                        if not df_result.empty and len(df_result) < 300:
+                # Потоковый ответ: этапы пайплайна в статусе, график сразу после выполнения SQL,
+                # затем текст по мере генерации
+                status = st.status("🤖 Генерирую SQL...", expanded=False)
+                answer_box = st.empty()
+                chart_box = st.container()
+                answer, df_result = "", None
+
+                for event in agent.stream_answer(prompt):
+                    if event["type"] == "sql":
+                        label = "💾 SQL из кэша" if event["cached"] else "🔹 SQL сгенерирован"
+                        status.update(label=f"{label}, выполняю...")
+                        status.code(event["sql"], language="sql")
+                    elif event["type"] == "retry":
+                        status.update(label=f"🔸 Попытка {event['attempt']}: исправляю запрос...")
+                        status.write(f"Попытка {event['attempt']}: {event['reason']}")
+                    elif event["type"] == "rows":
+                        df_result = event["df"]
+                        status.update(label=f"✅ Получено строк: {len(df_result)}. Анализирую...")
+                        # ДАННЫЕ ДЛЯ ГРАФИКА (результат именно этого запроса; большие прореживаются в viz)
+                        if not df_result.empty:
                             fig = auto_visualize_data(df_result)
                             if fig:
-                                st.plotly_chart(fig, use_container_width=True)
-                            # Сохраняем DF в историю, чтобы график остался навсегда
-                            msg_data["dataframe"] = df_result
-                    except Exception: pass
-
-                # Сохраняем ответ в историю
-                st.session_state.chat_histories[chat_id]["messages"].append(msg_data)
+                                chart_box.plotly_chart(fig, use_container_width=True)
+                    elif event["type"] == "token":
+                        answer += event["text"]
+                        answer_box.markdown(answer + "▌")
+                    elif event["type"] == "error":
+                        answer, df_result = event["text"], None
+
+                status.update(label="Готово", state="complete" if df_result is not None else "error")
+                answer_box.markdown(answer)
+                
+                # Сохраняем ответ в историю: таблица уходит на диск в Parquet, чтобы график остался навсегда
+                message_id = chat_store.add_message(chat_owner, chat_id, "assistant", answer, df_result)
+                if message_id is not None and df_result is not None and not df_result.empty:
+                    st.session_state.frame_cache.put(message_id, df_result, int(df_result.memory_usage(deep=True).sum()))
 
             except Exception as e:
                 st.error(f"Ошибка: {e}")
+
+
+# === ВКЛАДКА 3: ПРОИЗВОДИТЕЛЬНОСТЬ ===
+elif selected == "Производительность":
+    st.title("⏱ Производительность агента")
+    st.caption(f"Трассы этапов из {tracing.TRACE_PATH} (формат OTLP JSON)")
+
+    max_traces = st.select_slider("Последних вопросов", options=[50, 200, 1000, 5000], value=200)
+    spans = tracing.load_spans(max_lines=max_traces)
+    if spans.empty:
+        st.info("Трасс пока нет: задайте вопрос агенту на вкладке «AI Агент».")
+        st.stop()
+
+    roots = spans[spans["name"] == "agent.answer"]
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Вопросов", len(roots))
+    col2.metric("Ответ p50", f"{roots['duration_ms'].quantile(0.5) / 1000:.1f} сек" if len(roots) else "—")
+    col3.metric("Ответ p95", f"{roots['duration_ms'].quantile(0.95) / 1000:.1f} сек" if len(roots) else "—")
+    if "retries" in roots:
+        col4.metric("С повторами SQL", f"{roots['retries'].notna().mean():.0%}" if len(roots) else "—")
+    st.divider()
+
+    # Куда уходит время: этапы первого уровня (прямые дети корня), суммарно по всем вопросам
+    top_level = spans[spans["parent_id"].isin(roots["span_id"])]
+    df_share = top_level.groupby("name", as_index=False)["duration_ms"].sum().sort_values("duration_ms", ascending=False)
+    df_share["сек"] = df_share["duration_ms"] / 1000
+    fig_share = px.bar(df_share, x="сек", y="name", orientation="h", title="Где уходят секунды (этапы ответа, сумма)",
+                       template="plotly_white", color="сек", color_continuous_scale="Blues")
+    fig_share.update_layout(yaxis={"categoryorder": "total ascending"}, yaxis_title=None, coloraxis_showscale=False)
+    st.plotly_chart(fig_share, use_container_width=True)
+
+    st.subheader("Этапы")
+    st.dataframe(tracing.stage_stats(spans), use_container_width=True)
+
+    # Гистограммы задержек по этапам (бины считает DuckDB, как и у графиков дашборда)
+    stage_names = spans["name"].value_counts().index.tolist()
+    default_stages = [s for s in ["agent.answer", "sql.generate", "llm.call", "sql.execute", "analysis"] if s in stage_names]
+    chosen = st.multiselect("Гистограммы задержек", stage_names, default=default_stages)
+    hist_cols = st.columns(2)
+    for i, stage in enumerate(chosen):
+        df_hist, hist_error = chart_data.histogram(spans.loc[spans["name"] == stage, ["duration_ms"]], "duration_ms", bins=20)
+        if hist_error:
+            hist_cols[i % 2].warning(hist_error)
+            continue
+        fig_hist = px.bar(df_hist, x="bin", y="count", title=f"{stage}, мс", template="plotly_white")
+        fig_hist.update_layout(xaxis_title=None, yaxis_title="спанов", bargap=0.05)
+        hist_cols[i % 2].plotly_chart(fig_hist, use_container_width=True)
+
+    # Самые медленные вопросы и водопад этапов выбранного
+    st.subheader("Самые медленные вопросы")
+    slow_cols = [c for c in ["start", "question", "duration_ms", "retries", "rows", "sql_cache_hit", "outcome"] if c in roots]
+    df_slow = roots.sort_values("duration_ms", ascending=False)[slow_cols + ["trace_id"]].head(20)
+    st.dataframe(df_slow[slow_cols].round({"duration_ms": 0}), hide_index=True, use_container_width=True)
+    if not df_slow.empty:
+        trace_id = st.selectbox("Этапы вопроса", df_slow["trace_id"],
+                                format_func=lambda t: f"{df_slow.set_index('trace_id').loc[t, 'duration_ms'] / 1000:.1f} сек · "
+                                                      f"{df_slow.set_index('trace_id').loc[t, 'question'] if 'question' in df_slow else t}")
+        df_trace = spans[spans["trace_id"] == trace_id].sort_values("start").copy()
+        df_trace["end"] = df_trace["start"] + pd.to_timedelta(df_trace["duration_ms"], unit="ms")
+        df_trace["этап"] = [f"{name} #{i}" for i, name in enumerate(df_trace["name"])]
+        fig_trace = px.timeline(df_trace, x_start="start", x_end="end", y="этап", color="name",
+                                hover_data=[c for c in ["lane", "tokens", "rows", "result_cache", "queue_wait_ms", "error"] if c in df_trace])
+        fig_trace.update_yaxes(autorange="reversed", title=None)
+        fig_trace.update_layout(showlegend=False, template="plotly_white")
+        st.plotly_chart(fig_trace, use_container_width=True)
+
+    # Журнал нагрузки (запросы агента и дашборда) и витрины, которые советник предлагает под горячие агрегаты
+    st.divider()
+    st.subheader("Горячие агрегаты и кандидаты в витрины")
+    workload = workload_log.load(since_days=7)
+    if workload.empty:
+        st.caption(f"Журнал нагрузки {workload_log.WORKLOAD_PATH} пока пуст.")
+    else:
+        shapes = mart_advisor.hot_shapes(workload)
+        proposals = mart_advisor.propose(shapes)
+        wcol1, wcol2, wcol3 = st.columns(3)
+        wcol1.metric("Запросов за 7 дней", len(workload),
+                     help=", ".join(f"{k}: {v}" for k, v in workload["source"].value_counts().items()))
+        wcol2.metric("Горячие агрегаты по сырым таблицам", f"{sum(s['total_ms'] for s in shapes) / 1000:.1f} сек")
+        wcol3.metric("Предложено витрин", len(proposals))
+        if shapes:
+            df_shapes = pd.DataFrame([{
+                "запросов": s["hits"], "сек": round(s["total_ms"] / 1000, 1), "p95, мс": round(s["p95_ms"]),
+                "таблицы": " + ".join(s["tables"]),
+                "разрезы": ", ".join(f"{c} ({g})" if g else c for c, g in s["dims"].items()) or "—",
+                "агрегаты": ", ".join(s["measures"]), "источник": ", ".join(s["sources"]),
+            } for s in shapes])
+            st.dataframe(df_shapes, hide_index=True, use_container_width=True)
+        for p in proposals:
+            with st.expander(f"{p['name']} — {p['hits']} запросов, {p['total_ms'] / 1000:.1f} сек на сырых таблицах"):
+                st.code(mart_advisor.render_sql(p), language="sql")
+        if proposals:
+            st.caption("Создать: `python scripts_db/advise_marts.py --apply` — оценит размер витрин и соберёт их в новый снимок.")
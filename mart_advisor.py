@@ -0,0 +1,278 @@
+import os
+import re
+import json
+import math
+import hashlib
+from pathlib import Path
+
+import workload_log
+from workload_log import GRAINS
+from mart_build import MARTS_DIR
+
+# --- КОНФИГУРАЦИЯ ---
+# Советник витрин: по журналу нагрузки (workload_log) находит агрегаты по сырым таблицам, которые
+# спрашивают часто и долго считают, и предлагает для них витрины insight_auto_* — SQL-файлы в
+# scripts_db/marts/, которые собирает обычный mart_build. Описание витрины пишется в каталог базы
+# (COMMENT ON TABLE), оттуда его берут get_smart_schema и SchemaSelector — агент видит витрину сразу.
+MART_PREFIX = "insight_auto_"
+MIN_HITS = int(os.getenv("ADVISOR_MIN_HITS", "3"))              # запросов одной формы
+MIN_TOTAL_MS = float(os.getenv("ADVISOR_MIN_TOTAL_MS", "1000"))  # суммарно на сырых таблицах (попадания в кэш — 0)
+MAX_DIMS = 4              # разрезов в витрине: больше — витрина почти как сырая таблица
+MAX_ROW_RATIO = 0.05      # строк витрины относительно таблицы фактов
+
+RAW_TABLES = {"prescriptions", "prescriptions_fact", "patients", "diagnoses", "drugs"}
+FACT_TABLES = ("prescriptions_fact", "prescriptions")
+ALIASES = {"prescriptions": "pr", "prescriptions_fact": "pf", "patients": "pa", "diagnoses": "d", "drugs": "dr"}
+# Те же связи, что MY_RELATIONSHIPS в agent.py, — в виде условий JOIN
+JOINS = {
+    ("prescriptions", "patients"): "pr.id_пациента = pa.id_пациента",
+    ("prescriptions", "drugs"): "pr.код_препарата = dr.код_препарата",
+    ("prescriptions", "diagnoses"): "pr.код_диагноза = d.код_мкб",
+    ("prescriptions_fact", "patients"): "pf.patient_key = pa.patient_key",
+    ("prescriptions_fact", "drugs"): "pf.drug_key = dr.drug_key",
+    ("prescriptions_fact", "diagnoses"): "pf.diagnosis_key = d.diagnosis_key",
+}
+LABELS = {"prescriptions": "рецепты", "prescriptions_fact": "рецепты", "patients": "пациенты",
+          "diagnoses": "диагнозы", "drugs": "лекарства"}
+GRAIN_LABELS = {"day": "день", "week": "неделя", "month": "месяц", "quarter": "квартал", "year": "год"}
+# Какие зерна можно досчитать из витрины с данным зерном
+GRAIN_COVERS = {"day": set(GRAINS), "week": {"week"}, "month": {"month", "quarter", "year"},
+                "quarter": {"quarter", "year"}, "year": {"year"}}
+
+
+# --- ФОРМЫ ---
+def _dims(keys) -> dict:
+    """["t.c@month", "t.x"] -> {"t.c": "month", "t.x": None}; одна колонка в двух зернах — общее мелкое"""
+    dims = {}
+    for key in keys:
+        column, _, grain = key.partition("@")
+        grain = grain or None
+        dims[column] = _finer(dims[column], grain) if column in dims else grain
+    return dims
+
+
+def _finer(a, b):
+    if a is None or b is None or a == b:
+        return a or b
+    return next(g for g in reversed(GRAINS) if GRAIN_COVERS[g] >= {a, b})
+
+
+def _is_exact(measures) -> bool:
+    """COUNT(DISTINCT) не складывается между строками — витрина только ровно в разрезе запроса"""
+    return any(m.startswith("count_distinct:") for m in measures)
+
+
+def hot_shapes(workload, min_hits: int = MIN_HITS, min_total_ms: float = MIN_TOTAL_MS) -> list:
+    """Горячие агрегатные формы по сырым таблицам, по убыванию суммарного времени"""
+    groups = {}
+    for r in workload.to_dict("records"):
+        measures, tables = r.get("measures"), r.get("tables")
+        if r.get("error") or r.get("unparsed") is True or not isinstance(measures, list) or not measures:
+            continue
+        keys = list(r["group_by"]) + list(r["filters"])
+        if (not set(tables) <= RAW_TABLES or sum(t in tables for t in FACT_TABLES) != 1
+                or any(m.startswith("other:") for m in measures) or any(k.startswith("?.") for k in keys)):
+            continue  # не агрегат по сырым таблицам или агрегат, который витрина не воспроизведёт
+        key = (tuple(tables), tuple(sorted(keys)), tuple(measures))
+        group = groups.setdefault(key, {"tables": list(tables), "dims": _dims(keys), "measures": list(measures),
+                                        "hits": 0, "runtimes": [], "sources": set(), "fingerprints": set(),
+                                        "example": r["sql"]})
+        group["hits"] += 1
+        group["sources"].add(r["source"])
+        group["fingerprints"].add(r["fingerprint"])
+        if not r.get("cached"):
+            group["runtimes"].append(float(r["runtime_ms"]))
+
+    shapes = []
+    for group in groups.values():
+        runtimes = sorted(group.pop("runtimes"))
+        group["total_ms"] = sum(runtimes)
+        group["p95_ms"] = runtimes[max(math.ceil(len(runtimes) * 0.95) - 1, 0)] if runtimes else 0.0
+        group["sources"], group["fingerprints"] = sorted(group["sources"]), sorted(group["fingerprints"])
+        if group["hits"] >= min_hits and group["total_ms"] >= min_total_ms and len(group["dims"]) <= MAX_DIMS:
+            shapes.append(group)
+    return sorted(shapes, key=lambda g: -g["total_ms"])
+
+
+def covers(mart: dict, shape: dict) -> bool:
+    """Запрос этой формы можно посчитать по витрине (дорагрегацией её строк)"""
+    if sorted(mart["tables"]) != sorted(shape["tables"]) or not set(shape["measures"]) <= set(mart["measures"]):
+        return False
+    if _is_exact(shape["measures"]):
+        return mart["dims"] == shape["dims"]
+    return all(column in mart["dims"] and (grain is None or grain in GRAIN_COVERS.get(mart["dims"][column], ()))
+               for column, grain in shape["dims"].items())
+
+
+def registered(directory: Path = MARTS_DIR) -> dict:
+    """{витрина: форма} уже созданных советником витрин (строка "-- shape:" в заголовке SQL)"""
+    marts = {}
+    for path in sorted(Path(directory).glob(f"{MART_PREFIX}*.sql")):
+        for line in path.read_text(encoding="utf-8").splitlines():
+            if line.startswith("-- shape: "):
+                marts[path.stem] = json.loads(line[len("-- shape: "):])
+                break
+    return marts
+
+
+# --- ПРЕДЛОЖЕНИЯ ---
+def propose(shapes: list, existing: dict = None, con=None, max_dims: int = MAX_DIMS,
+            max_row_ratio: float = MAX_ROW_RATIO) -> list:
+    """Витрины под горячие формы: формы с одинаковыми таблицами объединяются в одну витрину более мелкого
+    разреза, пока в ней не больше max_dims разрезов (и, если передано соединение, не больше max_row_ratio
+    строк таблицы фактов). Формы, которые уже покрывает созданная витрина, пропускаются."""
+    existing = registered() if existing is None else existing
+    proposals = []
+    for shape in shapes:
+        if any(covers(mart, shape) for mart in existing.values()):
+            continue
+        target = next((p for p in proposals if covers(p, shape)), None)
+        if target is None and not _is_exact(shape["measures"]):
+            for p in proposals:
+                if p["exact"] or p["tables"] != shape["tables"]:
+                    continue
+                merged = dict(p, dims=_dims([f"{c}@{g}" if g else c for d in (p["dims"], shape["dims"]) for c, g in d.items()]),
+                              measures=sorted(set(p["measures"]) | set(shape["measures"])))
+                if len(merged["dims"]) > max_dims:
+                    continue
+                if con is not None:
+                    rows, fact_rows = estimate_rows(con, merged)
+                    if rows > max_row_ratio * fact_rows:
+                        continue
+                p.update(dims=merged["dims"], measures=merged["measures"])
+                target = p
+                break
+        if target is None:
+            target = {"tables": list(shape["tables"]), "dims": dict(shape["dims"]), "measures": list(shape["measures"]),
+                      "exact": _is_exact(shape["measures"]), "shapes": 0, "hits": 0, "total_ms": 0.0, "examples": []}
+            proposals.append(target)
+        target["shapes"] += 1
+        target["hits"] += shape["hits"]
+        target["total_ms"] += shape["total_ms"]
+        target["examples"].append(shape["example"])
+
+    for p in proposals:
+        p["name"] = mart_name(p)
+        p["rows"], p["fact_rows"] = estimate_rows(con, p) if con is not None else (None, None)
+        p["too_big"] = p["rows"] is not None and p["rows"] > max_row_ratio * p["fact_rows"]
+    return sorted(proposals, key=lambda p: -p["total_ms"])
+
+
+def _shape_of(proposal: dict) -> dict:
+    return {"tables": sorted(proposal["tables"]), "dims": dict(sorted(proposal["dims"].items())),
+            "measures": sorted(proposal["measures"]), "exact": proposal["exact"]}
+
+
+def mart_name(proposal: dict) -> str:
+    """insight_auto_<справочники>_<хэш формы> — одна форма всегда даёт одно имя"""
+    digest = hashlib.sha1(json.dumps(_shape_of(proposal), ensure_ascii=False).encode("utf-8")).hexdigest()[:6]
+    dimensions = [t for t in sorted(proposal["tables"]) if t not in FACT_TABLES] or ["prescriptions"]
+    return f"{MART_PREFIX}{'_'.join(dimensions)}_{digest}"
+
+
+# --- SQL ВИТРИНЫ ---
+def _fact(proposal: dict) -> str:
+    return next(t for t in FACT_TABLES if t in proposal["tables"])
+
+
+def _ref(key: str) -> str:
+    table, column = key.split(".", 1)
+    return f'{ALIASES[table]}."{column}"' if not re.fullmatch(r"\w+", column) else f"{ALIASES[table]}.{column}"
+
+
+def _ident(name: str) -> str:
+    return re.sub(r"\W+", "_", name).strip("_")
+
+
+def _from(proposal: dict) -> str:
+    fact = _fact(proposal)
+    lines = [f"FROM {fact} {ALIASES[fact]}"]
+    for table in sorted(t for t in proposal["tables"] if t != fact):
+        lines.append(f"JOIN {table} {ALIASES[table]} ON {JOINS[(fact, table)]}")
+    return "\n".join(lines)
+
+
+def _dimensions(proposal: dict) -> list:
+    """[(выражение, имя колонки, описание)] разрезов"""
+    columns = [key.split(".", 1)[1] for key in proposal["dims"]]
+    out = []
+    for key, grain in sorted(proposal["dims"].items()):
+        table, column = key.split(".", 1)
+        name = _ident(column if columns.count(column) == 1 else f"{table}_{column}")
+        if grain in (None, "day"):
+            out.append((_ref(key), name, column))
+        else:
+            out.append((f"date_trunc('{grain}', {_ref(key)})::DATE", f"{name}_{grain}", f"{GRAIN_LABELS[grain]} {column}"))
+    return out
+
+
+def _measures(proposal: dict) -> list:
+    """[(выражение, имя колонки, описание)] мер; AVG хранится суммой и количеством"""
+    out = {}
+    for measure in sorted(proposal["measures"]):
+        if measure == "count":
+            out["prescriptions"] = ("COUNT(*)", "число рецептов")
+            continue
+        kind, key = measure.split(":", 1)
+        column = key.split(".", 1)[1]
+        name = _ident(column)
+        if kind in ("sum", "avg"):
+            out[f"sum_{name}"] = (f"SUM({_ref(key)})", f"сумма {column}")
+        if kind in ("count", "avg"):
+            out[f"count_{name}"] = (f"COUNT({_ref(key)})", f"число непустых {column}")
+        if kind in ("min", "max"):
+            out[f"{kind}_{name}"] = (f"{kind.upper()}({_ref(key)})", f"{'минимум' if kind == 'min' else 'максимум'} {column}")
+        if kind == "count_distinct":
+            out[f"distinct_{name}"] = (f"COUNT(DISTINCT {_ref(key)})",
+                                       f"уникальные {column} ровно в этом разрезе (между строками НЕ складывать)")
+    return [(expr, name, label) for name, (expr, label) in out.items()]
+
+
+def description(proposal: dict) -> str:
+    """Описание для промпта агента (как TABLE_DESCRIPTIONS): что лежит в витрине и как из неё считать"""
+    rows = f", ~{proposal['rows']:_} строк".replace("_", " ") if proposal.get("rows") is not None else ""
+    dims = ", ".join(label if label == name else f"{label} ({name})" for _, name, label in _dimensions(proposal))
+    measures = "; ".join(f"{name} = {label}" for _, name, label in _measures(proposal))
+    averages = [m.split(":", 1)[1].split(".", 1)[1] for m in proposal["measures"] if m.startswith("avg:")]
+    hint = "".join(f" Среднее {c} = sum_{_ident(c)} / count_{_ident(c)}." for c in averages)
+    subject = ", ".join(LABELS[t] for t in sorted(proposal["tables"], key=lambda t: t not in FACT_TABLES))
+    return (f"ВИТРИНА (авто{rows}). Агрегаты: {subject} {'по разрезам ' + dims if dims else 'без разрезов'}. "
+            f"Поля: {measures}.{hint} Дорагрегируй её вместо подсчёта по сырым таблицам.")
+
+
+def render_sql(proposal: dict) -> str:
+    dimensions, measures = _dimensions(proposal), _measures(proposal)
+    select = [f"    {expr} AS {name}" for expr, name, _ in dimensions + measures]
+    select.append("    CURRENT_TIMESTAMP AS date_updated")
+    example = " ".join(proposal["examples"][0].split())[:300] if proposal.get("examples") else ""
+    header = [
+        f"-- Витрина создана mart_advisor.py по журналу нагрузки (форм запросов: {proposal.get('shapes', 0)},",
+        f"-- запросов: {proposal.get('hits', 0)}, на сырых таблицах: {proposal.get('total_ms', 0) / 1000:.1f} сек). Пример запроса:",
+        f"--   {example}",
+        f"-- shape: {json.dumps(_shape_of(proposal), ensure_ascii=False)}",
+    ]
+    group_by = f"\nGROUP BY {', '.join(str(i + 1) for i in range(len(dimensions)))}" if dimensions else ""
+    comment = description(proposal).replace("'", "''")
+    return ("\n".join(header) + f"\nCREATE OR REPLACE TABLE {proposal['name']} AS\nSELECT\n" + ",\n".join(select)
+            + f"\n{_from(proposal)}{group_by};\n\nCOMMENT ON TABLE {proposal['name']} IS '{comment}';\n")
+
+
+def estimate_rows(con, proposal: dict) -> tuple:
+    """(строк в витрине, строк в таблице фактов) — одним проходом по сырым таблицам"""
+    dims = ", ".join(expr for expr, _, _ in _dimensions(proposal)) or "1"
+    rows = con.execute(f"SELECT COUNT(*) FROM (SELECT {dims}\n{_from(proposal)}\nGROUP BY ALL)").fetchone()[0]
+    fact_rows = con.execute(f"SELECT COUNT(*) FROM {_fact(proposal)}").fetchone()[0]
+    return rows, fact_rows
+
+
+def write(proposal: dict, directory: Path = MARTS_DIR) -> Path:
+    path = Path(directory) / f"{proposal['name']}.sql"
+    path.write_text(render_sql(proposal), encoding="utf-8")
+    return path
+
+
+def advise(path: str = workload_log.WORKLOAD_PATH, since_days: float = None, con=None, **limits) -> tuple:
+    """(горячие формы, предложения) по журналу нагрузки"""
+    shapes = hot_shapes(workload_log.load(path, since_days),
+                        **{k: v for k, v in limits.items() if k in ("min_hits", "min_total_ms")})
+    return shapes, propose(shapes, con=con, **{k: v for k, v in limits.items() if k in ("max_dims", "max_row_ratio")})
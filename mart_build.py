@@ -0,0 +1,307 @@
+import re
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+import marts
+
+# --- КОНФИГУРАЦИЯ ---
+# Сборка витрин из scripts_db/marts/*.sql: зависимости выводятся из таблиц, которые скрипт читает и пишет,
+# независимые витрины считаются параллельно (у каждой своё соединение-курсор к той же базе).
+MARTS_DIR = Path(__file__).parent / "scripts_db" / "marts"
+BUILD_TABLE = "_mart_build"
+WORKERS = 4
+ENGINE_STAGE = "marts.py"     # витрины из marts.MARTS обновляются инкрементально одним этапом
+MEMORY_POLL = 0.05            # сек между замерами памяти DuckDB
+
+# Исходные таблицы -> источник в _ingest_state (его контрольная сумма и водяной знак = версия данных)
+INGEST_SOURCES = {
+    "prescriptions": "prescriptions",
+    "prescriptions_fact": "prescriptions",
+    "_keys_patients": "patients",
+    "_keys_diagnoses": "diagnoses",
+    "_keys_drugs": "drugs",
+    "patients": "patients",
+    "diagnoses": "diagnoses",
+    "drugs": "drugs",
+}
+
+_WRITES = re.compile(
+    r"\b(?:CREATE\s+(?:OR\s+REPLACE\s+)?(?:TABLE|VIEW)(?:\s+IF\s+NOT\s+EXISTS)?|INSERT\s+(?:OR\s+\w+\s+)?INTO|DELETE\s+FROM|UPDATE)"
+    r"\s+\"?(\w+)\"?", re.IGNORECASE)
+_READS = re.compile(r"\b(?:FROM|JOIN)\s+\"?(\w+)\b\"?(?!\s*\()", re.IGNORECASE)
+_CTES = re.compile(r"\b(\w+)\s+AS\s*\(", re.IGNORECASE)
+
+
+def _strip_comments(sql: str) -> str:
+    return re.sub(r"--[^\n]*", "", sql)
+
+
+def tables_of(sql: str) -> tuple:
+    """(читаемые, записываемые) таблицы скрипта — по FROM/JOIN и CREATE/INSERT/UPDATE/DELETE, без CTE"""
+    sql = _strip_comments(sql)
+    writes = {t.lower() for t in _WRITES.findall(sql)}
+    ctes = {t.lower() for t in _CTES.findall(sql)}
+    # DELETE FROM x и таблицы, которые скрипт сам создаёт, — не входы
+    reads = {t.lower() for t in _READS.findall(sql)} - ctes - writes
+    return reads, writes
+
+
+class Stage:
+    """Этап сборки: SQL-файл витрины или инкрементальный движок marts.py"""
+
+    def __init__(self, name: str, sql, reads: set, writes: set, text: str):
+        self.name = name
+        self.sql = sql          # None — этап marts.refresh
+        self.reads = reads
+        self.writes = writes
+        self.text = text        # что хэшируем в подпись (код этапа)
+        self.deps = set()
+
+
+def discover(directory: Path = MARTS_DIR, files=None) -> dict:
+    """{этап: Stage} со связями deps; витрины marts.MARTS объединяются в один этап движка"""
+    paths = [Path(f) for f in files] if files else sorted(Path(directory).glob("*.sql"))
+    stages, engine_reads, engine_writes, engine_text = {}, set(), set(), ""
+    for path in paths:
+        text = path.read_text(encoding="utf-8")
+        reads, writes = tables_of(text)
+        if path.stem in marts.MARTS and not files:
+            # Файл — эталон полного пересчёта, а обновляет витрину движок по дельте
+            engine_reads |= reads
+            engine_writes |= writes
+            engine_text += text
+            continue
+        stages[path.stem] = Stage(path.stem, text, reads, writes, text)
+    if engine_writes:
+        stages[ENGINE_STAGE] = Stage(ENGINE_STAGE, None, engine_reads, engine_writes, engine_text)
+
+    producers = {table: stage.name for stage in stages.values() for table in stage.writes}
+    for stage in stages.values():
+        stage.deps = {producers[t] for t in stage.reads if t in producers and producers[t] != stage.name}
+    _check_cycles(stages)
+    return stages
+
+
+def _check_cycles(stages: dict):
+    done, visiting = set(), set()
+
+    def visit(name, path):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Циклическая зависимость витрин: {' -> '.join(path + [name])}")
+        visiting.add(name)
+        for dep in stages[name].deps:
+            visit(dep, path + [name])
+        visiting.discard(name)
+        done.add(name)
+
+    for name in stages:
+        visit(name, [])
+
+
+# --- ПОДПИСЬ ВХОДОВ ---
+def _exists(con, table: str) -> bool:
+    """Таблица или представление в базе (временные таблицы этапов не считаются)"""
+    return con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE lower(table_name) = ? AND table_catalog <> 'temp'", [table.lower()]
+    ).fetchone()[0] > 0
+
+
+def _ensure_build_table(con):
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {BUILD_TABLE} (
+            stage VARCHAR PRIMARY KEY,
+            signature VARCHAR,       -- хэш кода этапа и версий входных таблиц
+            built_at TIMESTAMP,
+            seconds DOUBLE,
+            rows BIGINT,
+            peak_memory BIGINT       -- пик памяти DuckDB за время этапа, байт
+        )
+    """)
+
+
+def _table_version(con, table: str, producers: dict, built: dict) -> str:
+    """Версия входа: для исходных таблиц — контрольная сумма CSV, для витрин — когда их собрали"""
+    if table in producers:
+        return f"{table}@{built.get(producers[table])}"
+    source = INGEST_SOURCES.get(table)
+    if source and _exists(con, "_ingest_state"):
+        row = con.execute("SELECT checksum, watermark FROM _ingest_state WHERE source = ?", [source]).fetchone()
+        if row:
+            return f"{table}:{row[0]}:{row[1]}"
+    # Таблица без истории загрузки (созданная вручную) — число строк и колонки
+    if not _exists(con, table):
+        return f"{table}:missing"
+    count = con.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+    columns = ",".join(f"{r[0]} {r[1]}" for r in con.execute(f'DESCRIBE "{table}"').fetchall())
+    return f"{table}:{count}:{columns}"
+
+
+def signature(con, stage: Stage, producers: dict, built: dict) -> str:
+    parts = [stage.text] + [_table_version(con, t, producers, built) for t in sorted(stage.reads)]
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def _previous_builds(con) -> dict:
+    if not _exists(con, BUILD_TABLE):
+        return {}
+    return {row[0]: (row[1], str(row[2])) for row in con.execute(f"SELECT stage, signature, built_at FROM {BUILD_TABLE}").fetchall()}
+
+
+def plan(con, stages: dict, force: bool = False) -> dict:
+    """{этап: "run"|"skip"} без изменений в базе.
+
+    Этап пропускается, если подпись входов совпадает с прошлой сборкой и все его таблицы на месте.
+    Если пересобирается зависимость, этап тоже пересобирается.
+    """
+    previous = _previous_builds(con)
+    producers = {table: s.name for s in stages.values() for table in s.writes}
+    built = {name: when for name, (_, when) in previous.items()}
+    result = {}
+    for name in _topological(stages):
+        stage = stages[name]
+        changed_dep = any(result[d] == "run" for d in stage.deps)
+        same = name in previous and previous[name][0] == signature(con, stage, producers, built)
+        present = all(_exists(con, t) for t in stage.writes)
+        result[name] = "skip" if not force and not changed_dep and same and present else "run"
+    return result
+
+
+def _topological(stages: dict) -> list:
+    order, done = [], set()
+
+    def visit(name):
+        if name in done:
+            return
+        done.add(name)
+        for dep in sorted(stages[name].deps):
+            visit(dep)
+        order.append(name)
+
+    for name in sorted(stages):
+        visit(name)
+    return order
+
+
+# --- ВЫПОЛНЕНИЕ ---
+class _MemorySampler(threading.Thread):
+    """Фоновые замеры памяти DuckDB: пик за окно времени этапа (общий для параллельных этапов)"""
+
+    def __init__(self, con):
+        super().__init__(daemon=True)
+        self.con = con.cursor()
+        self.samples = []
+        self.stop = threading.Event()
+
+    def run(self):
+        while not self.stop.is_set():
+            used = self.con.execute("SELECT SUM(memory_usage_bytes) FROM duckdb_memory()").fetchone()[0] or 0
+            self.samples.append((time.perf_counter(), int(used)))
+            self.stop.wait(MEMORY_POLL)
+
+    def peak(self, start: float, end: float) -> int:
+        return max((used for t, used in list(self.samples) if start <= t <= end), default=0)
+
+
+def _run_stage(con, stage: Stage) -> dict:
+    cursor = con.cursor()  # отдельное соединение к той же базе: этапы идут параллельно
+    start = time.perf_counter()
+    try:
+        if stage.sql is None:
+            details = marts.refresh(cursor)
+        else:
+            for statement in cursor.extract_statements(stage.sql):
+                cursor.execute(statement)
+            details = None
+        rows = sum(cursor.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0] for t in sorted(stage.writes) if _exists(cursor, t))
+    finally:
+        cursor.close()
+    return {"start": start, "end": time.perf_counter(), "rows": rows, "details": details}
+
+
+def build(con, names=None, force: bool = False, workers: int = WORKERS, stages: dict = None) -> dict:
+    """Собирает витрины на пишущем соединении с учётом зависимостей.
+
+    names — собрать только эти этапы (и те их зависимости, что устарели).
+    Возвращает {этап: {"status": "built"|"skipped"|"failed"|"blocked", "seconds", "rows", "peak_memory", ...}}.
+    При ошибке этапа зависящие от него не запускаются, а в конце поднимается исключение —
+    снимок с полусобранными витринами не публикуется.
+    """
+    stages = stages or discover()
+    if names:
+        wanted = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name not in wanted:
+                wanted.add(name)
+                pending.extend(stages[name].deps)
+        stages = {name: stages[name] for name in wanted}
+        for stage in stages.values():
+            stage.deps &= wanted
+    decisions = plan(con, stages, force)
+    _ensure_build_table(con)
+    producers = {table: s.name for s in stages.values() for table in s.writes}
+    built = {name: when for name, (_, when) in _previous_builds(con).items()}
+
+    report = {name: {"status": "skipped", "seconds": 0.0, "rows": None, "peak_memory": None}
+              for name, decision in decisions.items() if decision == "skip"}
+    waiting = {name for name, decision in decisions.items() if decision == "run"}
+    running, errors = {}, []
+    sampler = _MemorySampler(con)
+    sampler.start()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            while waiting or running:
+                for name in sorted(waiting):
+                    deps = stages[name].deps
+                    if any(report.get(d, {}).get("status") in ("failed", "blocked") for d in deps):
+                        report[name] = {"status": "blocked", "seconds": 0.0, "rows": None, "peak_memory": None}
+                        waiting.discard(name)
+                    elif all(d in report for d in deps):
+                        # Подпись считаем до запуска: входы уже собраны и больше не меняются
+                        sig = signature(con, stages[name], producers, built)
+                        running[pool.submit(_run_stage, con, stages[name])] = (name, sig)
+                        waiting.discard(name)
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name, sig = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        errors.append(f"{name}: {e}")
+                        report[name] = {"status": "failed", "seconds": 0.0, "rows": None, "peak_memory": None, "error": str(e)}
+                        continue
+                    seconds = result["end"] - result["start"]
+                    peak = sampler.peak(result["start"], result["end"])
+                    # Журнал пишем из одного потока — параллельные записи в одну таблицу конфликтуют
+                    con.execute(f"INSERT OR REPLACE INTO {BUILD_TABLE} VALUES (?, ?, now()::TIMESTAMP, ?, ?, ?)",
+                                [name, sig, seconds, result["rows"], peak])
+                    built[name] = str(con.execute(f"SELECT built_at FROM {BUILD_TABLE} WHERE stage = ?", [name]).fetchone()[0])
+                    report[name] = {"status": "built", "seconds": seconds, "rows": result["rows"],
+                                    "peak_memory": peak, "details": result["details"]}
+    finally:
+        sampler.stop.set()
+        sampler.join()
+    if errors:
+        raise RuntimeError("Сборка витрин не удалась: " + "; ".join(errors))
+    return {name: report[name] for name in _topological(stages)}
+
+
+def format_report(report: dict) -> str:
+    lines = [f"   {'этап':<32} {'статус':<8} {'сек':>7} {'строк':>10} {'память':>9}"]
+    for name, r in report.items():
+        rows = f"{r['rows']:,}" if r["rows"] is not None else "—"
+        memory = f"{r['peak_memory'] / 2**20:.0f} МБ" if r["peak_memory"] is not None else "—"
+        lines.append(f"   {name:<32} {r['status']:<8} {r['seconds']:>7.2f} {rows:>10} {memory:>9}")
+        for mart, d in (r.get("details") or {}).items():
+            lines.append(f"     └ {mart:<28} {d['mode']:<8} {d['seconds']:>7.2f} {d['rows']:>10,}")
+        if r.get("error"):
+            lines.append(f"     ❌ {r['error']}")
+    return "\n".join(lines)
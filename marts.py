@@ -0,0 +1,305 @@
+import time
+from pathlib import Path
+
+# --- КОНФИГУРАЦИЯ ---
+# Инкрементальное обслуживание витрин insight_*.
+# Каждая витрина хранит сливаемые частичные агрегаты (суммы, счётчики, суммы на пациента) в служебных
+# таблицах _mart_*. Обновление прогоняет через них только рецепты новее водяного знака витрины,
+# поэтому стоимость пересчёта растёт с объёмом новых данных, а не со всей историей.
+STATE_TABLE = "_mart_state"
+FACT_TABLE = "prescriptions_fact"
+REFERENCE_DIR = Path(__file__).parent / "scripts_db" / "marts"  # эталонный полный пересчёт: <витрина>.sql
+TOLERANCE = 1e-9  # относительная погрешность сравнения DOUBLE в --verify (порядок суммирования другой)
+
+# Возраст на дату рецепта: у уже посчитанных строк он не меняется со временем
+AGE_GROUP = """
+    CASE
+        WHEN date_diff('year', pa.дата_рождения, p.дата_рецепта) < 18 THEN '0-17'
+        WHEN date_diff('year', pa.дата_рождения, p.дата_рецепта) < 35 THEN '18-34'
+        WHEN date_diff('year', pa.дата_рождения, p.дата_рецепта) < 60 THEN '35-59'
+        ELSE '60+'
+    END"""
+
+# Рецепты со всеми атрибутами справочников. LEFT JOIN: каждая витрина сама решает,
+# какие связи обязательны (как INNER JOIN в её эталонном SQL)
+DELTA_COLUMNS = f"""
+    p.дата_рецепта,
+    {{patient}} AS id_пациента,
+    pa.id_пациента IS NOT NULL AS patient_found,
+    pa.пол::VARCHAR AS пол,
+    pa.район_проживания::VARCHAR AS region,
+    {AGE_GROUP} AS age_group,
+    d.код_мкб,
+    d.класс_заболевания::VARCHAR AS disease_group,
+    dr.код_препарата,
+    dr."Торговое название" AS drug_name,
+    dr.стоимость AS cost"""
+
+DELTA_SOURCES = {
+    # Компактная схема: JOIN по целочисленным ключам, id пациента — из карты ключей (есть и у «сирот»)
+    "keyed": ("kp.id_пациента", f"""
+        {FACT_TABLE} p
+        JOIN _keys_patients kp ON p.patient_key = kp.patient_key
+        LEFT JOIN patients pa ON p.patient_key = pa.patient_key
+        LEFT JOIN diagnoses d ON p.diagnosis_key = d.diagnosis_key
+        LEFT JOIN drugs dr ON p.drug_key = dr.drug_key"""),
+    "legacy": ("p.id_пациента", """
+        prescriptions p
+        LEFT JOIN patients pa ON p.id_пациента = pa.id_пациента
+        LEFT JOIN diagnoses d ON p.код_диагноза = d.код_мкб
+        LEFT JOIN drugs dr ON p.код_препарата = dr.код_препарата"""),
+}
+
+# Витрина -> служебные таблицы состояния и финальный SQL.
+#   states: таблица -> (ключи, аддитивные колонки, SELECT частичных агрегатов из _mart_delta)
+#           без аддитивных колонок таблица — множество (новые ключи дописываются, старые не меняются)
+#   keys:   ключ строки витрины (для --verify)
+MARTS = {
+    "insight_cost_by_disease": {
+        "states": {
+            "_mart_cost_patient": (
+                ["disease_group", "id_пациента"], ["cost_sum", "prescriptions"],
+                """SELECT disease_group, id_пациента, SUM(cost) AS cost_sum, COUNT(*) AS prescriptions
+                   FROM _mart_delta WHERE код_мкб IS NOT NULL AND код_препарата IS NOT NULL
+                   GROUP BY disease_group, id_пациента"""),
+            "_mart_cost_drug": (
+                ["disease_group", "drug_name", "cost"], [],
+                """SELECT DISTINCT disease_group, drug_name, cost
+                   FROM _mart_delta WHERE код_мкб IS NOT NULL AND код_препарата IS NOT NULL"""),
+        },
+        "final": """
+            CREATE OR REPLACE TABLE insight_cost_by_disease AS
+            WITH agg AS (
+                SELECT
+                    disease_group,
+                    SUM(cost_sum) * 1.0 / SUM(prescriptions) AS avg_cost_per_prescription,
+                    AVG(cost_sum) AS avg_cost_per_patient,
+                    COUNT(*) AS total_patients,
+                    SUM(prescriptions) AS total_prescriptions
+                FROM _mart_cost_patient
+                GROUP BY disease_group
+            ),
+            -- Ранжируются различные препараты (как в scripts_db/marts/insight_cost_by_disease.sql), не строки рецептов
+            top_ranked_drugs AS (
+                SELECT
+                    disease_group,
+                    drug_name,
+                    ROW_NUMBER() OVER (PARTITION BY disease_group ORDER BY MAX(cost) DESC, drug_name) AS rn
+                FROM _mart_cost_drug
+                GROUP BY disease_group, drug_name
+            ),
+            top_drugs AS (
+                SELECT disease_group, ARRAY_TO_STRING(ARRAY_AGG(drug_name ORDER BY rn), ', ') AS top_expensive_drugs
+                FROM top_ranked_drugs
+                WHERE rn <= 3
+                GROUP BY disease_group
+            )
+            SELECT
+                a.disease_group,
+                a.avg_cost_per_prescription,
+                a.avg_cost_per_patient,
+                td.top_expensive_drugs,
+                a.total_patients,
+                a.total_prescriptions,
+                CURRENT_TIMESTAMP AS date_updated
+            FROM agg a
+            JOIN top_drugs td ON a.disease_group = td.disease_group
+        """,
+        "keys": ["disease_group"],
+    },
+    "insight_gender_disease": {
+        "states": {
+            "_mart_gender_patient": (
+                ["disease_group", "age_group", "id_пациента", "пол"], [],
+                """SELECT DISTINCT disease_group, age_group, id_пациента, пол
+                   FROM _mart_delta WHERE patient_found AND код_мкб IS NOT NULL"""),
+        },
+        "final": """
+            CREATE OR REPLACE TABLE insight_gender_disease AS
+            SELECT
+                disease_group,
+                age_group,
+                COUNT(*) FILTER (WHERE пол = 'М') AS male_patients,
+                COUNT(*) FILTER (WHERE пол = 'Ж') AS female_patients,
+                COUNT(*) FILTER (WHERE пол = 'Ж') - COUNT(*) FILTER (WHERE пол = 'М') AS female_minus_male,
+                CURRENT_TIMESTAMP AS date_updated
+            FROM _mart_gender_patient
+            GROUP BY disease_group, age_group
+        """,
+        "keys": ["disease_group", "age_group"],
+    },
+    "insight_region_drug_choice": {
+        "states": {
+            "_mart_region_drug": (
+                ["region", "disease_group", "drug_name"], ["prescriptions_count"],
+                """SELECT region, disease_group, drug_name, COUNT(*) AS prescriptions_count
+                   FROM _mart_delta
+                   WHERE patient_found AND код_мкб IS NOT NULL AND код_препарата IS NOT NULL
+                   GROUP BY region, disease_group, drug_name"""),
+        },
+        "final": """
+            CREATE OR REPLACE TABLE insight_region_drug_choice AS
+            SELECT
+                region,
+                disease_group,
+                drug_name,
+                prescriptions_count,
+                prescriptions_count * 1.0 / SUM(prescriptions_count) OVER (PARTITION BY region, disease_group) AS prescriptions_share,
+                CURRENT_TIMESTAMP AS date_updated
+            FROM _mart_region_drug
+        """,
+        "keys": ["region", "disease_group", "drug_name"],
+    },
+}
+
+
+# --- СОСТОЯНИЕ ---
+def _exists(con, table: str) -> bool:
+    return con.execute(
+        "SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ? AND NOT temporary", [table]
+    ).fetchone()[0] > 0
+
+
+def _ensure_state(con):
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            mart VARCHAR PRIMARY KEY,
+            watermark TIMESTAMP,     -- рецепты с датой <= watermark уже учтены
+            dimensions VARCHAR,      -- контрольные суммы справочников на момент пересчёта
+            rows_applied BIGINT,
+            refreshed_at TIMESTAMP
+        )
+    """)
+
+
+def _dimensions_signature(con):
+    """Контрольные суммы CSV справочников из _ingest_state (01_setup_db.py).
+
+    Изменился справочник — поменялись цены, классы или пол, и частичные агрегаты
+    устарели целиком: такую витрину пересчитываем полностью.
+    """
+    if not _exists(con, "_ingest_state"):
+        return None
+    return con.execute(
+        "SELECT string_agg(source || ':' || checksum, ',' ORDER BY source) FROM _ingest_state WHERE source <> 'prescriptions'"
+    ).fetchone()[0]
+
+
+def _fact(con) -> str:
+    return FACT_TABLE if _exists(con, FACT_TABLE) else "prescriptions"
+
+
+def _build_delta(con, watermark):
+    """_mart_delta: рецепты новее watermark (None — вся история) с атрибутами справочников"""
+    patient, source = DELTA_SOURCES["keyed" if _exists(con, FACT_TABLE) else "legacy"]
+    where, params = ("WHERE p.дата_рецепта > ?", [watermark]) if watermark is not None else ("", [])
+    con.execute(f"CREATE OR REPLACE TEMP TABLE _mart_delta AS SELECT {DELTA_COLUMNS.format(patient=patient)} FROM {source} {where}", params)
+    return con.execute("SELECT COUNT(*) FROM _mart_delta").fetchone()[0]
+
+
+def merge_state(con, table: str, keys: list, sums: list, select: str):
+    """Сливает частичные агрегаты порции в таблицу состояния: совпавшие ключи — складываем, новые — дописываем"""
+    con.execute(f"CREATE OR REPLACE TEMP TABLE _mart_part AS {select}")
+    if not _exists(con, table):
+        con.execute(f"CREATE TABLE {table} AS SELECT * FROM _mart_part")
+        return
+    match = " AND ".join(f"s.{k} IS NOT DISTINCT FROM d.{k}" for k in keys)
+    if sums:
+        assignments = ", ".join(f"{c} = s.{c} + d.{c}" for c in sums)
+        con.execute(f"UPDATE {table} AS s SET {assignments} FROM _mart_part d WHERE {match}")
+    con.execute(f"INSERT INTO {table} SELECT d.* FROM _mart_part d WHERE NOT EXISTS (SELECT 1 FROM {table} s WHERE {match})")
+
+
+# --- ОБНОВЛЕНИЕ ---
+def plan(con, names=None, full: bool = False) -> dict:
+    """{витрина: (режим, водяной знак порции)} без изменений в базе (годится и для read-only соединения).
+
+    full — нет витрины или её состояния, изменились справочники или full=True; порция — вся история.
+    delta — есть рецепты новее водяного знака; skip — новых рецептов нет.
+    """
+    dimensions = _dimensions_signature(con)
+    latest = con.execute(f"SELECT max(дата_рецепта) FROM {_fact(con)}").fetchone()[0]
+    states = {}
+    if _exists(con, STATE_TABLE):
+        states = {row[0]: (row[1], row[2]) for row in con.execute(f"SELECT mart, watermark, dimensions FROM {STATE_TABLE}").fetchall()}
+    result = {}
+    for name in names or MARTS:
+        state = states.get(name)
+        if (full or state is None or state[1] != dimensions or not _exists(con, name)
+                or not all(_exists(con, table) for table in MARTS[name]["states"])):
+            result[name] = ("full", None)
+        else:
+            result[name] = ("skip" if state[0] == latest else "delta", state[0])
+    return result
+
+
+def refresh(con, names=None, full: bool = False) -> dict:
+    """Обновляет витрины на открытом (пишущем) соединении.
+
+    Возвращает {витрина: {"mode": "delta"|"full"|"skip", "rows": рецептов в порции, "seconds": ...}}.
+    """
+    steps = plan(con, names, full)
+    _ensure_state(con)
+    dimensions = _dimensions_signature(con)
+    latest = con.execute(f"SELECT max(дата_рецепта) FROM {_fact(con)}").fetchone()[0]
+    built_for, rows = "missing", 0  # для какого водяного знака сейчас собрана _mart_delta
+    report = {}
+    for name, (mode, watermark) in steps.items():
+        mart = MARTS[name]
+        start = time.perf_counter()
+        if mode == "skip":
+            report[name] = {"mode": mode, "rows": 0, "seconds": 0.0}
+            continue
+        if mode == "full":
+            for table in mart["states"]:
+                con.execute(f"DROP TABLE IF EXISTS {table}")
+        # Обычно у всех витрин один водяной знак — порция собирается один раз
+        if built_for != watermark:
+            rows = _build_delta(con, watermark)
+            built_for = watermark
+        for table, (keys, sums, select) in mart["states"].items():
+            merge_state(con, table, keys, sums, select)
+        con.execute(mart["final"])
+        con.execute(f"INSERT OR REPLACE INTO {STATE_TABLE} VALUES (?, ?, ?, ?, now()::TIMESTAMP)",
+                    [name, latest, dimensions, rows])
+        report[name] = {"mode": mode, "rows": rows, "seconds": time.perf_counter() - start}
+    con.execute("DROP TABLE IF EXISTS _mart_delta")
+    con.execute("DROP TABLE IF EXISTS _mart_part")
+    return report
+
+
+# --- ПРОВЕРКА ---
+def reference_sql(name: str) -> str:
+    """Эталонный полный пересчёт витрины из scripts_db/marts/<витрина>.sql"""
+    return (REFERENCE_DIR / f"{name}.sql").read_text(encoding="utf-8")
+
+
+def verify(con, names=None, tolerance: float = TOLERANCE) -> dict:
+    """Сравнивает инкрементальные витрины с полным пересчётом по эталонному SQL.
+
+    Эталон считается во временную таблицу (соединение может быть read-only).
+    Возвращает {витрина: число расхождений (строки, которых нет с одной из сторон, или с другими значениями)}.
+    """
+    result = {}
+    for name in names or MARTS:
+        keys = MARTS[name]["keys"]
+        sql = reference_sql(name).replace(f"CREATE OR REPLACE TABLE {name} AS", "CREATE OR REPLACE TEMP TABLE _mart_reference AS", 1)
+        con.execute(sql)
+        columns = [(row[0], row[1]) for row in con.execute("DESCRIBE _mart_reference").fetchall()
+                   if row[0] != "date_updated" and row[0] not in keys]
+        differs = []
+        for column, dtype in columns:
+            if dtype in ("DOUBLE", "FLOAT") or dtype.startswith("DECIMAL"):
+                differs.append(f"abs(r.{column} - m.{column}) > {tolerance} * greatest(1, abs(r.{column}))"
+                               f" OR (r.{column} IS NULL) <> (m.{column} IS NULL)")
+            else:
+                differs.append(f"r.{column} IS DISTINCT FROM m.{column}")
+        on = " AND ".join(f"r.{k} IS NOT DISTINCT FROM m.{k}" for k in keys)
+        # FULL JOIN по ключам: строки, которой нет с одной из сторон, видно по _row IS NULL
+        result[name] = con.execute(f"""
+            SELECT COUNT(*) FROM (SELECT *, true AS _row FROM _mart_reference) r
+            FULL JOIN (SELECT *, true AS _row FROM {name}) m ON {on}
+            WHERE r._row IS NULL OR m._row IS NULL OR {' OR '.join(differs) or 'false'}
+        """).fetchone()[0]
+        con.execute("DROP TABLE _mart_reference")
+    return result
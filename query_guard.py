@@ -0,0 +1,59 @@
+import os
+import json
+
+# --- КОНФИГУРАЦИЯ ---
+MAX_OPERATOR_ROWS = int(os.getenv("QUERY_MAX_ROWS", "50000000"))   # оценка строк на одном операторе плана
+MAX_PLAN_COST = int(os.getenv("QUERY_MAX_COST", "200000000"))      # сумма оценок по всем операторам
+# DuckDB разрешает memory_limit и threads только на уровне всей базы, поэтому
+# они задаются пулу при подключении, а не отдельному запросу
+MEMORY_LIMIT = os.getenv("SQL_MEMORY_LIMIT", "4GB")
+THREADS = int(os.getenv("SQL_THREADS", str(os.cpu_count() or 4)))
+
+# Декартовы и theta-соединения: выход ограничен только произведением входов. Своя оценка DuckDB у них
+# сильно занижена (theta-join 200k x 20k оценивается в ~3 млн строк), поэтому берём максимум из неё и произведения
+CARTESIAN_OPERATORS = {"CROSS_PRODUCT", "NESTED_LOOP_JOIN", "BLOCKWISE_NL_JOIN", "PIECEWISE_MERGE_JOIN", "IE_JOIN"}
+
+
+def _walk(node: dict, stats: dict) -> int:
+    """Обходит JSON-план, возвращает оценку строк узла и копит статистику"""
+    child_rows = [_walk(child, stats) for child in node.get("children", [])]
+    name = node.get("name", "")
+    estimate = node.get("extra_info", {}).get("Estimated Cardinality")
+    if name in CARTESIAN_OPERATORS and len(child_rows) == 2:
+        rows = max(int(float(estimate or 0)), child_rows[0] * child_rows[1])
+    elif estimate is not None:
+        rows = int(float(estimate))
+    else:
+        rows = max(child_rows, default=0)
+
+    stats["cost"] += rows
+    if rows > stats["max_rows"]:
+        stats["max_rows"], stats["operator"] = rows, name
+    return rows
+
+
+def estimate(con, query: str, params=None) -> dict:
+    """Оценка плана без выполнения: {"max_rows", "operator", "cost"}"""
+    plan = con.execute("EXPLAIN (FORMAT json) " + query, params).fetchall()
+    stats = {"max_rows": 0, "operator": None, "cost": 0}
+    for _, plan_json in plan:
+        for node in json.loads(plan_json):
+            _walk(node, stats)
+    return stats
+
+
+def check(con, query: str, params=None):
+    """Возвращает текст причины отказа (для LLM) или None, если запрос в бюджете"""
+    stats = estimate(con, query, params)
+    if stats["max_rows"] > MAX_OPERATOR_ROWS:
+        hint = " Похоже на декартово произведение — проверь условия JOIN." if stats["operator"] in CARTESIAN_OPERATORS else ""
+        return (
+            f"Query Guard: запрос отклонён до выполнения. Оператор {stats['operator']} даст ~{stats['max_rows']:,} строк "
+            f"(лимит {MAX_OPERATOR_ROWS:,}).{hint} Добавь фильтры, агрегируй раньше или используй витрину insight_..."
+        )
+    if stats["cost"] > MAX_PLAN_COST:
+        return (
+            f"Query Guard: запрос отклонён до выполнения. Оценочная стоимость плана ~{stats['cost']:,} строк "
+            f"(лимит {MAX_PLAN_COST:,}). Упрости запрос: меньше JOIN, фильтры раньше, витрины insight_..."
+        )
+    return None
@@ -0,0 +1,103 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+
+from ru_text import normalize_text
+
+# --- КОНФИГУРАЦИЯ ---
+CACHE_PATH = "db/question_cache.json"
+MAX_ENTRIES = int(os.getenv("QUESTION_CACHE_SIZE", "500"))
+
+
+class QuestionSQLCache:
+    """Кэш "вопрос -> проверенный SQL" с LRU-вытеснением, хранится рядом с базой.
+
+    Весь кэш сбрасывается, если изменилась версия базы (файл пересобрали).
+    """
+
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db_version = None
+        self._entries = OrderedDict()
+        self._load()
+
+    @staticmethod
+    def make_key(question: str, context: str = "") -> str:
+        return normalize_text(question) + " || " + normalize_text(context)
+
+    def get(self, question: str, context: str, db_version):
+        key = self.make_key(question, context)
+        with self._lock:
+            self._check_version(db_version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["sql"]
+
+    def put(self, question: str, context: str, sql: str, db_version):
+        key = self.make_key(question, context)
+        with self._lock:
+            self._check_version(db_version)
+            self._entries[key] = {"question": question, "sql": sql}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._save()
+
+    def invalidate(self, question: str, context: str = ""):
+        key = self.make_key(question, context)
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._save()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+        }
+
+    def _check_version(self, db_version):
+        if db_version != self._db_version:
+            self._entries.clear()
+            self._db_version = db_version
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._db_version = data.get("db_version")
+            self._entries = OrderedDict((k, v) for k, v in data.get("entries", []))
+        except (ValueError, OSError):
+            self._entries = OrderedDict()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"db_version": self._db_version, "entries": list(self._entries.items())}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+# --- ОБЩИЙ КЭШ НА ПРОЦЕСС ---
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_question_cache() -> QuestionSQLCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = QuestionSQLCache()
+        return _cache
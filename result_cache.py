@@ -0,0 +1,240 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# --- КОНФИГУРАЦИЯ ---
+MAX_BYTES = int(os.getenv("RESULT_CACHE_MB", "256")) * 1024 * 1024
+SPILL_DIR = os.getenv("RESULT_CACHE_SPILL_DIR")  # например "db/result_cache"; не задано — без диска
+MAX_SPILL_BYTES = int(os.getenv("RESULT_CACHE_SPILL_MB", "1024")) * 1024 * 1024
+
+# Токены SQL: строки и идентификаторы в кавычках не трогаем, остальное нормализуем
+_TOKEN_RE = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<ident>"(?:[^"]|"")*")
+  | (?P<number>\b\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b)
+  | (?P<space>\s+)
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+_WORDISH = re.compile(r"[\w\"'.?]")
+
+# Результат зависит не только от данных: текущие дата/время, случайные значения, последовательности.
+# Ключевые слова вроде current_date пишутся без скобок, функции — со скобками
+_VOLATILE_RE = re.compile(r"""
+    \b(?:current_date|current_time|current_timestamp|localtime|localtimestamp)\b
+  | \b(?:now|today|get_current_time|get_current_timestamp|transaction_timestamp|current_localtimestamp
+      |random|setseed|gen_random_uuid|uuid|uuidv4|uuidv7|nextval|currval)\s*\(
+""", re.VERBOSE)
+
+
+def canonicalize_sql(sql: str, literals: bool = True) -> str:
+    """Каноническая форма SQL: без комментариев, лишних пробелов и ';', ключевые слова в нижнем регистре.
+
+    literals=False заменяет строковые и числовые литералы на '?' — это "форма" запроса,
+    одинаковая для всех значений фильтров (для статистики, не для ключа кэша).
+    """
+    out = []
+    pending_space = False
+    for m in _TOKEN_RE.finditer(sql):
+        kind, text = m.lastgroup, m.group()
+        if kind in ("comment", "space"):
+            pending_space = bool(out)
+            continue
+        if pending_space:
+            # Пробел значим только между "словами": "a = 1" и "a=1" дают одно и то же
+            if _WORDISH.match(out[-1][-1]) and _WORDISH.match(text[0]):
+                out.append(" ")
+            pending_space = False
+        if kind in ("string", "number"):
+            out.append(text if literals else "?")
+        elif kind == "ident":
+            out.append(text)
+        else:
+            # Идентификаторы без кавычек в DuckDB регистронезависимы
+            out.append(text.lower())
+    return "".join(out).strip().rstrip(";").strip()
+
+
+def is_volatile(sql: str) -> bool:
+    """Запрос с CURRENT_DATE, now(), random() и т.п.: его результат нельзя отдавать из кэша"""
+    # В канонической форме строки уже заменены на '?', идентификаторы в кавычках убираем сами
+    text = re.sub(r'"(?:[^"]|"")*"', "?", canonicalize_sql(sql, literals=False))
+    return _VOLATILE_RE.search(text) is not None
+
+
+def db_identity(db_path: str) -> str:
+    """Идентичность файла базы: путь, inode, размер и время изменения"""
+    try:
+        st = os.stat(db_path)
+    except OSError:
+        return f"{os.path.abspath(db_path)}:missing"
+    return f"{os.path.abspath(db_path)}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def fingerprint(sql: str, db_path: str, extra: str = "") -> str:
+    raw = "\n".join([canonicalize_sql(sql), db_identity(db_path), extra])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _result_bytes(result) -> int:
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(deep=True).sum())
+    return int(getattr(result, "nbytes", 0))
+
+
+class ResultCache:
+    """Общий на процесс LRU-кэш результатов запросов, ограниченный по байтам.
+
+    Вытесненные записи при заданном spill_dir сбрасываются в Parquet и поднимаются обратно при обращении.
+    """
+
+    def __init__(self, max_bytes: int = MAX_BYTES, spill_dir: str = SPILL_DIR, max_spill_bytes: int = MAX_SPILL_BYTES):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()   # key -> запись с result в памяти
+        self._spilled = OrderedDict()  # key -> запись с путём к parquet
+        self._bytes = 0
+        self._spill_bytes = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+            else:
+                entry = self._spilled.pop(key, None)
+                if entry is not None:
+                    entry = self._unspill(key, entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["hits"] += 1
+            entry["last_hit"] = time.time()
+            result = entry["result"]
+        # Копия без копирования данных: добавление колонок у вызывающего не портит кэш
+        return result.copy(deep=False) if isinstance(result, pd.DataFrame) else result
+
+    def put(self, key: str, sql: str, result):
+        size = _result_bytes(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._bytes -= old["bytes"]
+            self._memory[key] = {
+                "sql": canonicalize_sql(sql, literals=False), "result": result, "bytes": size,
+                "hits": 0, "created": time.time(), "last_hit": None, "path": None
+            }
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._memory:
+                old_key, old_entry = self._memory.popitem(last=False)
+                self._bytes -= old_entry["bytes"]
+                self._spill(old_key, old_entry)
+
+    def clear(self):
+        with self._lock:
+            for entry in self._spilled.values():
+                self._remove_file(entry["path"])
+            self._memory.clear()
+            self._spilled.clear()
+            self._bytes = 0
+            self._spill_bytes = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._memory),
+            "spilled": len(self._spilled),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def entry_stats(self) -> pd.DataFrame:
+        """Статистика по записям: форма запроса, размер, число попаданий"""
+        with self._lock:
+            rows = [
+                {"key": k[:10], "sql": e["sql"][:120], "bytes": e["bytes"], "hits": e["hits"],
+                 "on_disk": e["path"] is not None, "created": e["created"], "last_hit": e["last_hit"]}
+                for k, e in list(self._memory.items()) + list(self._spilled.items())
+            ]
+        return pd.DataFrame(rows).sort_values("hits", ascending=False) if rows else pd.DataFrame()
+
+    # --- Сброс на диск ---
+    def _spill(self, key: str, entry: dict):
+        if not self.spill_dir:
+            return
+        path = os.path.join(self.spill_dir, f"{key}.parquet")
+        try:
+            result = entry["result"]
+            if isinstance(result, pd.DataFrame):
+                result.to_parquet(path, index=False)
+            else:
+                import pyarrow.parquet as pq
+                pq.write_table(result, path)
+        except Exception:
+            return
+        entry.update({"result": None, "path": path, "arrow": not isinstance(entry["result"], pd.DataFrame)})
+        self._spilled[key] = entry
+        self._spill_bytes += os.path.getsize(path)
+        while self._spill_bytes > self.max_spill_bytes and self._spilled:
+            _, old_entry = self._spilled.popitem(last=False)
+            self._spill_bytes -= self._remove_file(old_entry["path"])
+
+    def _unspill(self, key: str, entry: dict):
+        path = entry["path"]
+        try:
+            if entry.get("arrow"):
+                import pyarrow.parquet as pq
+                result = pq.read_table(path)
+            else:
+                result = pd.read_parquet(path)
+        except Exception:
+            self._spill_bytes -= self._remove_file(path)
+            return None
+        self._spill_bytes -= self._remove_file(path)
+        entry.update({"result": result, "path": None})
+        self._memory[key] = entry
+        self._bytes += entry["bytes"]
+        while self._bytes > self.max_bytes and len(self._memory) > 1:
+            old_key, old_entry = self._memory.popitem(last=False)
+            self._bytes -= old_entry["bytes"]
+            self._spill(old_key, old_entry)
+        return entry
+
+    @staticmethod
+    def _remove_file(path) -> int:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except OSError:
+            return 0
+
+
+# --- ОБЩИЙ КЭШ НА ПРОЦЕСС ---
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_result_cache() -> ResultCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
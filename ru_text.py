@@ -0,0 +1,30 @@
+import re
+
+# Упрощённый стеммер для русского: отрезаем самое длинное известное окончание,
+# чтобы "дорогих лекарств" и "дорогие лекарства" нормализовались одинаково.
+ENDINGS = sorted([
+    # прилагательные и причастия
+    "ими", "ыми", "его", "ого", "ему", "ому", "ее", "ие", "ые", "ое", "ей", "ий", "ый", "ой",
+    "ем", "им", "ым", "ом", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею",
+    # существительные
+    "иями", "ями", "ами", "ией", "иям", "ием", "иях", "ев", "ов", "ие", "ье", "еи", "ии",
+    "ам", "ям", "ах", "ях", "ию", "ью", "ия", "ья", "а", "е", "и", "й", "о", "у", "ы", "ь", "ю", "я",
+    # глаголы (без коротких "-ит/-ет": они съедают медицинские термины — гастрит, диабет)
+    "ать", "ять", "ить", "еть", "ует", "уют", "ает", "ают",
+], key=len, reverse=True)
+MIN_STEM = 3
+
+def stem(word: str) -> str:
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+def tokenize(text: str) -> list:
+    """Нижний регистр, ё -> е, только буквы/цифры"""
+    text = str(text).lower().replace("ё", "е")
+    return re.findall(r"[a-zа-я0-9]+", text)
+
+def normalize_text(text: str) -> str:
+    """Регистр, пробелы, пунктуация и морфология — в одну каноническую строку"""
+    return " ".join(stem(t) for t in tokenize(text))
@@ -0,0 +1,134 @@
+import re
+import threading
+
+from ru_text import tokenize, stem
+from sql_executor import DB_PATH, db_version, get_schema, get_table_comments
+
+# Слова из вопросов, которые указывают на таблицу, хотя не встречаются в её колонках
+TABLE_KEYWORDS = {
+    "prescriptions": "рецепт назначен выдач обращен случа динамик месяц год сезон дата количеств сколько частот заболеваемост",
+    "prescriptions_fact": "рецепт назначен выдач обращен случа динамик месяц год сезон дата количеств сколько частот заболеваемост",
+    "patients": "пациент пол возраст район регион мужчин женщин жител демограф лет",
+    "drugs": "лекарств препарат медикамент стоимост цен дорог дешев дозировк торгов",
+    "diagnoses": "диагноз болезн заболеван мкб класс грипп орви диабет ринит синусит сердц инфаркт",
+    "insight_cost_by_disease": "стоимост лечен чек средн дорог затрат",
+    "insight_gender_disease": "пол мужчин женщин возраст разниц демограф",
+    "insight_region_drug_choice": "регион район популярн лекарств препарат выбор дол",
+    "insight_monthly_disease": "динамик месяц сезон тренд помесячн рост класс групп",
+}
+# Таблица фактов, через которую соединяются справочники (компактная, если база собрана с ключами)
+FACT_TABLES = ("prescriptions_fact", "prescriptions")
+SHORT_TYPES = {"VARCHAR": "TEXT", "TIMESTAMP": "TS", "DOUBLE": "NUM", "BIGINT": "INT", "INTEGER": "INT"}
+MAX_COLUMNS = 12  # для широких таблиц оставляем только релевантные колонки + ключи
+MAX_ENUM_CHARS = 80
+
+
+def _stems(text: str) -> set:
+    return {stem(t) for t in tokenize(text.replace("_", " "))}
+
+
+def _overlap(question_stems: set, stems: set) -> int:
+    """Совпадения основ, в том числе по префиксу ("заболеваемост" ~ "заболеван")"""
+    return sum(
+        1 for q in question_stems
+        if q in stems or (len(q) >= 4 and any(s.startswith(q) or (len(s) >= 4 and q.startswith(s)) for s in stems))
+    )
+
+
+class SchemaSelector:
+    """Компактная схема только с нужными вопросу таблицами и путями JOIN между ними"""
+
+    def __init__(self, db_path: str = DB_PATH, relationships: list = None, descriptions: dict = None):
+        self.db_path = db_path
+        self.relationships = relationships or []
+        self.descriptions = descriptions or {}
+        self._lock = threading.Lock()
+        self._version = None
+        self._profiles = {}
+        self._descriptions = dict(self.descriptions)
+
+    def _load(self):
+        """Профили таблиц (колонки + ключевые слова) — один раз на версию базы"""
+        version = db_version(self.db_path)
+        with self._lock:
+            if version == self._version and self._profiles:
+                return self._profiles
+            profiles = {}
+            # Витрины, созданные mart_advisor.py, описаны в каталоге базы (COMMENT ON TABLE)
+            descriptions = {**get_table_comments(self.db_path), **self.descriptions}
+            for table, columns in get_schema(self.db_path).items():
+                keywords = _stems(table) | _stems(descriptions.get(table, "")) | _stems(TABLE_KEYWORDS.get(table, ""))
+                profiles[table] = {
+                    "columns": columns,
+                    "column_stems": {col: _stems(col) for col, _ in columns},
+                    "keywords": keywords,
+                }
+            self._profiles, self._version, self._descriptions = profiles, version, descriptions
+            return profiles
+
+    def rank_tables(self, question: str) -> list:
+        """[(таблица, score)] по убыванию релевантности"""
+        q_stems = _stems(question)
+        scores = []
+        for table, profile in self._load().items():
+            score = 2 * _overlap(q_stems, profile["keywords"])
+            score += sum(1 for stems in profile["column_stems"].values() if _overlap(q_stems, stems))
+            scores.append((table, score))
+        return sorted(scores, key=lambda x: -x[1])
+
+    def select_tables(self, question: str) -> list:
+        ranked = [(t, s) for t, s in self.rank_tables(question) if s > 0]
+        if not ranked:
+            return list(self._load())
+        tables = [t for t, _ in ranked]
+        # Справочники без таблицы фактов бесполезны для подсчётов — добавляем хаб
+        hub = next((t for t in FACT_TABLES if t in self._load()), None)
+        dimensions = {t for t in tables if hub and self._joins_with(t, hub)}
+        if dimensions and hub not in tables:
+            tables.append(hub)
+        return tables
+
+    def build(self, question: str) -> str:
+        profiles = self._load()
+        tables = self.select_tables(question)
+        q_stems = _stems(question)
+
+        lines = ["### TABLES (только относящиеся к вопросу):"]
+        for table in tables:
+            columns = profiles[table]["columns"]
+            if len(columns) > MAX_COLUMNS:
+                keys = {c for c, _ in columns if c.startswith(("id_", "код_"))}
+                columns = [(c, t) for c, t in columns if c in keys or _overlap(q_stems, profiles[table]["column_stems"][c])] or columns
+            cols = ", ".join(f"{_quote(c)} {_short_type(t)}" for c, t in columns)
+            desc = self._descriptions.get(table)
+            lines.append(f"- {table}: {cols}" + (f"  -- {desc}" if desc else ""))
+
+        joins = [rel for rel in self.relationships if self._rule_applies(rel, tables, profiles)]
+        if joins:
+            lines.append("### JOINS:")
+            lines.extend(f"- {rel}" for rel in joins)
+        return "\n".join(lines) + "\n"
+
+    def _joins_with(self, table: str, hub: str) -> bool:
+        return table != hub and any(f"{hub}." in rel and f"{table}." in rel for rel in self.relationships)
+
+    @staticmethod
+    def _rule_applies(rule: str, tables: list, profiles: dict) -> bool:
+        """Правило нужно, если все упомянутые в нём таблицы попали в выборку"""
+        qualified = set(re.findall(r"\b(\w+)\.", rule))
+        if qualified - set(profiles):
+            return False  # правило про таблицу, которой нет в этой базе (например, prescriptions_fact)
+        mentioned = qualified | set(re.findall(r"'(\w+)'", rule)) | set(re.findall(r"JOIN (\w+)", rule))
+        known = mentioned & set(profiles)
+        return bool(known) and known <= set(tables)
+
+
+def _short_type(dtype: str) -> str:
+    # Короткие ENUM показываем со значениями (подсказка для фильтров), длинные — просто ENUM
+    if dtype.startswith("ENUM("):
+        return dtype if len(dtype) <= MAX_ENUM_CHARS else "ENUM"
+    return SHORT_TYPES.get(dtype, dtype)
+
+
+def _quote(name: str) -> str:
+    return name if re.fullmatch(r"[^\W\d]\w*", name) else f'"{name}"'
@@ -1,98 +1,437 @@
 # scripts_db/01_setup_db.py
+# Полная пересборка (по умолчанию) или инкрементальная загрузка новых данных:
+#   python scripts_db/01_setup_db.py                 ← собрать базу из всех CSV с нуля
+#   python scripts_db/01_setup_db.py --incremental   ← дописать только новые рецепты и изменённые справочники
+#   python scripts_db/01_setup_db.py --legacy-layout ← старая схема: рецепты с VARCHAR-кодами, без ENUM
+# Оба режима пишут в новый снимок db/snapshots/*.duckdb и атомарно переключают на него db/medinsight.current.
+import sys
+import argparse
+import hashlib
+import time
 import duckdb
 from pathlib import Path
 
 PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+import db_snapshot
+import mart_build
+
 DB_PATH = PROJECT_ROOT / "db" / "medinsight.duckdb"
 DATA_DIR = PROJECT_ROOT / "data"
 
-# Удаляем старую БД
-if DB_PATH.exists():
-    DB_PATH.unlink()
-
-DB_PATH.parent.mkdir(exist_ok=True)
-print("📁 Создаём чистую базу данных...")
-
-con = duckdb.connect(str(DB_PATH))
-
-# === 1. patients (без дубликатов) ===
-print("✅ Загружаем patients (уникальные)...")
-con.execute(f"""
-    CREATE TABLE patients AS
-    SELECT DISTINCT ON (id_пациента)
-        id_пациента,
-        дата_рождения,
-        пол,
-        район_проживания,
-        регион
-    FROM read_csv_auto(
-        '{DATA_DIR / "данные_пациентов.csv"}',
+STATE_TABLE = "_ingest_state"
+PRESCRIPTIONS_FILE = "данные_рецептов.csv"
+# Справочники: таблица -> (файл, ключ для upsert)
+DIMENSIONS = {
+    "patients": ("данные_пациентов.csv", "id_пациента"),
+    "diagnoses": ("данные_диагнозы.csv", "код_мкб"),
+    "drugs": ("данные_препараты.csv", "код_препарата"),
+}
+DIMENSION_TYPES = "'код_мкб': 'VARCHAR', 'код_препарата': 'VARCHAR'"
+
+# --- КОМПАКТНАЯ СХЕМА ХРАНЕНИЯ ---
+# Рецепты лежат в prescriptions_fact с целочисленными ключами вместо строковых кодов,
+# prescriptions — совместимое представление с прежними колонками (старый SQL работает как раньше)
+FACT_TABLE = "prescriptions_fact"
+# Справочник -> (суррогатный ключ, код в справочнике, код в рецептах)
+SURROGATE_KEYS = {
+    "patients": ("patient_key", "id_пациента", "id_пациента"),
+    "diagnoses": ("diagnosis_key", "код_мкб", "код_диагноза"),
+    "drugs": ("drug_key", "код_препарата", "код_препарата"),
+}
+# Категориальные колонки с малым числом значений -> ENUM (словарное кодирование)
+ENUM_COLUMNS = {
+    "patients": ["пол", "район_проживания", "регион"],
+    "diagnoses": ["класс_заболевания"],
+}
+
+# --- КЛАСТЕРИЗАЦИЯ РЕЦЕПТОВ ---
+# Рецепты пишутся отсортированными: период (CLUSTER_GRAIN) -> диагноз -> дата_рецепта.
+# Тогда min/max в каждой группе строк узкие, и DuckDB пропускает группы вне окна дат или кодов
+# (отчёт по группам: python scripts_db/storage_report.py).
+CLUSTER_GRAIN = "month"
+
+
+def cluster_order(diagnosis: str) -> str:
+    return f"date_trunc('{CLUSTER_GRAIN}', дата_рецепта), {diagnosis}, дата_рецепта"
+
+
+def read_csv(path: Path, types: str) -> str:
+    return f"""read_csv_auto(
+        '{path}',
         header=true,
         nullstr='',
-        types={{'id_пациента': 'VARCHAR'}},
+        types={{{types}}},
         strict_mode=false,
         ignore_errors=true,
         null_padding=true
-    )
-    WHERE id_пациента IS NOT NULL
-    ORDER BY id_пациента;
-""")
-
-# === 2. diagnoses и drugs ===
-for name, file in [("diagnoses", "данные_диагнозы.csv"), ("drugs", "данные_препараты.csv")]:
-    print(f"✅ Загружаем {name}...")
+    )"""
+
+
+def dimension_select(table: str, data_dir: Path) -> str:
+    file, _ = DIMENSIONS[table]
+    if table == "patients":
+        # === patients (без дубликатов) ===
+        return f"""
+            SELECT DISTINCT ON (id_пациента)
+                id_пациента,
+                дата_рождения,
+                пол,
+                район_проживания,
+                регион
+            FROM {read_csv(data_dir / file, "'id_пациента': 'VARCHAR'")}
+            WHERE id_пациента IS NOT NULL
+            ORDER BY id_пациента
+        """
+    # === diagnoses и drugs ===
+    return f"SELECT * FROM {read_csv(data_dir / file, DIMENSION_TYPES)}"
+
+
+def prescriptions_select(data_dir: Path) -> str:
+    # prescriptions — через ПОСЛЕДНЮЮ колонку id_пациента_1
+    types = "'id_пациента': 'VARCHAR', 'id_пациента_1': 'VARCHAR', 'код_диагноза': 'VARCHAR', 'код_препарата': 'VARCHAR'"
+    return f"""
+        SELECT
+            CAST("id_пациента_1" AS VARCHAR) AS id_пациента,
+            дата_рецепта,
+            код_диагноза,
+            код_препарата
+        FROM {read_csv(data_dir / PRESCRIPTIONS_FILE, types)}
+        WHERE "id_пациента_1" IS NOT NULL
+    """
+
+
+def file_checksum(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# --- КЛЮЧИ И ENUM ---
+def key_map(table: str) -> str:
+    """Служебная таблица код -> суррогатный ключ (включает и коды, которых нет в справочнике)"""
+    return f"_keys_{table}"
+
+
+def is_keyed(con) -> bool:
+    return con.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ?", [FACT_TABLE]).fetchone()[0] > 0
+
+
+def fact_table(con) -> str:
+    """Где физически лежат рецепты (для водяного знака и подсчётов — без JOIN представления)"""
+    return FACT_TABLE if is_keyed(con) else "prescriptions"
+
+
+def register_keys(con, table: str, codes_sql: str):
+    """Новым кодам выдаём следующие номера; уже выданные ключи не меняются"""
+    key, code, _ = SURROGATE_KEYS[table]
+    con.execute(f"CREATE TABLE IF NOT EXISTS {key_map(table)} ({key} INTEGER, {code} VARCHAR)")
     con.execute(f"""
-        CREATE TABLE {name} AS
-        SELECT * FROM read_csv_auto(
-            '{DATA_DIR / file}',
-            header=true,
-            nullstr='',
-            types={{'код_мкб': 'VARCHAR', 'код_препарата': 'VARCHAR'}},
-            strict_mode=false,
-            ignore_errors=true,
-            null_padding=true
-        );
+        INSERT INTO {key_map(table)}
+        SELECT (COALESCE((SELECT max({key}) FROM {key_map(table)}), 0) + row_number() OVER (ORDER BY {code}))::INTEGER, {code}
+        FROM (
+            SELECT DISTINCT {code}::VARCHAR AS {code} FROM ({codes_sql}) WHERE {code} IS NOT NULL
+            EXCEPT SELECT {code} FROM {key_map(table)}
+        )
     """)
 
-# === 3. prescriptions — через ПОСЛЕДНЮЮ колонку id_пациента_1 ===
-print("✅ Загружаем prescriptions (связь через id_пациента_1)...")
-con.execute(f"""
-    CREATE TABLE prescriptions AS
-    SELECT
-        CAST("id_пациента_1" AS VARCHAR) AS id_пациента,
-        дата_рецепта,
-        код_диагноза,
-        код_препарата
-    FROM read_csv_auto(
-        '{DATA_DIR / "данные_рецептов.csv"}',
-        header=true,
-        nullstr='',
-        types={{
-            'id_пациента': 'VARCHAR',
-            'id_пациента_1': 'VARCHAR',
-            'код_диагноза': 'VARCHAR',
-            'код_препарата': 'VARCHAR'
-        }},
-        strict_mode=false,
-        ignore_errors=true,
-        null_padding=true
-    )
-    WHERE "id_пациента_1" IS NOT NULL;
-""")
-
-# === 4. Проверка связности ===
-total_patients = con.execute("SELECT COUNT(*) FROM patients").fetchone()[0]
-total_presc = con.execute("SELECT COUNT(*) FROM prescriptions").fetchone()[0]
-linked = con.execute("""
-    SELECT COUNT(*)
-    FROM prescriptions p
-    JOIN patients pa ON p.id_пациента = pa.id_пациента
-""").fetchone()[0]
-
-print(f"\n📊 Проверка связности:")
-print(f"   Пациентов: {total_patients:,}")
-print(f"   Рецептов:  {total_presc:,}")
-print(f"   Связано:   {linked:,} ({linked/total_presc:.1%})")
-
-con.close()
-print("\n✨ База готова! Все данные доступны напрямую.")
\ No newline at end of file
+
+def create_enum(con, column: str, sources: list):
+    values = " UNION ALL ".join(f"SELECT {column}::VARCHAR AS v FROM {src}" for src in sources)
+    con.execute(f"CREATE TYPE {column}_enum AS ENUM (SELECT DISTINCT v FROM ({values}) WHERE v IS NOT NULL ORDER BY 1)")
+
+
+def refresh_enums(con, table: str, stage: str):
+    """ENUM нельзя дополнить: при новых значениях пересоздаём тип через VARCHAR"""
+    for column in ENUM_COLUMNS.get(table, []):
+        new = con.execute(f"""
+            SELECT COUNT(*) FROM (
+                SELECT DISTINCT {column}::VARCHAR FROM {stage} WHERE {column} IS NOT NULL
+                EXCEPT SELECT unnest(enum_range(NULL::{column}_enum))
+            )
+        """).fetchone()[0]
+        if not new:
+            continue
+        print(f"   ENUM {column}: +{new} новых значений")
+        con.execute(f"ALTER TABLE {table} ALTER {column} TYPE VARCHAR")
+        con.execute(f"DROP TYPE {column}_enum")
+        create_enum(con, column, [table, stage])
+        con.execute(f"ALTER TABLE {table} ALTER {column} TYPE {column}_enum")
+
+
+def keyed_dimension_select(table: str, stage: str, where: str = "") -> str:
+    """Строки справочника из stage: категории как ENUM + суррогатный ключ"""
+    key, code, _ = SURROGATE_KEYS[table]
+    casts = ", ".join(f"{c}::{c}_enum AS {c}" for c in ENUM_COLUMNS.get(table, []))
+    replace = f" REPLACE ({casts})" if casts else ""
+    return f"SELECT s.*{replace}, k.{key} FROM {stage} s JOIN {key_map(table)} k USING ({code}) {where} ORDER BY k.{key}"
+
+
+def fact_select(stage: str) -> str:
+    """Рецепты из stage с кодами, заменёнными на ключи"""
+    columns, joins = ["s.дата_рецепта"], []
+    for i, (table, (key, code, fact_code)) in enumerate(SURROGATE_KEYS.items()):
+        columns.append(f"k{i}.{key}")
+        joins.append(f"LEFT JOIN {key_map(table)} k{i} ON s.{fact_code} = k{i}.{code}")
+    # Ключи диагнозов выдаются в порядке кодов, поэтому сортировка по ключу группирует и префиксы МКБ
+    return f"SELECT {', '.join(columns)} FROM {stage} s {' '.join(joins)} ORDER BY {cluster_order('diagnosis_key')}"
+
+
+def create_compat_view(con):
+    """prescriptions с прежними колонками поверх prescriptions_fact"""
+    columns, joins = [], []
+    for i, (table, (key, code, fact_code)) in enumerate(SURROGATE_KEYS.items()):
+        columns.append(f"k{i}.{code} AS {fact_code}")
+        joins.append(f"LEFT JOIN {key_map(table)} k{i} ON f.{key} = k{i}.{key}")
+    columns.insert(1, "f.дата_рецепта")
+    con.execute(f"CREATE OR REPLACE VIEW prescriptions AS SELECT {', '.join(columns)} FROM {FACT_TABLE} f {' '.join(joins)}")
+
+
+# --- СОСТОЯНИЕ ЗАГРУЗКИ ---
+def ensure_state(con):
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            source VARCHAR PRIMARY KEY,
+            checksum VARCHAR,
+            watermark TIMESTAMP,
+            rows BIGINT,
+            loaded_at TIMESTAMP
+        )
+    """)
+
+
+def get_state(con, source: str):
+    row = con.execute(f"SELECT checksum, watermark FROM {STATE_TABLE} WHERE source = ?", [source]).fetchone()
+    return row if row else (None, None)
+
+
+def save_state(con, source: str, checksum: str, table: str, watermark=None):
+    rows = con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    con.execute(f"""
+        INSERT OR REPLACE INTO {STATE_TABLE} VALUES (?, ?, ?, ?, now()::TIMESTAMP)
+    """, [source, checksum, watermark, rows])
+
+
+# --- ПОЛНАЯ ПЕРЕСБОРКА ---
+def full_rebuild(db_path: Path, data_dir: Path, legacy: bool = False) -> dict:
+    # Собираем в новый файл-снимок: живая база не удаляется, приложение переключится после публикации
+    print("📁 Создаём чистую базу данных (новый снимок)...")
+    with db_snapshot.build(db_path) as snapshot:
+        con = duckdb.connect(snapshot)
+        report = load_legacy(con, data_dir) if legacy else load_keyed(con, data_dir)
+
+        # Запоминаем контрольные суммы и водяной знак, чтобы следующий запуск мог быть инкрементальным
+        ensure_state(con)
+        for table, (file, _) in DIMENSIONS.items():
+            save_state(con, table, file_checksum(data_dir / file), table)
+        watermark = con.execute(f"SELECT max(дата_рецепта) FROM {fact_table(con)}").fetchone()[0]
+        save_state(con, "prescriptions", file_checksum(data_dir / PRESCRIPTIONS_FILE), fact_table(con), watermark)
+
+        check_links(con)
+        refresh_marts(con)
+        con.close()
+    print(f"📌 Опубликован снимок {Path(db_snapshot.resolve(db_path)).name}")
+    return report
+
+
+def load_legacy(con, data_dir: Path) -> dict:
+    report = {}
+    for table in DIMENSIONS:
+        print(f"✅ Загружаем {table}...")
+        con.execute(f"CREATE TABLE {table} AS {dimension_select(table, data_dir)}")
+        report[table] = {"added": con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0], "updated": 0}
+
+    print("✅ Загружаем prescriptions (связь через id_пациента_1)...")
+    con.execute(f"CREATE TABLE prescriptions AS {prescriptions_select(data_dir)} ORDER BY {cluster_order('код_диагноза')}")
+    report["prescriptions"] = {"added": con.execute("SELECT COUNT(*) FROM prescriptions").fetchone()[0], "updated": 0}
+    return report
+
+
+def load_keyed(con, data_dir: Path) -> dict:
+    """Справочники с ENUM и суррогатными ключами, рецепты — только ключи и дата"""
+    report = {}
+    for table in DIMENSIONS:
+        con.execute(f"CREATE TEMP TABLE _stage_{table} AS {dimension_select(table, data_dir)}")
+    con.execute(f"CREATE TEMP TABLE _stage_prescriptions AS {prescriptions_select(data_dir)}")
+
+    for table, (key, code, fact_code) in SURROGATE_KEYS.items():
+        # Ключи выдаются и кодам, которые встречаются только в рецептах, — иначе представление их потеряет
+        register_keys(con, table, f"SELECT {code} FROM _stage_{table} UNION ALL SELECT {fact_code} AS {code} FROM _stage_prescriptions")
+        for column in ENUM_COLUMNS.get(table, []):
+            create_enum(con, column, [f"_stage_{table}"])
+        print(f"✅ Загружаем {table} (ключ {key})...")
+        con.execute(f"CREATE TABLE {table} AS {keyed_dimension_select(table, f'_stage_{table}')}")
+        report[table] = {"added": con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0], "updated": 0}
+
+    print(f"✅ Загружаем {FACT_TABLE} (связь через id_пациента_1)...")
+    con.execute(f"CREATE TABLE {FACT_TABLE} AS {fact_select('_stage_prescriptions')}")
+    create_compat_view(con)
+    report["prescriptions"] = {"added": con.execute(f"SELECT COUNT(*) FROM {FACT_TABLE}").fetchone()[0], "updated": 0}
+    return report
+
+
+# --- ИНКРЕМЕНТАЛЬНАЯ ЗАГРУЗКА ---
+def upsert_dimension(con, table: str, data_dir: Path) -> dict:
+    """Новые и изменённые строки справочника: удаляем старые версии по ключу и вставляем из CSV"""
+    _, key = DIMENSIONS[table]
+    keyed = is_keyed(con)
+    con.execute(f"CREATE OR REPLACE TEMP TABLE _stage AS {dimension_select(table, data_dir)}")
+    columns = ", ".join(row[0] if row[0].isidentifier() else f'"{row[0]}"' for row in con.execute("DESCRIBE _stage").fetchall())
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE _changed AS
+        SELECT DISTINCT {key} FROM (SELECT * FROM _stage EXCEPT SELECT {columns} FROM {table})
+    """)
+    added, updated = con.execute(f"""
+        SELECT
+            COUNT(*) FILTER (WHERE {key} NOT IN (SELECT {key} FROM {table})),
+            COUNT(*) FILTER (WHERE {key} IN (SELECT {key} FROM {table}))
+        FROM _changed
+    """).fetchone()
+    con.execute(f"DELETE FROM {table} WHERE {key} IN (SELECT {key} FROM _changed)")
+    where = f"WHERE {key} IN (SELECT {key} FROM _changed)"
+    if keyed:
+        refresh_enums(con, table, "_stage")
+        register_keys(con, table, f"SELECT {key} FROM _stage")
+        con.execute(f"INSERT INTO {table} BY NAME {keyed_dimension_select(table, '_stage', where)}")
+    else:
+        con.execute(f"INSERT INTO {table} BY NAME SELECT * FROM _stage {where}")
+    con.execute("DROP TABLE _stage")
+    con.execute("DROP TABLE _changed")
+    return {"added": added, "updated": updated}
+
+
+def append_prescriptions(con, data_dir: Path, watermark) -> dict:
+    """Только рецепты новее водяного знака (максимальной загруженной даты_рецепта).
+
+    Новые рецепты позже всех загруженных, поэтому отсортированная порция дописывается в конец
+    и не ломает кластеризацию по дате.
+    """
+    condition = "WHERE дата_рецепта > ?" if watermark is not None else ""
+    params = [watermark] if watermark is not None else []
+    keyed = is_keyed(con)
+    target = FACT_TABLE if keyed else "prescriptions"
+    before = con.execute(f"SELECT COUNT(*) FROM {target}").fetchone()[0]
+    if keyed:
+        con.execute(f"CREATE OR REPLACE TEMP TABLE _stage_prescriptions AS SELECT * FROM ({prescriptions_select(data_dir)}) {condition}", params)
+        for table, (_, code, fact_code) in SURROGATE_KEYS.items():
+            register_keys(con, table, f"SELECT {fact_code} AS {code} FROM _stage_prescriptions")
+        con.execute(f"INSERT INTO {FACT_TABLE} BY NAME {fact_select('_stage_prescriptions')}")
+        con.execute("DROP TABLE _stage_prescriptions")
+    else:
+        con.execute(f"""
+            INSERT INTO prescriptions BY NAME
+            SELECT * FROM ({prescriptions_select(data_dir)}) {condition} ORDER BY {cluster_order('код_диагноза')}
+        """, params)
+    added = con.execute(f"SELECT COUNT(*) FROM {target}").fetchone()[0] - before
+    return {"added": added, "updated": 0}
+
+
+def read_states(db_file: str) -> dict:
+    """{источник: (checksum, watermark)} из текущей версии базы (только чтение)"""
+    con = duckdb.connect(db_file, read_only=True)
+    try:
+        return {row[0]: (row[1], row[2]) for row in con.execute(f"SELECT source, checksum, watermark FROM {STATE_TABLE}").fetchall()}
+    except duckdb.CatalogException:
+        return {}  # база собрана до появления _ingest_state
+    finally:
+        con.close()
+
+
+def incremental(db_path: Path, data_dir: Path) -> dict:
+    current = db_snapshot.resolve(db_path)
+    if not Path(current).exists():
+        print("ℹ️ Базы ещё нет — выполняем полную сборку.")
+        return full_rebuild(db_path, data_dir)
+
+    # Сначала сверяем контрольные суммы — если ничего не менялось, новый снимок не нужен
+    states = read_states(current)
+    checksums = {table: file_checksum(data_dir / file) for table, (file, _) in DIMENSIONS.items()}
+    checksums["prescriptions"] = file_checksum(data_dir / PRESCRIPTIONS_FILE)
+    changed = [source for source, checksum in checksums.items() if checksum != states.get(source, (None, None))[0]]
+    for source in checksums:
+        if source not in changed:
+            print(f"⏭ {source}: файл не изменился")
+    if not changed:
+        return {}
+
+    # Изменения применяются к копии текущей версии; при ошибке копия удаляется, живая база не тронута
+    report = {}
+    with db_snapshot.build(db_path, from_current=True) as snapshot:
+        con = duckdb.connect(snapshot)
+        ensure_state(con)
+        # Сначала справочники: новые рецепты могут ссылаться на новых пациентов и препараты
+        for table in DIMENSIONS:
+            if table in changed:
+                print(f"🔄 Обновляем {table}...")
+                report[table] = upsert_dimension(con, table, data_dir)
+                save_state(con, table, checksums[table], table)
+
+        if "prescriptions" in changed:
+            watermark = get_state(con, "prescriptions")[1]
+            if watermark is None:
+                watermark = con.execute(f"SELECT max(дата_рецепта) FROM {fact_table(con)}").fetchone()[0]
+            print(f"🔄 Дописываем prescriptions новее {watermark}...")
+            report["prescriptions"] = append_prescriptions(con, data_dir, watermark)
+            new_watermark = con.execute(f"SELECT max(дата_рецепта) FROM {fact_table(con)}").fetchone()[0]
+            save_state(con, "prescriptions", checksums["prescriptions"], fact_table(con), new_watermark)
+
+        check_links(con)
+        refresh_marts(con)
+        con.close()
+    print(f"📌 Опубликован снимок {Path(db_snapshot.resolve(db_path)).name}")
+    return report
+
+
+# --- ПРОВЕРКА СВЯЗНОСТИ ---
+def check_links(con):
+    total_patients = con.execute("SELECT COUNT(*) FROM patients").fetchone()[0]
+    total_presc = con.execute("SELECT COUNT(*) FROM prescriptions").fetchone()[0]
+    linked = con.execute("""
+        SELECT COUNT(*)
+        FROM prescriptions p
+        JOIN patients pa ON p.id_пациента = pa.id_пациента
+    """).fetchone()[0]
+
+    print(f"\n📊 Проверка связности:")
+    print(f"   Пациентов: {total_patients:,}")
+    print(f"   Рецептов:  {total_presc:,}")
+    print(f"   Связано:   {linked:,} ({linked / max(total_presc, 1):.1%})")
+
+
+# --- ВИТРИНЫ ---
+def refresh_marts(con):
+    """Витрины из scripts_db/marts/ в том же снимке: insight_* движка marts.py получают только новые рецепты,
+    остальные пересобираются, если изменились их входы"""
+    print("\n📈 Обновляем витрины:")
+    print(mart_build.format_report(mart_build.build(con)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Загрузка CSV из data/ в DuckDB")
+    parser.add_argument("--incremental", action="store_true",
+                        help="дописать новые рецепты (по водяному знаку дата_рецепта) и обновить изменённые справочники")
+    parser.add_argument("--legacy-layout", action="store_true",
+                        help="полная сборка в старой схеме: prescriptions с VARCHAR-кодами, категории без ENUM")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.incremental:
+        report = incremental(args.db, args.data_dir)
+    else:
+        report = full_rebuild(args.db, args.data_dir, legacy=args.legacy_layout)
+    elapsed = time.perf_counter() - start
+
+    print("\n📥 Загружено:")
+    for table, counts in report.items():
+        print(f"   {table:<14} +{counts['added']:,} новых, {counts['updated']:,} обновлено")
+    if not report:
+        print("   ничего нового")
+    print(f"\n✨ База готова за {elapsed:.1f} сек! Все данные доступны напрямую.")
+
+
+if __name__ == "__main__":
+    main()
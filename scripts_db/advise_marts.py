@@ -0,0 +1,89 @@
+# scripts_db/advise_marts.py
+# Советник витрин по журналу нагрузки (logs/workload.jsonl — туда пишутся запросы агента и дашборда):
+# находит частые и долгие агрегаты по сырым таблицам и предлагает витрины insight_auto_*, которые их покрывают.
+#   python scripts_db/advise_marts.py                  ← горячие формы запросов и предложения (ничего не меняет)
+#   python scripts_db/advise_marts.py --sql            ← + текст SQL предложенных витрин
+#   python scripts_db/advise_marts.py --apply          ← записать scripts_db/marts/insight_auto_*.sql и собрать их в новый снимок
+# Для автоматического режима — запускать с --apply по расписанию (cron). Описание витрины попадает в каталог
+# базы (COMMENT ON TABLE), и агент видит её в схеме со следующего вопроса, без перезапуска.
+import sys
+import argparse
+import time
+import duckdb
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+import db_snapshot
+import mart_build
+import mart_advisor
+import workload_log
+
+DB_PATH = PROJECT_ROOT / "db" / "medinsight.duckdb"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Предложить (и создать) витрины insight_auto_* по журналу нагрузки")
+    parser.add_argument("--log", default=str(PROJECT_ROOT / workload_log.WORKLOAD_PATH))
+    parser.add_argument("--since-days", type=float, help="учитывать только последние N дней журнала")
+    parser.add_argument("--min-hits", type=int, default=mart_advisor.MIN_HITS)
+    parser.add_argument("--min-total-ms", type=float, default=mart_advisor.MIN_TOTAL_MS)
+    parser.add_argument("--max-dims", type=int, default=mart_advisor.MAX_DIMS)
+    parser.add_argument("--max-row-ratio", type=float, default=mart_advisor.MAX_ROW_RATIO)
+    parser.add_argument("--sql", action="store_true", help="показать SQL предложенных витрин")
+    parser.add_argument("--apply", action="store_true", help="записать витрины и собрать их")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    args = parser.parse_args()
+
+    con = duckdb.connect(db_snapshot.resolve(args.db), read_only=True)
+    try:
+        shapes, proposals = mart_advisor.advise(args.log, args.since_days, con=con, min_hits=args.min_hits,
+                                                min_total_ms=args.min_total_ms, max_dims=args.max_dims,
+                                                max_row_ratio=args.max_row_ratio)
+    finally:
+        con.close()
+
+    print(f"🔥 Горячие формы запросов по сырым таблицам: {len(shapes)}")
+    for shape in shapes:
+        dims = ", ".join(f"{c}@{g}" if g else c for c, g in shape["dims"].items()) or "—"
+        print(f"   {shape['hits']:>5} запр. {shape['total_ms'] / 1000:>8.1f} сек  p95 {shape['p95_ms']:>7.0f} мс  "
+              f"{'+'.join(shape['tables'])}: {dims} → {', '.join(shape['measures'])}")
+    if not proposals:
+        print("\n✅ Новых витрин не нужно: горячих агрегатов нет или их уже покрывают витрины insight_auto_*.")
+        return
+
+    print("\n📋 Предложенные витрины:")
+    for p in proposals:
+        mark = "⏭" if p["too_big"] else "▶"
+        size = f"{p['rows']:,} строк из {p['fact_rows']:,}" if p["rows"] is not None else "размер неизвестен"
+        print(f"   {mark} {p['name']:<36} форм: {p['shapes']}, запр.: {p['hits']}, {p['total_ms'] / 1000:.1f} сек; {size}")
+        if p["too_big"]:
+            print(f"      слишком детальная (больше {args.max_row_ratio:.0%} таблицы фактов) — не создаётся")
+        if args.sql:
+            print("\n" + mart_advisor.render_sql(p))
+
+    wanted = [p for p in proposals if not p["too_big"]]
+    if not args.apply or not wanted:
+        return
+
+    # Как build_marts.py: витрины собираются в копии текущего снимка, которая публикуется только при успехе
+    paths = [mart_advisor.write(p) for p in wanted]
+    print("\n📝 " + "\n📝 ".join(str(path.relative_to(PROJECT_ROOT)) for path in paths))
+    start = time.perf_counter()
+    try:
+        with db_snapshot.build(args.db, from_current=True) as snapshot:
+            con = duckdb.connect(snapshot)
+            try:
+                report = mart_build.build(con, [p["name"] for p in wanted])
+            finally:
+                con.close()
+    except Exception:
+        for path in paths:
+            path.unlink()  # несобранная витрина не должна ломать следующие build_marts.py
+        raise
+    print(f"\n{mart_build.format_report(report)}")
+    print(f"\n📌 Опубликован снимок {Path(db_snapshot.resolve(args.db)).name} за {time.perf_counter() - start:.1f} сек")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# scripts_db/build_marts.py
+# Сборка всех витрин из scripts_db/marts/*.sql с учётом зависимостей (вместо ручного run_sql.py по файлу):
+#   python scripts_db/build_marts.py                     ← пересобрать устаревшие витрины (остальные пропускаются)
+#   python scripts_db/build_marts.py insight_x --force   ← только эта витрина (и устаревшие зависимости), без пропуска
+#   python scripts_db/build_marts.py --plan              ← показать граф и что будет пересобрано, ничего не меняя
+# Независимые витрины считаются параллельно; время, строки и пик памяти этапов — в таблице _mart_build.
+import sys
+import argparse
+import time
+import duckdb
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+import db_snapshot
+import mart_build
+
+DB_PATH = PROJECT_ROOT / "db" / "medinsight.duckdb"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка витрин insight_* по графу зависимостей")
+    parser.add_argument("stages", nargs="*", help="какие этапы собрать (по умолчанию все)")
+    parser.add_argument("--force", action="store_true", help="не пропускать этапы с неизменёнными входами")
+    parser.add_argument("--plan", action="store_true", help="только показать план")
+    parser.add_argument("--workers", type=int, default=mart_build.WORKERS)
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    args = parser.parse_args()
+
+    stages = mart_build.discover()
+    unknown = set(args.stages) - set(stages)
+    if unknown:
+        parser.error(f"неизвестные этапы: {', '.join(sorted(unknown))} (есть: {', '.join(stages)})")
+
+    con = duckdb.connect(db_snapshot.resolve(args.db), read_only=True)
+    decisions = mart_build.plan(con, stages, force=args.force)
+    con.close()
+    wanted = set(args.stages) or set(stages)
+    print("📋 План сборки:")
+    for name, decision in decisions.items():
+        deps = ", ".join(sorted(stages[name].deps)) or "исходные таблицы"
+        mark = "▶" if decision == "run" and name in wanted else "⏭"
+        print(f"   {mark} {name:<28} ← {deps}")
+    if args.plan:
+        return
+    if not any(decisions[name] == "run" for name in wanted):
+        print("\n✅ Все витрины актуальны — новый снимок не нужен.")
+        return
+
+    # Как run_sql.py: изменения идут в копию текущего снимка и публикуются только при успехе
+    start = time.perf_counter()
+    with db_snapshot.build(args.db, from_current=True) as snapshot:
+        con = duckdb.connect(snapshot)
+        try:
+            report = mart_build.build(con, args.stages or None, force=args.force, workers=args.workers, stages=stages)
+        finally:
+            con.close()
+    print(f"\n{mart_build.format_report(report)}")
+    print(f"\n📌 Опубликован снимок {Path(db_snapshot.resolve(args.db)).name} за {time.perf_counter() - start:.1f} сек")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,14 @@
 # scripts_db/inspect_db.py
+import sys
 import duckdb
 from pathlib import Path
 
-DB_PATH = Path(__file__).parent.parent / "db" / "medinsight.duckdb"
-con = duckdb.connect(str(DB_PATH))
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+import db_snapshot
+
+DB_PATH = db_snapshot.resolve(PROJECT_ROOT / "db" / "medinsight.duckdb")  # текущий снимок базы
+con = duckdb.connect(DB_PATH, read_only=True)
 
 tables = con.execute("""
     SELECT table_name, table_type 
@@ -21,4 +26,4 @@ for _, r in tables.iterrows():
         print(f"  • {c['column_name']} : {c['column_type']}")
 
 con.close()
-print("\n✅ Готово.")
\ No newline at end of file
+print(f"\n✅ Готово. Снимок: {Path(DB_PATH).name}")
\ No newline at end of file
@@ -1,7 +1,13 @@
 # scripts_db/list_tables.py
+import sys
 import duckdb
+from pathlib import Path
 
-con = duckdb.connect("../db/medinsight.duckdb")
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+import db_snapshot
+
+con = duckdb.connect(db_snapshot.resolve(PROJECT_ROOT / "db" / "medinsight.duckdb"), read_only=True)
 tables = con.execute("SHOW TABLES").fetchdf()
 print("Таблицы в базе:")
 print(tables)
@@ -0,0 +1,76 @@
+-- Куб дашборда: все графики вкладки «Дашборд» берутся срезами этих таблиц в памяти (dashboard_cube.py).
+-- Ячейка: месяц × район × регион × пол × возрастная группа × класс заболеваний —
+-- число рецептов, стоимость и HyperLogLog-регистры пациентов (уникальных пациентов можно объединять по ячейкам).
+-- Диагнозы — отдельной таблицей по (месяц, класс, диагноз): 14 тыс. диагнозов раздули бы основной куб до размера рецептов.
+-- Число регистров 2^14 должно совпадать с HLL_P в dashboard_cube.py.
+CREATE OR REPLACE TEMP TABLE cube_rows AS
+SELECT
+    date_trunc('month', pr.дата_рецепта)::DATE AS month,
+    pa.район_проживания::VARCHAR AS district,
+    pa.регион::VARCHAR AS region,
+    pa.пол::VARCHAR AS sex,
+    CASE
+        WHEN pa.дата_рождения IS NULL THEN NULL
+        WHEN date_diff('year', pa.дата_рождения, pr.дата_рецепта) < 18 THEN '0-17'
+        WHEN date_diff('year', pa.дата_рождения, pr.дата_рецепта) < 35 THEN '18-34'
+        WHEN date_diff('year', pa.дата_рождения, pr.дата_рецепта) < 60 THEN '35-59'
+        ELSE '60+'
+    END AS age_group,
+    d.класс_заболевания::VARCHAR AS disease_class,
+    d.код_мкб,
+    d.название_диагноза,
+    dr.стоимость AS cost,
+    hash(pr.id_пациента) AS patient_hash
+FROM prescriptions pr
+LEFT JOIN patients pa ON pr.id_пациента = pa.id_пациента
+LEFT JOIN diagnoses d ON pr.код_диагноза = d.код_мкб
+LEFT JOIN drugs dr ON pr.код_препарата = dr.код_препарата;
+
+CREATE OR REPLACE TABLE _cube_cells AS
+SELECT
+    row_number() OVER (ORDER BY month, district, region, sex, age_group, disease_class)::INTEGER AS cell,
+    *
+FROM (
+    SELECT month, district, region, sex, age_group, disease_class,
+           COUNT(*) AS prescriptions, SUM(cost) AS cost
+    FROM cube_rows
+    GROUP BY ALL
+);
+
+-- Регистр = младшие 14 бит хэша пациента, ранг = позиция первой единицы в остальных 50 битах
+CREATE OR REPLACE TABLE _cube_sketches AS
+SELECT
+    c.cell,
+    (r.patient_hash & 16383)::USMALLINT AS register,
+    MAX(CASE WHEN r.patient_hash >> 14 = 0 THEN 51
+             ELSE 50 - floor(log2((r.patient_hash >> 14)::DOUBLE))::INTEGER END)::UTINYINT AS rank
+FROM cube_rows r
+JOIN _cube_cells c
+  ON  c.month IS NOT DISTINCT FROM r.month
+  AND c.district IS NOT DISTINCT FROM r.district
+  AND c.region IS NOT DISTINCT FROM r.region
+  AND c.sex IS NOT DISTINCT FROM r.sex
+  AND c.age_group IS NOT DISTINCT FROM r.age_group
+  AND c.disease_class IS NOT DISTINCT FROM r.disease_class
+GROUP BY 1, 2
+ORDER BY 1, 2;
+
+CREATE OR REPLACE TABLE _cube_diagnoses AS
+SELECT month, disease_class, код_мкб, название_диагноза,
+       COUNT(*) AS prescriptions, SUM(cost) AS cost
+FROM cube_rows
+GROUP BY ALL;
+
+-- Демография — по справочнику пациентов (в т.ч. без рецептов). Возраст считается от года рождения:
+-- date_diff('year', ...) в DuckDB — разность лет, поэтому возраст на любую дату восстанавливается точно.
+CREATE OR REPLACE TABLE _cube_patients AS
+SELECT
+    пол::VARCHAR AS sex,
+    район_проживания::VARCHAR AS district,
+    регион::VARCHAR AS region,
+    year(дата_рождения) AS birth_year,
+    COUNT(*) AS patients
+FROM patients
+GROUP BY ALL;
+
+DROP TABLE cube_rows;
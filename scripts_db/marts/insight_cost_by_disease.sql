@@ -1,11 +1,13 @@
-DELETE FROM insight_cost_by_disease;
+-- Витрина: стоимость лечения по группам заболеваний (полный пересчёт).
+-- Обычно обновляется инкрементально (marts.py), этот SQL — эталон для проверки: python scripts_db/refresh_marts.py --verify
+CREATE OR REPLACE TABLE insight_cost_by_disease AS
 
 -- 1. Определяем базовые данные: пациент, диагноз, группа болезни, стоимость
 WITH base AS (
     SELECT
         pr.id_пациента,
         pr.код_диагноза,
-        d.класс_заболевания AS disease_group,
+        d.класс_заболевания::VARCHAR AS disease_group,
         pr.код_препарата, -- Добавлен для удобства в дальнейшем
         dr.стоимость AS cost
     FROM prescriptions pr
@@ -37,28 +39,30 @@ patient_costs AS (
 avg_patient_cost AS (
     SELECT
         disease_group,
-        AVG(total_cost_per_patient_by_group) AS avg_cost_per_patient
+        AVG(total_cost_per_patient_by_group) AS avg_cost_per_patient,
+        COUNT(*) AS total_patients
     FROM patient_costs
     GROUP BY disease_group
 ),
 
--- 5. Определение топ-3 самых дорогих препаратов для каждой группы заболеваний (ИСПРАВЛЕНО)
+-- 5. Топ-3 самых дорогих препаратов для каждой группы заболеваний
+-- (ранжируем различные препараты, а не строки рецептов — иначе один препарат занимал все три места)
 top_ranked_drugs AS (
-    SELECT DISTINCT
+    SELECT
         b.disease_group,
         dr."Торговое название",
-        -- Присваиваем ранг каждому уникальному препарату внутри группы заболеваний
         ROW_NUMBER() OVER(
-            PARTITION BY b.disease_group 
-            ORDER BY dr.стоимость DESC
+            PARTITION BY b.disease_group
+            ORDER BY MAX(dr.стоимость) DESC, dr."Торговое название"
         ) AS rn
     FROM base b
     JOIN drugs dr ON b.код_препарата = dr.код_препарата
+    GROUP BY b.disease_group, dr."Торговое название"
 ),
 top_drugs AS (
     SELECT
         disease_group,
-        -- Собираем в массив только те, у которых ранг 1, 2 или 3
+        -- Собираем в строку только те, у которых ранг 1, 2 или 3
         ARRAY_TO_STRING(
             ARRAY_AGG("Торговое название" ORDER BY rn ASC), ', '
         ) AS top_expensive_drugs
@@ -67,14 +71,14 @@ top_drugs AS (
     GROUP BY disease_group
 )
 
--- Финальная вставка данных
-INSERT INTO insight_cost_by_disease
 SELECT
     a.disease_group,
     a.total_cost_group * 1.0 / a.total_prescriptions AS avg_cost_per_prescription,
     apc.avg_cost_per_patient, -- Средняя стоимость на пациента
     td.top_expensive_drugs,   -- Список самых дорогих препаратов
+    apc.total_patients,
+    a.total_prescriptions,
     CURRENT_TIMESTAMP AS date_updated
 FROM agg a
 JOIN avg_patient_cost apc ON a.disease_group = apc.disease_group
-JOIN top_drugs td ON a.disease_group = td.disease_group;
\ No newline at end of file
+JOIN top_drugs td ON a.disease_group = td.disease_group;
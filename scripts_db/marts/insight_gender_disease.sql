@@ -0,0 +1,29 @@
+-- Витрина: число пациентов по полу в каждой группе заболеваний и возрастной группе (полный пересчёт).
+-- Возраст — на дату рецепта, поэтому строки не «стареют» и витрину можно дописывать новыми рецептами.
+CREATE OR REPLACE TABLE insight_gender_disease AS
+
+WITH base AS (
+    SELECT DISTINCT
+        d.класс_заболевания::VARCHAR AS disease_group,
+        CASE
+            WHEN date_diff('year', pa.дата_рождения, pr.дата_рецепта) < 18 THEN '0-17'
+            WHEN date_diff('year', pa.дата_рождения, pr.дата_рецепта) < 35 THEN '18-34'
+            WHEN date_diff('year', pa.дата_рождения, pr.дата_рецепта) < 60 THEN '35-59'
+            ELSE '60+'
+        END AS age_group,
+        pr.id_пациента,
+        pa.пол::VARCHAR AS пол
+    FROM prescriptions pr
+    JOIN patients pa ON pr.id_пациента = pa.id_пациента
+    JOIN diagnoses d ON pr.код_диагноза = d.код_мкб
+)
+
+SELECT
+    disease_group,
+    age_group,
+    COUNT(*) FILTER (WHERE пол = 'М') AS male_patients,
+    COUNT(*) FILTER (WHERE пол = 'Ж') AS female_patients,
+    COUNT(*) FILTER (WHERE пол = 'Ж') - COUNT(*) FILTER (WHERE пол = 'М') AS female_minus_male,
+    CURRENT_TIMESTAMP AS date_updated
+FROM base
+GROUP BY disease_group, age_group;
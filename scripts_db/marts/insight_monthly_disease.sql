@@ -0,0 +1,13 @@
+-- Витрина: помесячная динамика рецептов и пациентов по группам заболеваний.
+-- Отвечает на вопросы "динамика ... по месяцам" без JOIN по миллиону рецептов.
+CREATE OR REPLACE TABLE insight_monthly_disease AS
+SELECT
+    date_trunc('month', pr.дата_рецепта)::DATE AS month,
+    d.класс_заболевания::VARCHAR AS disease_group,
+    COUNT(*) AS prescriptions_count,
+    COUNT(DISTINCT pr.id_пациента) AS patients_count,
+    CURRENT_TIMESTAMP AS date_updated
+FROM prescriptions pr
+JOIN diagnoses d ON pr.код_диагноза = d.код_мкб
+GROUP BY 1, 2
+ORDER BY 1, 2;
@@ -0,0 +1,25 @@
+-- Витрина: популярность препаратов по районам внутри группы заболеваний (полный пересчёт).
+-- prescriptions_share — доля препарата среди всех назначений района для этой группы.
+CREATE OR REPLACE TABLE insight_region_drug_choice AS
+
+WITH counts AS (
+    SELECT
+        pa.район_проживания::VARCHAR AS region,
+        d.класс_заболевания::VARCHAR AS disease_group,
+        dr."Торговое название" AS drug_name,
+        COUNT(*) AS prescriptions_count
+    FROM prescriptions pr
+    JOIN patients pa ON pr.id_пациента = pa.id_пациента
+    JOIN diagnoses d ON pr.код_диагноза = d.код_мкб
+    JOIN drugs dr ON pr.код_препарата = dr.код_препарата
+    GROUP BY 1, 2, 3
+)
+
+SELECT
+    region,
+    disease_group,
+    drug_name,
+    prescriptions_count,
+    prescriptions_count * 1.0 / SUM(prescriptions_count) OVER (PARTITION BY region, disease_group) AS prescriptions_share,
+    CURRENT_TIMESTAMP AS date_updated
+FROM counts;
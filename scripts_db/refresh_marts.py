@@ -0,0 +1,68 @@
+# scripts_db/refresh_marts.py
+# Обновление витрин insight_* по новым рецептам (без DELETE + полного пересчёта):
+#   python scripts_db/refresh_marts.py           ← только рецепты новее водяного знака каждой витрины
+#   python scripts_db/refresh_marts.py --full    ← пересчитать частичные агрегаты с нуля
+#   python scripts_db/refresh_marts.py --verify  ← сравнить витрины с эталонным SQL из scripts_db/marts/ (база не меняется)
+import sys
+import argparse
+import time
+import duckdb
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+import db_snapshot
+import marts
+
+DB_PATH = PROJECT_ROOT / "db" / "medinsight.duckdb"
+
+
+def print_report(report: dict):
+    for name, r in report.items():
+        if r["mode"] == "skip":
+            print(f"⏭ {name}: новых рецептов нет")
+        else:
+            mode = "полный пересчёт" if r["mode"] == "full" else "дельта"
+            print(f"✅ {name}: {mode}, {r['rows']:,} рецептов за {r['seconds']:.2f} сек")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Инкрементальное обновление витрин insight_*")
+    parser.add_argument("marts", nargs="*", help="какие витрины (по умолчанию все)")
+    parser.add_argument("--full", action="store_true", help="пересчитать с нуля")
+    parser.add_argument("--verify", action="store_true", help="сравнить с полным пересчётом, ничего не меняя")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    args = parser.parse_args()
+    unknown = set(args.marts) - set(marts.MARTS)
+    if unknown:
+        parser.error(f"неизвестные витрины: {', '.join(sorted(unknown))} (есть: {', '.join(marts.MARTS)})")
+    names = args.marts or None
+
+    if args.verify:
+        con = duckdb.connect(db_snapshot.resolve(args.db), read_only=True)
+        start = time.perf_counter()
+        mismatches = marts.verify(con, names)
+        con.close()
+        for name, count in mismatches.items():
+            print(f"{'✅' if count == 0 else '❌'} {name}: {count} расхождений с полным пересчётом")
+        print(f"\nПроверка заняла {time.perf_counter() - start:.1f} сек")
+        sys.exit(1 if any(mismatches.values()) else 0)
+
+    # Если новых рецептов нет, новый снимок не нужен
+    con = duckdb.connect(db_snapshot.resolve(args.db), read_only=True)
+    steps = marts.plan(con, names, full=args.full)
+    con.close()
+    if all(mode == "skip" for mode, _ in steps.values()):
+        print_report({name: {"mode": "skip"} for name in steps})
+        return
+
+    # Витрины пишутся в копию текущего снимка и публикуются атомарно (как run_sql.py)
+    with db_snapshot.build(args.db, from_current=True) as snapshot:
+        con = duckdb.connect(snapshot)
+        print_report(marts.refresh(con, names, full=args.full))
+        con.close()
+    print(f"📌 Опубликован снимок {Path(db_snapshot.resolve(args.db)).name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,26 @@
 # scripts_db/run_sql.py
+# Выполнить DDL/DML-скрипты (CREATE, INSERT...) — сразу несколько, в порядке зависимостей и параллельно:
+#   python scripts_db/run_sql.py my_script.sql [other.sql ...]
+# Постоянные витрины кладите в scripts_db/marts/ — их собирает scripts_db/build_marts.py.
 import duckdb
 import sys
 from pathlib import Path
 
-DB_PATH = Path(__file__).parent.parent / "db" / "medinsight.duckdb"
-SQL_FILE = Path(sys.argv[1])
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+import db_snapshot
+import mart_build
 
-con = duckdb.connect(str(DB_PATH))
-with open(SQL_FILE, "r", encoding="utf-8") as f:
-    con.execute(f.read())
-con.close()
-print("✅ Выполнено.")
\ No newline at end of file
+DB_PATH = PROJECT_ROOT / "db" / "medinsight.duckdb"
+SQL_FILES = [Path(arg) for arg in sys.argv[1:]]
+
+# DDL/DML применяем к копии текущей версии и публикуем её целиком:
+# приложение не видит полуизменённую базу и не упирается в блокировку файла
+with db_snapshot.build(DB_PATH, from_current=True) as snapshot:
+    con = duckdb.connect(snapshot)
+    try:
+        report = mart_build.build(con, force=True, stages=mart_build.discover(files=SQL_FILES))
+    finally:
+        con.close()
+print(mart_build.format_report(report))
+print(f"✅ Выполнено. Опубликован снимок {Path(db_snapshot.resolve(DB_PATH)).name}")
@@ -4,7 +4,11 @@ import sys
 import re
 from pathlib import Path
 
-DB_PATH = Path(__file__).parent.parent / "db" / "medinsight.duckdb"
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+import db_snapshot
+
+DB_PATH = db_snapshot.resolve(PROJECT_ROOT / "db" / "medinsight.duckdb")  # текущий снимок базы
 SQL_FILE = Path(sys.argv[1])
 OUTPUT_CSV = Path("answer.csv")
 
@@ -15,7 +19,7 @@ def is_safe(q):
     tokens = re.findall(r'\b\w+\b', clean.upper())
     return not any(t in DANGEROUS for t in tokens[:3])
 
-con = duckdb.connect(str(DB_PATH), read_only=True)
+con = duckdb.connect(DB_PATH, read_only=True)
 with open(SQL_FILE, "r", encoding="utf-8") as f:
     sql = f.read().strip()
 
@@ -0,0 +1,111 @@
+# scripts_db/storage_report.py
+# Отчёт по группам строк (row groups): min/max колонок из статистики DuckDB.
+# По нему видно, сколько групп запрос с фильтром может пропустить целиком (zone maps).
+#   python scripts_db/storage_report.py                                  ← рецепты: дата_рецепта + диагноз
+#   python scripts_db/storage_report.py patients --columns район_проживания
+#   python scripts_db/storage_report.py --column дата_рецепта --low 2023-03-01 --high 2023-04-01
+import sys
+import argparse
+import duckdb
+import pandas as pd
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+import db_snapshot
+
+DB_PATH = PROJECT_ROOT / "db" / "medinsight.duckdb"
+# Таблица рецептов -> колонки кластеризации (см. cluster_order в 01_setup_db.py)
+FACT_COLUMNS = {
+    "prescriptions_fact": ["дата_рецепта", "diagnosis_key"],
+    "prescriptions": ["дата_рецепта", "код_диагноза"],
+}
+
+
+def default_table(con) -> str:
+    tables = {row[0] for row in con.execute("SELECT table_name FROM duckdb_tables()").fetchall()}
+    return next((t for t in FACT_COLUMNS if t in tables), "prescriptions")
+
+
+def row_groups(con, table: str, columns: list) -> pd.DataFrame:
+    """row_group_id, rows и <колонка>_min / <колонка>_max для каждой группы строк.
+
+    Статистика берётся из pragma_storage_info: строки в ней усечены до 8 байт (для кодов МКБ хватает),
+    а только что вставленные данные попадают в неё после CHECKPOINT.
+    """
+    types = {row[0]: row[1] for row in con.execute(f'DESCRIBE "{table}"').fetchall()}
+    result = con.execute(f"""
+        SELECT row_group_id, max(count) AS rows FROM pragma_storage_info('{table}')
+        WHERE segment_type = 'VALIDITY' GROUP BY 1 ORDER BY 1
+    """).fetchdf()
+    for column in columns:
+        # ENUM хранится как число — статистика по нему бесполезна для фильтров по тексту
+        cast = types[column] if not types[column].startswith("ENUM") else "VARCHAR"
+        stats = con.execute(f"""
+            SELECT
+                row_group_id,
+                min(TRY_CAST(regexp_extract(stats, 'Min: (.*?), Max: ', 1) AS {cast})) AS "{column}_min",
+                max(TRY_CAST(regexp_extract(stats, 'Max: (.*?)(?:, Has Unicode|\\])', 1) AS {cast})) AS "{column}_max"
+            FROM pragma_storage_info('{table}')
+            WHERE column_name = ? AND segment_type <> 'VALIDITY' AND stats LIKE '[Min:%'
+            GROUP BY 1
+        """, [column]).fetchdf()
+        result = result.merge(stats, on="row_group_id", how="left")
+    return result
+
+
+def skippable(groups: pd.DataFrame, column: str, low=None, high=None) -> int:
+    """Сколько групп не пересекается с диапазоном [low, high) по колонке — их DuckDB не читает"""
+    low = pd.Series([low]).astype(groups[f"{column}_min"].dtype)[0] if low is not None else None
+    high = pd.Series([high]).astype(groups[f"{column}_max"].dtype)[0] if high is not None else None
+    outside = pd.Series(False, index=groups.index)
+    if low is not None:
+        outside |= groups[f"{column}_max"] < low
+    if high is not None:
+        outside |= groups[f"{column}_min"] >= high
+    return int(outside.sum())
+
+
+def overlap(groups: pd.DataFrame, column: str) -> float:
+    """Со сколькими группами в среднем пересекается диапазон группы (1.0 — идеальная кластеризация)"""
+    lows, highs = groups[f"{column}_min"], groups[f"{column}_max"]
+    if groups.empty:
+        return 0.0
+    hits = [int(((lows <= high) & (highs >= low)).sum()) for low, high in zip(lows, highs)]
+    return sum(hits) / len(hits)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="min/max по группам строк и оценка пропуска групп")
+    parser.add_argument("table", nargs="?")
+    parser.add_argument("--columns", nargs="+")
+    parser.add_argument("--column", help="колонка фильтра для оценки пропуска")
+    parser.add_argument("--low")
+    parser.add_argument("--high")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    args = parser.parse_args()
+
+    db_file = db_snapshot.resolve(args.db)
+    con = duckdb.connect(db_file, read_only=True)
+    fact = default_table(con)
+    table = args.table or fact
+    if con.execute("SELECT COUNT(*) FROM duckdb_views() WHERE view_name = ?", [table]).fetchone()[0]:
+        con.close()
+        sys.exit(f"❌ {table} — представление, групп строк у него нет (рецепты лежат в {fact})")
+    columns = args.columns or FACT_COLUMNS.get(table, [])
+    groups = row_groups(con, table, columns)
+    con.close()
+
+    print(f"🔹 {table}: {len(groups)} групп строк, {int(groups['rows'].sum()):,} строк ({Path(db_file).name})\n")
+    with pd.option_context("display.max_rows", 200, "display.width", 200):
+        print(groups.to_string(index=False))
+    print()
+    for column in columns:
+        print(f"📊 {column}: группа пересекается в среднем с {overlap(groups, column):.1f} группами из {len(groups)}")
+    if args.column:
+        skipped = skippable(groups, args.column, args.low, args.high)
+        print(f"\n✂️ Фильтр {args.column} в [{args.low}, {args.high}): пропускается {skipped} из {len(groups)} групп")
+
+
+if __name__ == "__main__":
+    main()
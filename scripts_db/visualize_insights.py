@@ -1,3 +1,4 @@
+import sys
 import duckdb
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -5,7 +6,11 @@ import seaborn as sns
 from pathlib import Path
 
 # --- Настройка путей и папки для сохранения (Оставляем как есть) ---
-DB_PATH = Path(__file__).parent.parent / "db" / "medinsight.duckdb"
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+import db_snapshot
+
+DB_PATH = db_snapshot.resolve(PROJECT_ROOT / "db" / "medinsight.duckdb")  # текущий снимок базы
 charts_dir = Path(__file__).parent / 'charts'
 
 # --- 1. Гарантированное создание папки charts (Оставляем как есть) ---
@@ -42,7 +47,7 @@ def load_insight_data(con, table_name):
 # --- Основная логика ---
 con = None
 try:
-    con = duckdb.connect(str(DB_PATH), read_only=True)
+    con = duckdb.connect(DB_PATH, read_only=True)
     print("Соединение с DuckDB установлено.")
     
     # 2. Загрузка всех инсайт-таблиц (Оставляем как есть)
@@ -194,9 +199,9 @@ try:
 
 except Exception as e:
     print(f"\n❌ Произошла ошибка во время работы: {e}")
-    if "lock" in str(e) or "DBeaver" in str(e):
-        print("\nПОЖАЛУЙСТА, ЗАКРОЙТЕ DBeaver! Он держит блокировку на файле базы данных.")
-        print("Повторите запуск скрипта после закрытия приложения.")
+    if "lock" in str(e):
+        # Сборщик базы пишет только в новые снимки, так что блокировку держит стороннее подключение на запись
+        print(f"\nСнимок {Path(DB_PATH).name} открыт на запись другим приложением (DBeaver и т.п.). Переподключите его в режиме read-only.")
     else:
         print("Проверьте ваши инсайт-таблицы на наличие ошибок в SQL-запросах (например, пустые или некорректные данные).")
 
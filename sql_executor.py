@@ -0,0 +1,311 @@
+import os
+import re
+import math
+import time
+import queue
+import threading
+from collections import deque
+import duckdb
+
+from result_cache import get_result_cache, fingerprint, is_volatile
+import query_guard
+import db_snapshot
+import tracing
+import workload_log
+
+# --- КОНФИГУРАЦИЯ ---
+DB_PATH = "db/medinsight.duckdb"
+POOL_SIZE = int(os.getenv("SQL_POOL_SIZE", "4"))           # число воркеров = число соединений
+MAX_QUEUE = int(os.getenv("SQL_MAX_QUEUE", "32"))          # сколько запросов может ждать в очереди
+QUEUE_TIMEOUT = float(os.getenv("SQL_QUEUE_TIMEOUT", "5"))  # сколько ждать места в полной очереди
+DEFAULT_TIMEOUT = 30   # сек, как раньше у subprocess.run
+DEFAULT_LIMIT = 50     # как в scripts_db/run_sql_safe.py
+
+# Те же правила безопасности, что и в scripts_db/run_sql_safe.py
+DANGEROUS = {'CREATE','DROP','INSERT','UPDATE','DELETE','ALTER','TRUNCATE','REPLACE','COPY'}
+
+def is_safe(q):
+    clean = re.sub(r'--.*', '', q)
+    tokens = re.findall(r'\b\w+\b', clean.upper())
+    return not any(t in DANGEROUS for t in tokens[:3])
+
+def split_queries(sql: str) -> list:
+    # Фрагменты только из комментариев (например, "; -- конец") не считаем запросами
+    return [q.strip() for q in sql.strip().split(";") if re.sub(r'--.*', '', q).strip()]
+
+# Ошибки нагрузки, а не самого SQL: очередь, таймаут, отмена. Отказ Query Guard сюда не входит —
+# он детерминирован для того же SQL и той же базы, запрос нужно переписать
+TRANSIENT_ERRORS = ("Сервер перегружен", "SQL Query Timed Out", "Запрос отменён")
+
+def is_transient_error(error: str) -> bool:
+    """Запрос не выполнен из-за нагрузки, а не из-за ошибки в SQL: тот же запрос может пройти позже"""
+    return bool(error) and error.startswith(TRANSIENT_ERRORS)
+
+def db_version(db_path: str = DB_PATH):
+    """Версия базы: меняется при каждой пересборке или публикации нового снимка (имя + размер + время изменения)"""
+    physical = db_snapshot.resolve(db_path)
+    try:
+        st = os.stat(physical)
+    except OSError:
+        return None
+    return f"{os.path.basename(physical)}-{st.st_size}-{st.st_mtime_ns}"
+
+def apply_limit(query: str, limit) -> str:
+    """Добавляет LIMIT, если это SELECT без LIMIT (поведение run_sql_safe.py)"""
+    if limit and query.upper().startswith("SELECT") and "LIMIT" not in query.upper():
+        query += f" LIMIT {limit}"
+    return query
+
+
+def _plain_categories(df):
+    """ENUM-колонки DuckDB приходят как pandas Categorical — отдаём обычные значения,
+    чтобы replace/конкатенация в вызывающем коде работали как со старой VARCHAR-схемой"""
+    categorical = df.select_dtypes("category").columns
+    if len(categorical):
+        df[categorical] = df[categorical].astype(object)
+    return df
+
+
+class DuckDBPool:
+    """Пул read-only соединений к DuckDB внутри процесса (без subprocess и answer.csv).
+
+    Каждый запрос — отдельная задача в FIFO-очереди фиксированного размера; её выполняет
+    один из воркеров со своим соединением, результат возвращается только вызывающему.
+    Пул привязан к одному снимку базы: после публикации новой версии get_pool() создаёт новый пул,
+    а этот дорабатывает уже принятые запросы и закрывается.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, size: int = POOL_SIZE, max_queue: int = MAX_QUEUE):
+        self.logical_path = db_path
+        self.db_path = db_snapshot.resolve(db_path)
+        self.size = size
+        self._base = duckdb.connect(self.db_path, read_only=True, config={
+            "memory_limit": query_guard.MEMORY_LIMIT, "threads": query_guard.THREADS
+        })
+        self._jobs = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=500)  # последние времена ожидания в очереди, мс
+        self._counters = {"submitted": 0, "rejected": 0, "completed": 0, "in_flight": 0}
+        self._closed = False
+        self._submitting = 0  # сколько вызовов сейчас кладут задачу в очередь (close() их дожидается)
+        self._workers = []
+        # cursor() — отдельное соединение к той же базе, их можно использовать из разных потоков
+        for i in range(size):
+            worker = threading.Thread(target=self._worker, args=(self._base.cursor(),), name=f"duckdb-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def execute(self, sql_query: str, timeout: float = DEFAULT_TIMEOUT, limit=DEFAULT_LIMIT, arrow: bool = False,
+                use_cache: bool = True, cancel_event: threading.Event = None, guard: bool = True, params=None,
+                source: str = None):
+        """Возвращает (result, error): типизированный DataFrame (или Arrow Table) либо текст ошибки.
+
+        cancel_event — если его выставить, запрос снимается с очереди или прерывается через interrupt().
+        guard — перед выполнением оценить план (query_guard) и отклонить слишком дорогой запрос.
+        params — значения для ? / $name в запросе (значения не подставляются в текст SQL).
+        source — кто спрашивает ("agent", "dashboard"): такие запросы пишутся в журнал нагрузки workload_log;
+        служебные (схема, EXPLAIN, индекс терминов) вызываются без него и в журнал не попадают.
+        """
+        queries = split_queries(sql_query)
+        if not queries:
+            return None, "Пустой SQL запрос."
+        if params is not None and len(queries) > 1:
+            return None, "Параметры можно передать только одному запросу."
+        for i, query in enumerate(queries):
+            if not is_safe(query):
+                return None, f"❌ Запрещённый запрос {i+1}: разрешены только SELECT-запросы."
+
+        # Общий кэш результатов: одинаковый (с точностью до форматирования) SQL к той же базе.
+        # Запросы с текущей датой/временем или случайными значениями не кэшируются: база та же, ответ — нет
+        cache = get_result_cache() if use_cache and not is_volatile(sql_query) else None
+        cache_key = fingerprint(sql_query, self.db_path, f"limit={limit};arrow={arrow};params={params!r}")
+        if cache is not None:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                tracing.set_attributes(result_cache="hit")
+                if source:
+                    workload_log.record(sql_query, source, self.logical_path, 0.0, len(cached), cached=True)
+                return cached, None
+
+        with self._lock:
+            if self._closed:
+                # Пул уже выведен из работы (вышла новая версия базы) — отдаём запрос актуальному
+                return get_pool(self.logical_path).execute(
+                    sql_query, timeout=timeout, limit=limit, arrow=arrow,
+                    use_cache=use_cache, cancel_event=cancel_event, guard=guard, params=params, source=source
+                )
+            self._submitting += 1
+
+        job = {
+            "queries": queries, "params": params, "timeout": timeout, "limit": limit, "arrow": arrow, "guard": guard,
+            "enqueued_at": time.perf_counter(), "started_at": None, "finished_at": None, "done": threading.Event(), "result": (None, None),
+            "lock": threading.Lock(), "state": "queued", "con": None, "stop_reason": None
+        }
+        try:
+            # Backpressure: при полной очереди ждём немного и отказываем, а не копим задачи
+            self._jobs.put(job, timeout=QUEUE_TIMEOUT)
+        except queue.Full:
+            with self._lock:
+                self._counters["rejected"] += 1
+                self._submitting -= 1
+            return None, "Сервер перегружен: очередь SQL-запросов заполнена. Повторите запрос позже."
+        with self._lock:
+            self._counters["submitted"] += 1
+            self._submitting -= 1
+
+        if cancel_event is None:
+            job["done"].wait()
+        else:
+            while not job["done"].wait(0.05):
+                if cancel_event.is_set():
+                    self._stop(job, "cancelled")
+                    job["done"].wait()
+                    break
+        result, error = job["result"]
+        if job["started_at"] is not None:
+            queue_wait_ms = round((job["started_at"] - job["enqueued_at"]) * 1000, 1)
+            tracing.set_attributes(queue_wait_ms=queue_wait_ms, result_cache="miss" if cache is not None else "off")
+            if source:
+                workload_log.record(sql_query, source, self.logical_path, (job["finished_at"] - job["started_at"]) * 1000,
+                                    len(result) if result is not None else None, error, queue_wait_ms=queue_wait_ms)
+        if cache is not None and error is None and result is not None:
+            cache.put(cache_key, sql_query, result)
+        return result, error
+
+    def _stop(self, job: dict, reason: str):
+        """Останавливает задачу: ещё в очереди — воркер её пропустит, уже выполняется — interrupt()"""
+        with job["lock"]:
+            if job["state"] == "done" or job["stop_reason"]:
+                return
+            job["stop_reason"] = reason
+            if job["state"] == "running":
+                job["con"].interrupt()
+
+    def _worker(self, con):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                con.close()
+                return
+            job["started_at"] = time.perf_counter()
+            with self._lock:
+                self._waits.append((job["started_at"] - job["enqueued_at"]) * 1000)
+                self._counters["in_flight"] += 1
+            try:
+                job["result"] = self._run(con, job)
+            finally:
+                job["finished_at"] = time.perf_counter()
+                with self._lock:
+                    self._counters["in_flight"] -= 1
+                    self._counters["completed"] += 1
+                job["done"].set()
+
+    def _run(self, con, job: dict):
+        timeout = job["timeout"]
+        with job["lock"]:
+            if job["stop_reason"] == "cancelled":
+                job["state"] = "done"
+                return None, "Запрос отменён."
+            job["state"], job["con"] = "running", con
+
+        # Тайм-аут считается с момента начала выполнения, а не постановки в очередь
+        timer = threading.Timer(timeout, self._stop, args=(job, "timeout"))
+        timer.daemon = True
+        timer.start()
+        try:
+            result = None
+            for query in job["queries"]:
+                query = apply_limit(query, job["limit"])
+                if job["guard"] and query.upper().startswith(("SELECT", "WITH")):
+                    rejection = query_guard.check(con, query, job["params"])
+                    if rejection:
+                        return None, rejection
+                cur = con.execute(query, job["params"])
+                result = cur.fetch_arrow_table() if job["arrow"] else _plain_categories(cur.df())
+            return result, None
+        except Exception as e:
+            if job["stop_reason"] == "cancelled":
+                return None, "Запрос отменён."
+            if job["stop_reason"] == "timeout" or isinstance(e, duckdb.InterruptException):
+                return None, f"SQL Query Timed Out (более {timeout:g} сек)."
+            return None, str(e)
+        finally:
+            with job["lock"]:
+                job["state"] = "done"
+            timer.cancel()
+
+    def stats(self) -> dict:
+        """Метрики очереди: глубина, занятые воркеры, время ожидания"""
+        with self._lock:
+            waits = sorted(self._waits)
+            stats = dict(self._counters)
+        stats["workers"] = self.size
+        stats["snapshot"] = os.path.basename(self.db_path)
+        stats["queue_depth"] = self._jobs.qsize()
+        stats["avg_wait_ms"] = sum(waits) / len(waits) if waits else 0.0
+        # Ближайший ранг: ceil(0.95 * n)-й элемент по порядку
+        stats["p95_wait_ms"] = waits[max(math.ceil(len(waits) * 0.95) - 1, 0)] if waits else 0.0
+        stats["max_wait_ms"] = waits[-1] if waits else 0.0
+        return stats
+
+    def close(self):
+        """Плавное закрытие: новые запросы уходят в актуальный пул, принятые — дорабатывают"""
+        with self._lock:
+            self._closed = True
+        while True:
+            with self._lock:
+                if self._submitting == 0:
+                    break
+            time.sleep(0.01)
+        # Сигнал остановки встаёт в очередь после всех принятых задач (FIFO)
+        for _ in self._workers:
+            self._jobs.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._base.close()
+
+
+def get_schema(db_path: str = DB_PATH) -> dict:
+    """Схема базы {таблица: [(колонка, тип), ...]} (кэшируется вместе с результатами запросов)"""
+    df, error = get_pool(db_path).execute(
+        "SELECT table_name, column_name, data_type FROM information_schema.columns "
+        # Служебные таблицы (_ingest_state и т.п.) в схему для LLM не попадают
+        "WHERE table_schema = 'main' AND NOT starts_with(table_name, '_') ORDER BY table_name, ordinal_position",
+        limit=None
+    )
+    if error:
+        raise RuntimeError(error)
+    schema = {}
+    for table, column, dtype in df.itertuples(index=False):
+        schema.setdefault(table, []).append((column, dtype))
+    return schema
+
+
+def get_table_comments(db_path: str = DB_PATH) -> dict:
+    """Описания таблиц из каталога {таблица: COMMENT ON TABLE} — так регистрируются витрины mart_advisor.py"""
+    df, error = get_pool(db_path).execute(
+        "SELECT table_name, comment FROM duckdb_tables() "
+        "WHERE schema_name = 'main' AND comment IS NOT NULL AND comment <> '' AND NOT starts_with(table_name, '_')",
+        limit=None
+    )
+    if error:
+        return {}
+    return dict(df.itertuples(index=False))
+
+
+# --- ОБЩИЙ ПУЛ НА ПРОЦЕСС ---
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path: str = DB_PATH) -> DuckDBPool:
+    """Пул для текущей версии базы; при смене снимка старый пул выводится из работы в фоне"""
+    physical = db_snapshot.resolve(db_path)
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is not None and pool.db_path == physical:
+            return pool
+        current = _pools[db_path] = DuckDBPool(db_path)
+    if pool is not None:
+        print(f"🔄 DB SNAPSHOT SWITCH: {os.path.basename(pool.db_path)} -> {os.path.basename(current.db_path)}")
+        threading.Thread(target=pool.close, name="duckdb-pool-drain", daemon=True).start()
+    return current
@@ -0,0 +1,179 @@
+import re
+import difflib
+import threading
+
+from sql_executor import DB_PATH, get_pool, get_schema, split_queries
+
+# Сколько детерминированных исправлений пробуем, прежде чем отдать ошибку LLM
+MAX_FIXES = 5
+
+# Общая на процесс статистика (все агенты)
+_stats = {"checked": 0, "valid": 0, "repaired": 0, "residual_errors": 0, "fixes": 0}
+_stats_lock = threading.Lock()
+
+# Строки и идентификаторы в кавычках — их содержимое не трогаем
+_QUOTED_RE = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+_JOIN_RULE_RE = re.compile(r"(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)")
+_TABLE_ALIAS_RE = re.compile(r'\b(?:FROM|JOIN)\s+"?(\w+)"?(?:\s+(?:AS\s+)?(?!ON\b|USING\b|WHERE\b|GROUP\b|ORDER\b|LIMIT\b|JOIN\b|LEFT\b|RIGHT\b|INNER\b|FULL\b|CROSS\b)(\w+))?', re.IGNORECASE)
+
+
+def _map_unquoted(sql: str, fn) -> str:
+    """Применяет fn только к частям SQL вне кавычек"""
+    parts = _QUOTED_RE.split(sql)
+    return "".join(part if i % 2 else fn(part) for i, part in enumerate(parts))
+
+
+def _quote(name: str) -> str:
+    return name if re.fullmatch(r"[^\W\d]\w*", name) else '"' + name.replace('"', '""') + '"'
+
+
+def _replace_identifier(sql: str, old: str, new: str, qualifier: str = None) -> str:
+    """Заменяет идентификатор old (с кавычками или без) на new, опционально только после "qualifier." """
+    prefix = rf"(?<![\w.]){re.escape(qualifier)}\." if qualifier else r"(?<![\w\"])"
+    replacement = (f"{qualifier}." if qualifier else "") + _quote(new)
+    # Сначала "old" в кавычках, потом голое вхождение вне строк
+    sql = re.sub(prefix + f'"{re.escape(old)}"', lambda m: replacement, sql)
+    pattern = re.compile(prefix + re.escape(old) + r"(?!\w)")
+    return _map_unquoted(sql, lambda part: pattern.sub(lambda m: replacement, part))
+
+
+def parse_join_keys(relationships: list) -> dict:
+    """Из MY_RELATIONSHIPS: {(таблица, ошибочная_колонка): правильная_колонка} для ключей JOIN"""
+    keys = {}
+    for rule in relationships or []:
+        match = _JOIN_RULE_RE.search(rule)
+        if not match:
+            continue
+        left_table, left_col, right_table, right_col = match.groups()
+        if left_col != right_col:
+            keys[(right_table, left_col)] = right_col
+            keys[(left_table, right_col)] = left_col
+    return keys
+
+
+def _candidates(error: str) -> list:
+    match = re.search(r"Candidate bindings:[:\s]*(.*)", error)
+    return re.findall(r'"([^"]+)"', match.group(1)) if match else []
+
+
+def _best_match(name: str, options: list):
+    lowered = {o.lower(): o for o in options}
+    if name.lower() in lowered:
+        return lowered[name.lower()]
+    # "класс" -> "класс_заболевания": единственная колонка с таким началом
+    prefixed = [o for o in options if o.lower().startswith(name.lower())]
+    if len(prefixed) == 1:
+        return prefixed[0]
+    close = difflib.get_close_matches(name.lower(), list(lowered), n=1, cutoff=0.75)
+    return lowered[close[0]] if close else None
+
+
+class SQLPreflight:
+    """Проверка SQL через EXPLAIN (парсинг + биндинг без выполнения) и локальная починка типовых ошибок"""
+
+    def __init__(self, db_path: str = DB_PATH, relationships: list = None):
+        self.db_path = db_path
+        self.join_keys = parse_join_keys(relationships)
+
+    def check(self, sql: str):
+        """Возвращает (sql, error): error=None, если запрос биндится; иначе ошибка для LLM"""
+        for query in split_queries(sql):
+            # Пробы EXPLAIN не кладём в кэш результатов: не занимают его бюджет и не искажают статистику попаданий
+            _, error = get_pool(self.db_path).execute("EXPLAIN " + query, limit=None, use_cache=False)
+            if error:
+                return sql, error
+        return sql, None
+
+    def repair(self, sql: str):
+        """Чинит SQL локально. Возвращает (sql, error, fixes): fixes — список применённых исправлений"""
+        schema = get_schema(self.db_path)
+        fixes = []
+        fixed = self._quote_identifiers(sql, schema)
+        if fixed != sql:
+            fixes.append("кавычки вокруг идентификаторов с пробелами")
+
+        fixed, error = self.check(fixed)
+        while error and len(fixes) < MAX_FIXES:
+            attempt, description = self._fix_error(fixed, error, schema)
+            if attempt is None or attempt == fixed:
+                break
+            fixes.append(description)
+            fixed, error = self.check(attempt)
+
+        with _stats_lock:
+            _stats["checked"] += 1
+            _stats["fixes"] += len(fixes)
+            if error:
+                _stats["residual_errors"] += 1
+            elif fixes:
+                _stats["repaired"] += 1
+            else:
+                _stats["valid"] += 1
+        return fixed, error, fixes
+
+    # --- Типовые исправления ---
+    def _quote_identifiers(self, sql: str, schema: dict) -> str:
+        """Торговое название -> "Торговое название" (колонки с пробелами без кавычек не парсятся)"""
+        spaced = {col for cols in schema.values() for col, _ in cols if not re.fullmatch(r"[^\W\d]\w*", col)}
+        for col in sorted(spaced, key=len, reverse=True):
+            words = [re.escape(w) for w in col.split()]
+            pattern = re.compile(r"(?<![\w\"])" + r"\s+".join(words) + r"(?![\w\"])", re.IGNORECASE)
+            sql = _map_unquoted(sql, lambda part: pattern.sub(_quote(col), part))
+        return sql
+
+    def _aliases(self, sql: str) -> dict:
+        aliases = {}
+        for table, alias in _TABLE_ALIAS_RE.findall(sql):
+            aliases[table.lower()] = table
+            if alias:
+                aliases[alias.lower()] = table
+        return aliases
+
+    def _fix_error(self, sql: str, error: str, schema: dict):
+        all_columns = [col for cols in schema.values() for col, _ in cols]
+
+        # Таблица с опечаткой: DuckDB сам подсказывает "Did you mean"
+        match = re.search(r'Table with name (\S+) does not exist!\s*Did you mean "([^"]+)"', error)
+        if match:
+            old, new = match.group(1), match.group(2).split(".")[-1]
+            return _replace_identifier(sql, old, new), f"таблица {old} -> {new}"
+
+        # Неизвестный алиас: x.col при единственном кандидате
+        match = re.search(r'Referenced table "([^"]+)" not found!\s*Candidate tables: "([^"]+)"', error)
+        if match:
+            old, new = match.group(1), match.group(2)
+            fixed = re.sub(rf"(?<![\w.]){re.escape(old)}\.", f"{new}.", sql)
+            return fixed, f"алиас {old}. -> {new}."
+
+        # Колонка не найдена в конкретной таблице/алиасе
+        match = re.search(r'Table "([^"]+)" does not have a column named "([^"]+)"', error)
+        if match:
+            alias, column = match.groups()
+            table = self._aliases(sql).get(alias.lower(), alias)
+            # Неверный ключ JOIN: diagnoses.код_диагноза -> diagnoses.код_мкб (из MY_RELATIONSHIPS)
+            new = self.join_keys.get((table, column))
+            description = f"ключ JOIN {alias}.{column} -> {alias}.{new}"
+            if new is None:
+                options = [c for c, _ in schema.get(table, [])] or _candidates(error) or all_columns
+                new = _best_match(column, options)
+                description = f"колонка {alias}.{column} -> {alias}.{new}"
+            if new:
+                return _replace_identifier(sql, column, new, qualifier=alias), description
+            return None, None
+
+        # Колонка без алиаса: берём из кандидатов DuckDB, иначе из всей схемы
+        match = re.search(r'Referenced column "([^"]+)" not found', error)
+        if match:
+            column = match.group(1)
+            new = _best_match(column, _candidates(error)) or _best_match(column, all_columns)
+            if new:
+                return _replace_identifier(sql, column, new), f"колонка {column} -> {new}"
+        return None, None
+
+
+def preflight_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    # Каждый локально починенный запрос — минимум один несделанный вызов _fix_sql_error
+    stats["llm_calls_avoided"] = stats["repaired"]
+    return stats
@@ -0,0 +1,164 @@
+import bisect
+import threading
+
+from ru_text import tokenize, stem
+from sql_executor import DB_PATH, db_version, get_pool, get_schema
+
+# --- КОНФИГУРАЦИЯ ---
+# Что индексируем: источник -> (справочник, колонка кода, колонка кода в prescriptions, [колонки с названиями])
+SOURCES = {
+    "diagnoses": ("diagnoses", "код_мкб", "код_диагноза", ["название_диагноза", "класс_заболевания"]),
+    "drugs": ("drugs", "код_препарата", "код_препарата", ["Торговое название", "Полное_название"]),
+}
+# Если база собрана с суррогатными ключами — фильтр по целым числам в prescriptions_fact
+FACT_TABLE = "prescriptions_fact"
+SURROGATE_KEYS = {"diagnoses": "diagnosis_key", "drugs": "drug_key"}
+MAX_CODES = 200        # больше кодов в IN-список не кладём — такой фильтр уже не селективен
+MAX_SHARE = 0.3        # термин, совпавший с >30% справочника, считаем общим словом ("болезнь", "препарат")
+MIN_PREFIX = 4         # основы короче ищем только целиком: "нос" не должен находить "диагностику"
+
+# Бытовые слова -> корни медицинских терминов (раньше эти расширения LLM делал через цепочки ILIKE)
+SYNONYMS = {
+    "нос": ["ринит", "синусит", "гайморит", "фронтит", "ринофаринг"],
+    "насморк": ["ринит"],
+    "горл": ["фарингит", "ларингит", "тонзиллит", "ангин"],
+    "рот": ["стоматит", "гингивит", "глоссит"],
+    "зуб": ["кариес", "пульпит", "периодонтит"],
+    "сердц": ["кардио", "кардит", "инфаркт", "ишеми", "стенокард", "аритми", "сердечн"],
+    "сердечн": ["кардио", "инфаркт", "ишеми", "стенокард"],
+    "давлен": ["гипертенз", "гипертони", "гипотенз"],
+    "живот": ["гастрит", "колит", "энтерит", "язв", "панкреатит"],
+    "желуд": ["гастрит", "гастродуоденит", "язв"],
+    "печен": ["гепатит", "цирроз", "гепат"],
+    "почк": ["нефрит", "пиелонефрит", "нефро"],
+    "легк": ["пневмони", "бронхит", "пульмон"],
+    "кашел": ["бронхит", "трахеит", "пневмони"],
+    "простуд": ["орви", "ринит", "фарингит", "грипп"],
+    "сахар": ["диабет"],
+    "суста": ["артрит", "артроз", "полиартрит"],
+    "спин": ["остеохондроз", "дорсопат", "радикулит"],
+    "кож": ["дерматит", "экзем", "псориаз", "дермат"],
+    "глаз": ["конъюнктивит", "кератит", "глауком", "катаракт"],
+    "ух": ["отит"],
+    "голов": ["мигрен", "цефал"],
+    "нерв": ["невр", "неврит", "невралги"],
+}
+
+
+def _stems(text) -> list:
+    """Основы слов без чисел и однобуквенных обрывков ("Грипп вирус 0" -> ["грипп", "вирус"])"""
+    return [stem(t) for t in tokenize(text) if len(t) > 1 and not t.isdigit()]
+
+
+class TermIndex:
+    """Инвертированный индекс основа -> коды по названиям диагнозов и лекарств.
+
+    Заменяет подстрочный поиск ILIKE '%...%' внутри JOIN с таблицей фактов:
+    агент заранее переводит термины вопроса в список кодов, и фильтр становится IN (...).
+    """
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._version = None
+        self._index = {}     # источник -> {основа: set(кодов)}
+        self._keys = {}      # источник -> отсортированные основы (для поиска по префиксу)
+        self._sizes = {}     # источник -> число кодов в справочнике
+        self._keys_by_code = {}  # источник -> {код: суррогатный ключ} (пусто для старой схемы)
+
+    def _load(self):
+        """Индекс строится один раз на версию базы (справочники маленькие: тысячи строк)"""
+        version = db_version(self.db_path)
+        with self._lock:
+            if version == self._version and self._index:
+                return
+            index, keys, sizes, keys_by_code = {}, {}, {}, {}
+            pool = get_pool(self.db_path)
+            schema = get_schema(self.db_path)
+            for source, (table, code_col, _, text_cols) in SOURCES.items():
+                key_col = SURROGATE_KEYS.get(source)
+                if FACT_TABLE in schema and key_col in dict(schema.get(table, [])):
+                    df, error = pool.execute(f'SELECT "{code_col}", {key_col} FROM {table}', limit=None, guard=False)
+                    if error:
+                        raise RuntimeError(f"Не удалось построить индекс терминов по {table}: {error}")
+                    keys_by_code[source] = {str(code): int(key) for code, key in df.itertuples(index=False)}
+                columns = ", ".join(f'"{c}"' for c in [code_col] + text_cols)
+                df, error = pool.execute(f"SELECT DISTINCT {columns} FROM {table}", limit=None, guard=False)
+                if error:
+                    raise RuntimeError(f"Не удалось построить индекс терминов по {table}: {error}")
+                postings = {}
+                for row in df.itertuples(index=False):
+                    code = str(row[0])
+                    for text in row[1:]:
+                        for s in _stems(text):
+                            postings.setdefault(s, set()).add(code)
+                index[source] = postings
+                keys[source] = sorted(postings)
+                sizes[source] = df.iloc[:, 0].nunique()
+            self._index, self._keys, self._sizes, self._version = index, keys, sizes, version
+            self._keys_by_code = keys_by_code
+
+    def _lookup(self, source: str, term: str, prefix: bool) -> set:
+        postings = self._index[source]
+        if not prefix:
+            return set(postings.get(term, ()))
+        keys = self._keys[source]
+        codes = set()
+        i = bisect.bisect_left(keys, term)
+        while i < len(keys) and keys[i].startswith(term):
+            codes |= postings[keys[i]]
+            i += 1
+        return codes
+
+    def search(self, source: str, word: str) -> set:
+        """Коды по одному слову вопроса: сама основа + медицинские синонимы"""
+        self._load()
+        s = stem(word.lower().replace("ё", "е"))
+        # Названия с цифрами ("Препарат5") — только точное совпадение, иначе найдутся Препарат50..59
+        codes = self._lookup(source, s, prefix=len(s) >= MIN_PREFIX and s.isalpha())
+        for root in SYNONYMS.get(s, []):
+            codes |= self._lookup(source, root, prefix=True)
+        return codes
+
+    def resolve(self, question: str) -> dict:
+        """{источник: {слово_вопроса: [коды]}} — только селективные совпадения"""
+        self._load()
+        found = {}
+        for source in SOURCES:
+            limit = min(MAX_CODES, max(1, int(self._sizes[source] * MAX_SHARE)))
+            for word in dict.fromkeys(t for t in tokenize(question) if len(t) > 1 and not t.isdigit()):
+                codes = self.search(source, word)
+                if codes and len(codes) <= limit:
+                    found.setdefault(source, {})[word] = sorted(codes)
+        return found
+
+    def prompt_hint(self, question: str) -> str:
+        """Блок для промпта: готовые IN-списки кодов вместо цепочек ILIKE"""
+        found = self.resolve(question)
+        if not found:
+            return ""
+        lines = []
+        for source, terms in found.items():
+            table, code_col, fact_col, _ = SOURCES[source]
+            key_map = self._keys_by_code.get(source)
+            for word, codes in terms.items():
+                if key_map and all(c in key_map for c in codes):
+                    # Компактная схема: целочисленный фильтр прямо по таблице фактов, без строковых кодов
+                    in_list = ", ".join(str(key_map[c]) for c in codes)
+                    key_col = SURROGATE_KEYS[source]
+                    lines.append(f'- "{word}" -> {FACT_TABLE}.{key_col} IN ({in_list})  (= {table}.{key_col})')
+                else:
+                    in_list = ", ".join(f"'{c}'" for c in codes)
+                    lines.append(f'- "{word}" -> prescriptions.{fact_col} IN ({in_list})  (= {table}.{code_col})')
+        return "\n".join(lines)
+
+
+# --- ОБЩИЙ ИНДЕКС НА ПРОЦЕСС ---
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_term_index(db_path: str = DB_PATH) -> TermIndex:
+    with _indexes_lock:
+        if db_path not in _indexes:
+            _indexes[db_path] = TermIndex(db_path)
+        return _indexes[db_path]
@@ -0,0 +1,120 @@
+# tests/test_chat_store.py
+# Хранилище чатов (chat_store.py) во временном SQLite-файле.
+# Запуск из корня проекта: python -m pytest -q tests
+import sqlite3
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from chat_store import ChatStore, FrameCache
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChatStore(str(tmp_path / "chats.sqlite"))
+
+
+def test_owners_do_not_see_each_other(store):
+    alice = store.create_chat("alice")
+    message_id = store.add_message("alice", alice, "assistant", "диабет по районам", pd.DataFrame({"n": [1, 2]}))
+    bob = store.create_chat("bob")
+
+    assert [c["chat_id"] for c in store.list_chats("bob")] == [bob]
+    assert not store.chat_exists("bob", alice)
+    assert store.messages("bob", alice) == []
+    assert store.frame("bob", message_id) is None
+    assert store.search("bob", "диабет") == []
+    assert store.add_message("bob", alice, "user", "чужой чат") is None
+
+    store.delete_chat("bob", alice)
+    assert store.chat_exists("alice", alice)
+    assert [h["chat_id"] for h in store.search("alice", "диабет")] == [alice]
+
+
+def test_latest_chat_is_per_owner(store):
+    first = store.create_chat("alice")
+    store.create_chat("bob")
+    assert store.list_chats("alice")[0]["chat_id"] == first
+
+
+def test_store_without_owner_column_is_migrated(tmp_path):
+    path = str(tmp_path / "old.sqlite")
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE chats (chat_id TEXT PRIMARY KEY, name TEXT NOT NULL, created_at REAL NOT NULL, updated_at REAL NOT NULL)")
+    con.execute("INSERT INTO chats VALUES ('legacy', 'Чат 1', 0, 0)")
+    con.commit()
+    con.close()
+
+    store = ChatStore(path)
+    # Старые чаты ничьи: никому не видны, новые создаются с владельцем
+    assert store.list_chats("alice") == []
+    assert not store.chat_exists("alice", "legacy")
+    chat_id = store.create_chat("alice")
+    assert [c["chat_id"] for c in store.list_chats("alice")] == [chat_id]
+
+
+def test_mixed_type_frame_is_stored_as_strings(store):
+    chat_id = store.create_chat("alice")
+    message_id = store.add_message("alice", chat_id, "assistant", "ответ", pd.DataFrame({"a": [1, "b"], "n": [1, 2]}))
+    assert store.messages("alice", chat_id)[0]["content"] == "ответ"
+    df = store.frame("alice", message_id)
+    assert df["a"].tolist() == ["1", "b"] and df["n"].tolist() == [1, 2]
+
+
+def test_chats_survive_reopen(tmp_path):
+    path = str(tmp_path / "chats.sqlite")
+    store = ChatStore(path)
+    chat_id = store.create_chat("alice")
+    store.add_message("alice", chat_id, "user", "рецепты по месяцам")
+    message_id = store.add_message("alice", chat_id, "assistant", "вот они", pd.DataFrame({"month": ["2023-01"], "n": [5]}))
+    store._con.close()
+
+    reopened = ChatStore(path)
+    assert [m["content"] for m in reopened.messages("alice", chat_id)] == ["рецепты по месяцам", "вот они"]
+    assert reopened.frame("alice", message_id).to_dict("list") == {"month": ["2023-01"], "n": [5]}
+
+
+def test_search_by_word_prefix_any_case(store):
+    diabetes = store.create_chat("alice")
+    store.add_message("alice", diabetes, "user", "Сколько пациентов с Диабетом в 2023?")
+    other = store.create_chat("alice")
+    store.add_message("alice", other, "user", "Самые дорогие препараты")
+
+    assert [h["chat_id"] for h in store.search("alice", "диабет 2023")] == [diabetes]
+    assert [h["chat_id"] for h in store.search("alice", "препарат")] == [other]
+    assert store.search("alice", "инсульт") == []
+    assert store.search("alice", "!!!") == []
+
+
+def test_deleted_chat_leaves_search(store):
+    chat_id = store.create_chat("alice")
+    store.add_message("alice", chat_id, "user", "астма по районам")
+    store.delete_chat("alice", chat_id)
+    assert store.search("alice", "астма") == []
+
+
+def test_frame_cache_evicts_least_recently_used():
+    cache = FrameCache(max_bytes=300)
+    frames = {i: pd.DataFrame({"n": [i]}) for i in range(3)}
+    cache.put(0, frames[0], 100)
+    cache.put(1, frames[1], 100)
+    cache.put(2, frames[2], 100)
+    assert cache.get(0) is frames[0]       # 0 — самый свежий, вытеснится 1
+    cache.put(3, pd.DataFrame({"n": [3]}), 100)
+    assert cache.get(1) is None and cache.get(0) is frames[0] and cache.get(2) is frames[2]
+    assert cache.bytes == 300
+
+    cache.put(4, pd.DataFrame({"n": [4]}), 1000)  # больше всего лимита — не кэшируется
+    assert cache.get(4) is None and cache.bytes == 300
+
+
+def test_frame_read_from_disk_once(store):
+    chat_id = store.create_chat("alice")
+    message_id = store.add_message("alice", chat_id, "assistant", "ответ", pd.DataFrame({"n": range(10)}))
+    cache = FrameCache()
+    first = store.frame("alice", message_id, cache)
+    assert store.frame("alice", message_id, cache) is first
+    assert cache.stats()["loads"] == 1 and cache.stats()["hits"] == 1
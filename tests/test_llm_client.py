@@ -0,0 +1,108 @@
+# tests/test_llm_client.py
+# Ограничитель запросов к LLM и обработка 429 (llm_client.py) без обращения к провайдеру.
+# Запуск из корня проекта: python -m pytest -q tests
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import llm_client
+from llm_client import LLMClient, RateLimiter
+
+
+def rate_limit_error(retry_after: str = "0") -> openai.RateLimitError:
+    response = httpx.Response(429, headers={"retry-after": retry_after}, request=httpx.Request("POST", "http://llm"))
+    return openai.RateLimitError("429", response=response, body=None)
+
+
+def test_interactive_lane_goes_first():
+    limiter = RateLimiter(rpm=100, tpm=100000, max_in_flight=1)
+    running = limiter.acquire("pipeline", 10)
+    background = limiter.enqueue("background", 10)
+    interactive = limiter.enqueue("interactive", 10)
+    assert limiter.try_grant(interactive) > 0      # слот занят
+    limiter.release(running)
+
+    assert limiter.try_grant(background) > 0       # пришла раньше, но полоса ниже
+    assert limiter.try_grant(interactive) == 0
+    limiter.release(interactive)
+    assert limiter.try_grant(background) == 0
+
+
+def test_same_lane_is_fifo_and_cancel_frees_head():
+    limiter = RateLimiter(rpm=100, tpm=100000, max_in_flight=4)
+    first, second = limiter.enqueue("pipeline", 10), limiter.enqueue("pipeline", 10)
+    assert limiter.try_grant(second) > 0
+    limiter.cancel(first)
+    assert limiter.try_grant(second) == 0
+    assert limiter.state()["queued"] == 0
+
+
+def test_token_bucket_waits_and_refunds_unused_tokens():
+    limiter = RateLimiter(rpm=100, tpm=1000, max_in_flight=4)
+    big = limiter.acquire("interactive", 900)
+    waiting = limiter.enqueue("interactive", 500)
+    assert limiter.try_grant(waiting) > 1          # ~24 сек до пополнения ведра
+    limiter.release(big, used_tokens=100)          # 800 зарезервированных токенов вернулись
+    assert limiter.try_grant(waiting) == 0
+
+
+def test_pause_stops_every_lane():
+    limiter = RateLimiter(rpm=100, tpm=100000, max_in_flight=4)
+    limiter.pause(30)
+    ticket = limiter.enqueue("interactive", 10)
+    assert limiter.try_grant(ticket) > 29
+    assert limiter.state()["paused_sec"] > 29 and limiter.state()["requests_available"] == 0
+    limiter.cancel(ticket)
+
+
+class FakeModel:
+    """Поток ответа по сценарию: строки — кусочки текста, исключения — ошибки провайдера"""
+
+    def __init__(self, *attempts):
+        self.attempts = list(attempts)
+        self.calls = 0
+
+    def stream(self, messages):
+        script = self.attempts[self.calls]
+        self.calls += 1
+        for item in script:
+            if isinstance(item, Exception):
+                raise item
+            yield SimpleNamespace(content=item, usage_metadata=None, response_metadata={})
+
+
+@pytest.fixture
+def client():
+    return LLMClient("test-key", limiter=RateLimiter(rpm=1000, tpm=10**6))
+
+
+MESSAGES = [SimpleNamespace(content="вопрос")]
+
+
+def test_stream_retries_429_before_first_chunk(client):
+    model = FakeModel([rate_limit_error()], ["Ответ", " готов"])
+    client._model = lambda temperature=None: model
+    assert "".join(client.stream(MESSAGES)) == "Ответ готов"
+    assert model.calls == 2 and client.stats()["lanes"]["interactive"]["rate_limited"] == 1
+
+
+def test_stream_does_not_repeat_text_after_429(client):
+    model = FakeModel(["Начало", rate_limit_error()], ["Начало", " конец"])
+    client._model = lambda temperature=None: model
+    chunks = []
+    with pytest.raises(openai.RateLimitError):
+        for chunk in client.stream(MESSAGES):
+            chunks.append(chunk)
+    assert chunks == ["Начало"] and model.calls == 1
+    assert client.limiter.state()["in_flight"] == 0
+
+
+def test_p95_nearest_rank():
+    assert llm_client._p95([]) == 0.0
+    assert llm_client._p95([float(i) for i in range(1, 11)]) == 10.0
+    assert llm_client._p95([float(i) for i in range(1, 21)]) == 19.0
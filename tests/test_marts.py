@@ -0,0 +1,91 @@
+# tests/test_marts.py
+# Инкрементальные витрины insight_* (marts.py) против эталонного полного пересчёта (scripts_db/marts/*.sql)
+# на синтетической базе в памяти (схема как у исходных CSV: prescriptions + справочники).
+# Запуск из корня проекта: python -m pytest -q tests
+import sys
+from pathlib import Path
+
+import duckdb
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import marts
+
+
+def add_prescriptions(con, start: str, count: int, offset: int = 0):
+    con.execute(f"""
+        INSERT INTO prescriptions
+        SELECT
+            'P' || ((range + {offset}) * 7 % 300),
+            TIMESTAMP '{start}' + INTERVAL (range % 365) DAY + INTERVAL (range % 24) HOUR,
+            'D' || ((range + {offset}) * 11 % 30),
+            'R' || ((range + {offset}) * 17 % 40)
+        FROM range({count})
+    """)
+
+
+@pytest.fixture
+def con():
+    con = duckdb.connect()
+    con.execute("""
+        CREATE TABLE patients AS SELECT
+            'P' || range AS id_пациента,
+            DATE '1950-01-01' + INTERVAL (range * 37 % 25000) DAY AS дата_рождения,
+            CASE WHEN range % 2 = 0 THEN 'М' ELSE 'Ж' END AS пол,
+            'Район ' || (range % 7) AS район_проживания
+        FROM range(300)
+    """)
+    con.execute("""
+        CREATE TABLE diagnoses AS SELECT
+            'D' || range AS код_мкб, 'Диагноз ' || range AS название_диагноза, 'Класс ' || (range % 5) AS класс_заболевания
+        FROM range(30)
+    """)
+    # Одно торговое название у нескольких кодов и одинаковые цены — проверка ранжирования топ-3
+    con.execute("""
+        CREATE TABLE drugs AS SELECT
+            'R' || range AS код_препарата,
+            'Препарат ' || (range % 35) AS "Торговое название",
+            (((range * 13) % 50 + 1) * 10.0)::DECIMAL(21, 1) AS стоимость
+        FROM range(40)
+    """)
+    con.execute("CREATE TABLE prescriptions (id_пациента VARCHAR, дата_рецепта TIMESTAMP, код_диагноза VARCHAR, код_препарата VARCHAR)")
+    add_prescriptions(con, "2023-01-01", 20000)
+    # «Сироты»: пациента и препарата нет в справочниках
+    con.execute("INSERT INTO prescriptions VALUES ('P999', TIMESTAMP '2023-06-01', 'D1', 'R1'), ('P1', TIMESTAMP '2023-06-01', 'D1', 'R999')")
+    yield con
+    con.close()
+
+
+def test_delta_refresh_matches_full_recompute(con):
+    assert {r["mode"] for r in marts.refresh(con).values()} == {"full"}
+    assert set(marts.verify(con).values()) == {0}
+
+    # Новые рецепты после водяного знака проходят через витрины порцией
+    add_prescriptions(con, "2024-01-01", 3000, offset=5)
+    report = marts.refresh(con)
+    assert {r["mode"] for r in report.values()} == {"delta"}
+    assert {r["rows"] for r in report.values()} == {3000}
+    assert marts.verify(con) == {name: 0 for name in marts.MARTS}
+
+    assert {r["mode"] for r in marts.refresh(con).values()} == {"skip"}
+
+
+def test_changed_dimension_forces_full_recompute(con):
+    con.execute("CREATE TABLE _ingest_state (source VARCHAR PRIMARY KEY, checksum VARCHAR, watermark TIMESTAMP, rows BIGINT, loaded_at TIMESTAMP)")
+    con.execute("INSERT INTO _ingest_state VALUES ('drugs', 'a', NULL, 40, now()), ('prescriptions', 'x', NULL, 0, now())")
+    marts.refresh(con)
+
+    con.execute("UPDATE drugs SET стоимость = 9999 WHERE код_препарата = 'R3'")
+    con.execute("UPDATE _ingest_state SET checksum = 'b' WHERE source = 'drugs'")
+    assert {mode for mode, _ in marts.plan(con).values()} == {"full"}
+    marts.refresh(con)
+    assert marts.verify(con) == {name: 0 for name in marts.MARTS}
+    # Подорожавший препарат — первым в топ-3 каждой группы, где его назначали
+    tops = con.execute("""
+        SELECT m.top_expensive_drugs FROM insight_cost_by_disease m
+        WHERE m.disease_group IN (
+            SELECT d.класс_заболевания FROM prescriptions p JOIN diagnoses d ON p.код_диагноза = d.код_мкб
+            WHERE p.код_препарата = 'R3' AND p.id_пациента <> 'P999'
+        )
+    """).fetchall()
+    assert tops and all(top.startswith("Препарат 3,") for (top,) in tops)
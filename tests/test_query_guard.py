@@ -0,0 +1,39 @@
+# tests/test_query_guard.py
+# Query Guard на синтетических таблицах в памяти (база проекта не нужна).
+# Запуск из корня проекта: python -m pytest -q tests
+import sys
+from pathlib import Path
+
+import duckdb
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import query_guard
+
+
+@pytest.fixture
+def con():
+    con = duckdb.connect()
+    con.execute("CREATE TABLE a AS SELECT range AS id, range % 1000 AS k FROM range(200000)")
+    con.execute("CREATE TABLE b AS SELECT range AS id, range % 1000 AS k FROM range(20000)")
+    yield con
+    con.close()
+
+
+def test_theta_join_rejected(con):
+    # Оценка DuckDB для PIECEWISE_MERGE_JOIN — единицы миллионов строк, а выход до 200k x 20k
+    reason = query_guard.check(con, "SELECT COUNT(*) FROM a JOIN b ON a.id < b.id")
+    assert reason is not None and "декартово" in reason
+
+
+def test_two_inequalities_rejected(con):
+    reason = query_guard.check(con, "SELECT COUNT(*) FROM a JOIN b ON a.id < b.id AND a.k > b.k")
+    assert reason is not None
+
+
+def test_cross_join_rejected(con):
+    assert query_guard.check(con, "SELECT COUNT(*) FROM a, b") is not None
+
+
+def test_equi_join_passes(con):
+    assert query_guard.check(con, "SELECT COUNT(*) FROM a JOIN b ON a.id = b.id") is None
@@ -0,0 +1,31 @@
+# tests/test_result_cache.py
+# Кэш результатов не должен отдавать запросы, зависящие от текущего времени или случайных значений.
+# Запуск из корня проекта: python -m pytest -q tests
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from result_cache import is_volatile
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM t WHERE d > CURRENT_DATE - INTERVAL 30 DAY",
+    "select current_timestamp",
+    "SELECT now()",
+    "SELECT * FROM t ORDER BY RANDOM () LIMIT 10",
+    "SELECT gen_random_uuid()",
+])
+def test_volatile(sql):
+    assert is_volatile(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT 'current_date' FROM t",
+    'SELECT "now"(x) FROM t',
+    "SELECT random_col, nowhere FROM t -- now()",
+    "SELECT date_trunc('month', d), COUNT(*) FROM t GROUP BY 1",
+])
+def test_stable(sql):
+    assert not is_volatile(sql)
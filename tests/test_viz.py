@@ -0,0 +1,62 @@
+# tests/test_viz.py
+# Автографики ответов агента (viz.py) на синтетических DataFrame.
+# Запуск из корня проекта: python -m pytest -q tests
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import viz
+
+
+def months(n: int) -> list:
+    # Как strftime(дата_рецепта, '%Y-%m') в примерах SQL агента
+    return [f"{2000 + i // 12}-{i % 12 + 1:02d}" for i in range(n)]
+
+
+def test_large_string_dates_downsampled():
+    df = pd.DataFrame({"month": months(6000), "prescriptions": range(6000)})
+    spec, plot_df = viz.prepare(df)
+    assert spec["kind"] == "line" and spec["x"] == "month"
+    assert len(plot_df) == viz.MAX_POINTS
+    assert plot_df["month"].iloc[0] == df["month"].iloc[0] and plot_df["month"].iloc[-1] == df["month"].iloc[-1]
+
+
+def test_large_unparseable_axis_uses_row_order():
+    df = pd.DataFrame({"дата": [f"неделя {i:05d}" for i in range(6000)], "n": range(6000)})
+    spec, plot_df = viz.prepare(df)
+    assert spec["kind"] == "line" and len(plot_df) == viz.MAX_POINTS
+
+
+def test_lttb_keeps_ends_and_spike():
+    x = np.arange(10000, dtype=float)
+    y = np.sin(x / 500)
+    y[7777] = 50.0  # одиночный пик должен пережить прореживание
+    index = viz.lttb(x, y, 500)
+    assert len(index) == 500 and index[0] == 0 and index[-1] == len(x) - 1
+    assert np.all(np.diff(index) > 0)
+    assert 7777 in index
+
+
+def test_minmax_keeps_extremes():
+    y = np.random.default_rng(0).normal(size=10000)
+    y[123], y[9000] = -100.0, 100.0
+    index = viz.minmax(y, 200)
+    assert {0, 123, 9000, len(y) - 1} <= set(index.tolist())
+    assert len(index) <= 200 + 2
+
+
+def test_small_result_not_downsampled():
+    df = pd.DataFrame({"month": months(100), "n": range(100)})
+    assert viz.downsample(df, "month", "n") is df
+
+
+def test_spec_cached_per_content():
+    df = pd.DataFrame({"month": months(3000), "n": range(3000)})
+    spec, plot_df = viz.prepare(df)
+    # Тот же результат (в том числе копия) — та же спецификация и те же данные, без повторного расчёта
+    again, again_df = viz.prepare(df.copy())
+    assert again is spec and again_df is plot_df
+    assert viz.prepare(df.assign(n=df["n"] * 2))[0] is not spec
@@ -0,0 +1,192 @@
+import os
+import json
+import asyncio
+import time
+import secrets
+import threading
+import contextvars
+from contextlib import contextmanager
+
+import pandas as pd
+
+# --- КОНФИГУРАЦИЯ ---
+# Спаны этапов агента (промпт, LLM, SQL, анализ) пишутся в logs/traces.jsonl в формате OTLP JSON
+# (одна строка — один ExportTraceServiceRequest, как у file exporter OpenTelemetry Collector),
+# поэтому файл читает и страница «Производительность», и любой OTLP-совместимый инструмент.
+TRACE_PATH = os.getenv("TRACE_PATH", "logs/traces.jsonl")
+TRACING = os.getenv("TRACING", "1") != "0"
+MAX_FILE_MB = int(os.getenv("TRACE_MAX_MB", "50"))    # дальше файл уходит в traces.jsonl.1 (одна ротация)
+SERVICE_NAME = "medinsight-agent"
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """Этап с длительностью и атрибутами; дочерние спаны наследуют trace_id через contextvars"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, parent=None, attributes: dict = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.start_ns, self.end_ns = time.time_ns(), None
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id, "spanId": self.span_id, "name": self.name, "kind": 1,
+            "startTimeUnixNano": str(self.start_ns), "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items() if v is not None],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class _Exporter:
+    """Копит спаны трассы и пишет её одной строкой, когда закрывается корневой спан"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._pending = {}   # trace_id -> [Span]
+        self._lock = threading.Lock()
+
+    def finish(self, span: Span):
+        with self._lock:
+            spans = self._pending.setdefault(span.trace_id, [])
+            spans.append(span)
+            if span.parent_id is not None:
+                return
+            del self._pending[span.trace_id]
+        self._write(spans)
+
+    def finish_late(self, span: Span):
+        """Спан, закрывшийся после корня (отменённый кандидат гонки), — отдельной строкой"""
+        self._write([span])
+
+    def _write(self, spans: list):
+        line = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": [s.otlp() for s in spans]}],
+        }]}, ensure_ascii=False)
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                if os.path.exists(self.path) and os.path.getsize(self.path) > MAX_FILE_MB * 1024 * 1024:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except OSError as e:
+            print(f"🔸 TRACE NOT WRITTEN: {e}")
+
+    def is_open(self, trace_id: str) -> bool:
+        with self._lock:
+            return trace_id in self._pending
+
+
+_exporter = _Exporter(TRACE_PATH)
+
+
+# --- API ---
+@contextmanager
+def span(name: str, **attributes):
+    """with span("sql.execute", sql=...) as s: ... s.set(rows=len(df)) — вложенные спаны становятся детьми"""
+    if not TRACING:
+        yield Span(name)
+        return
+    parent = _current.get()
+    current = Span(name, parent, attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except (GeneratorExit, asyncio.CancelledError):
+        current.set(cancelled=True)   # поток ответа брошен или кандидат гонки проиграл — это не ошибка
+        raise
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        try:
+            _current.reset(token)
+        except ValueError:
+            _current.set(parent)   # генератор дочитан в другом контексте
+        if current.parent_id is None or _exporter.is_open(current.trace_id):
+            _exporter.finish(current)
+        else:
+            _exporter.finish_late(current)
+
+
+def set_attributes(**attributes):
+    """Атрибуты текущему спану (если трассировка идёт): так модули ниже агента отмечают, например, попадание в кэш"""
+    current = _current.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def current_span():
+    return _current.get()
+
+
+# --- ЧТЕНИЕ ДЛЯ СТРАНИЦЫ «ПРОИЗВОДИТЕЛЬНОСТЬ» ---
+def _plain(value: dict):
+    if "intValue" in value:
+        return int(value["intValue"])
+    return next(iter(value.values()), None)
+
+
+def load_spans(path: str = TRACE_PATH, max_lines: int = 5000) -> pd.DataFrame:
+    """Спаны последних max_lines строк файла: trace_id, span_id, parent_id, name, start, duration_ms, error + атрибуты"""
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=["trace_id", "span_id", "parent_id", "name", "start", "duration_ms", "error"])
+    with open(path, encoding="utf-8") as f:
+        lines = f.readlines()[-max_lines:]
+    rows = []
+    for line in lines:
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError:
+            continue  # строка, недописанная при падении процесса
+        for resource in request.get("resourceSpans", []):
+            for scope in resource.get("scopeSpans", []):
+                for s in scope.get("spans", []):
+                    start, end = int(s["startTimeUnixNano"]), int(s["endTimeUnixNano"])
+                    row = {"trace_id": s["traceId"], "span_id": s["spanId"], "parent_id": s.get("parentSpanId"),
+                           "name": s["name"], "start": pd.Timestamp(start, unit="ns"), "duration_ms": (end - start) / 1e6,
+                           "error": s.get("status", {}).get("message")}
+                    row.update({a["key"]: _plain(a["value"]) for a in s.get("attributes", []) if a["key"] not in row})
+                    rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def stage_stats(spans: pd.DataFrame) -> pd.DataFrame:
+    """По этапам: число спанов, p50/p95/макс длительности, суммарное время и ошибки"""
+    if spans.empty:
+        return pd.DataFrame()
+    grouped = spans.groupby("name")["duration_ms"]
+    stats = pd.DataFrame({
+        "count": grouped.size(),
+        "p50_ms": grouped.quantile(0.5),
+        "p95_ms": grouped.quantile(0.95),
+        "max_ms": grouped.max(),
+        "total_s": grouped.sum() / 1000,
+        "errors": spans["error"].notna().groupby(spans["name"]).sum(),
+    })
+    return stats.sort_values("total_s", ascending=False).round(1)
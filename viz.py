@@ -0,0 +1,176 @@
+import os
+import hashlib
+import threading
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import chart_data
+
+# --- КОНФИГУРАЦИЯ ---
+# Автографики ответов агента: роли колонок определяются один раз на результат (спецификация кэшируется),
+# большие результаты прореживаются до MAX_POINTS точек вместо обрезки по числу строк.
+MAX_POINTS = int(os.getenv("VIZ_MAX_POINTS", "2000"))     # точек на линейном графике
+DOWNSAMPLE = os.getenv("VIZ_DOWNSAMPLE", "lttb")          # lttb | minmax
+TOP_CATEGORIES = 20                                       # столбцов на бар-чарте, остальные — одной строкой
+MAX_SERIES = 10                                           # линий на графике (категория -> цвет)
+SPEC_CACHE_SIZE = 64
+OTHER_LABEL = "Остальные ({} категорий)"
+
+DATE_HINTS = ['date', 'time', 'year', 'month', 'day', 'дата', 'год', 'месяц']
+SHARE_HINTS = ['share', 'доля', 'процент']
+# Средние и доли нельзя складывать в «Остальные» — такие ряды просто обрезаются до топа
+NON_ADDITIVE_HINTS = ['avg', 'mean', 'средн', 'share', 'доля', 'процент', 'percent', 'ratio', 'rate', 'per_', 'на_']
+
+
+# --- ПРОРЕЖИВАНИЕ ---
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Индексы точек Largest-Triangle-Three-Buckets: форма линии сохраняется, пики не теряются"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)  # threshold-2 корзин между крайними точками
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        # Площадь треугольника (предыдущая выбранная точка, кандидат, среднее следующей корзины)
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def minmax(y: np.ndarray, threshold: int) -> np.ndarray:
+    """Индексы минимума и максимума в каждой из threshold/2 корзин (плюс крайние точки)"""
+    n = len(y)
+    if threshold >= n:
+        return np.arange(n)
+    buckets = np.arange(n) * max(threshold // 2, 1) // n
+    grouped = pd.Series(y).groupby(buckets)
+    keep = np.concatenate([grouped.idxmin().to_numpy(), grouped.idxmax().to_numpy(), [0, n - 1]])
+    return np.unique(keep)
+
+
+def _x_axis(xs: pd.Series) -> np.ndarray:
+    """Ось X числами для LTTB: даты — в наносекундах, строки вида "2023-01" разбираются как даты,
+    ось, которая не число и не дата, — номер строки (ряд уже отсортирован по x)"""
+    if pd.api.types.is_datetime64_any_dtype(xs):
+        return xs.astype("int64").to_numpy(dtype=float)
+    numbers = pd.to_numeric(xs, errors="coerce")
+    if numbers.notna().all():
+        return numbers.to_numpy(dtype=float)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)  # "Could not infer format" для нестандартных строк
+        dates = pd.to_datetime(xs, errors="coerce")
+    if dates.notna().all():
+        return dates.astype("int64").to_numpy(dtype=float)
+    return np.arange(len(xs), dtype=float)
+
+
+def downsample(df: pd.DataFrame, x: str, y: str, points: int = MAX_POINTS, method: str = None) -> pd.DataFrame:
+    """Строки временного ряда (отсортированного по x), которые остаются на графике"""
+    if len(df) <= points:
+        return df
+    values = df[y].to_numpy(dtype=float)
+    if (method or DOWNSAMPLE) == "minmax":
+        index = minmax(values, points)
+    else:
+        index = lttb(_x_axis(df[x]), values, points)
+    return df.iloc[index]
+
+
+# --- РОЛИ КОЛОНОК ---
+def infer_spec(df: pd.DataFrame):
+    """Спецификация графика {"kind", "x", "y", "color", "title"} или None, если строить нечего"""
+    if df is None or df.empty or len(df.columns) < 2:
+        return None
+    datetime_cols = df.select_dtypes(include=['datetime', 'datetimetz']).columns.tolist()
+    date_cols = datetime_cols + [c for c in df.columns if c not in datetime_cols and any(h in c.lower() for h in DATE_HINTS)]
+    # Год/месяц числом — ось X, а не показатель
+    num_cols = [c for c in df.select_dtypes(include=['number']).columns if c not in date_cols]
+    cat_cols = [c for c in df.select_dtypes(include=['object', 'string', 'category']).columns if c not in date_cols]
+
+    if date_cols and num_cols:
+        x, y = date_cols[0], num_cols[0]
+        # Несколько рядов: категория с небольшим числом значений -> цвет линии
+        color = next((c for c in cat_cols if df[c].nunique() <= MAX_SERIES), None)
+        return {"kind": "line", "x": x, "y": y, "color": color, "title": f"Динамика: {y}"}
+    if cat_cols and num_cols:
+        x, y = cat_cols[0], num_cols[0]
+        if len(df) <= 6 and any(h in y.lower() for h in SHARE_HINTS):
+            return {"kind": "pie", "x": x, "y": y, "color": None, "title": f"Распределение: {x}"}
+        return {"kind": "bar", "x": x, "y": y, "color": None, "title": f"{y} по {x}"}
+    return None
+
+
+def _plot_data(df: pd.DataFrame, spec: dict) -> pd.DataFrame:
+    """Данные, которые реально уходят в Plotly (прорежённые / свёрнутые)"""
+    x, y, color = spec["x"], spec["y"], spec["color"]
+    if spec["kind"] == "line":
+        df = df.dropna(subset=[x, y]).sort_values([color, x] if color else x)
+        if color:
+            per_series = max(MAX_POINTS // max(df[color].nunique(), 1), 3)
+            return pd.concat([downsample(g, x, y, per_series) for _, g in df.groupby(color, sort=False)])
+        return downsample(df, x, y)
+    if spec["kind"] == "bar" and len(df) > TOP_CATEGORIES:
+        if any(h in y.lower() for h in NON_ADDITIVE_HINTS):
+            return df.nlargest(TOP_CATEGORIES, y)
+        # Суммы по категориям и хвост одной строкой считает DuckDB
+        top, error = chart_data.top_n(df, x, y, n=TOP_CATEGORIES, other_label=OTHER_LABEL)
+        return df.nlargest(TOP_CATEGORIES, y) if error else top
+    return df
+
+
+# --- КЭШ СПЕЦИФИКАЦИЙ ---
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _fingerprint(df: pd.DataFrame) -> str:
+    """Хэш содержимого результата: по буферам Arrow (hash_pandas_object по строкам в десятки раз медленнее)"""
+    digest = hashlib.sha1("|".join(f"{c}:{t}" for c, t in df.dtypes.astype(str).items()).encode("utf-8"))
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+        return digest.hexdigest()
+    for column in table.columns:
+        for chunk in column.chunks:
+            for buffer in chunk.buffers():
+                if buffer is not None:
+                    digest.update(buffer)
+    return digest.hexdigest()
+
+
+def prepare(df: pd.DataFrame):
+    """(спецификация, данные для графика) — один раз на результат, повторные перерисовки из кэша"""
+    if df is None or df.empty:
+        return None, None
+    key = _fingerprint(df)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    spec = infer_spec(df)
+    plot_df = None
+    if spec is not None:
+        plot_df = _plot_data(df, spec)
+        spec["rows"], spec["points"] = len(df), len(plot_df)
+        # Прореживание не должно быть незаметным
+        if spec["kind"] == "line" and len(plot_df) < len(df):
+            spec["title"] += f" ({len(plot_df):,} точек из {len(df):,})"
+        elif spec["kind"] == "bar" and len(df) > TOP_CATEGORIES:
+            categories = df[spec["x"]].nunique()
+            if categories > TOP_CATEGORIES:
+                spec["title"] += f" (топ-{TOP_CATEGORIES} из {categories:,})"
+    with _cache_lock:
+        _cache[key] = (spec, plot_df)
+        if len(_cache) > SPEC_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return spec, plot_df
@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import queue
+import hashlib
+import threading
+
+import duckdb
+import pandas as pd
+
+from result_cache import canonicalize_sql
+
+# --- КОНФИГУРАЦИЯ ---
+# Журнал нагрузки: каждый запрос агента и дашборда через пул — одна строка JSON с «формой» запроса
+# (таблицы, ключи GROUP BY, колонки фильтров, агрегаты) и временем выполнения. По нему mart_advisor.py
+# ищет горячие агрегаты по сырым таблицам и предлагает для них витрины insight_auto_*.
+WORKLOAD_PATH = os.getenv("WORKLOAD_PATH", "logs/workload.jsonl")
+WORKLOAD_LOG = os.getenv("WORKLOAD_LOG", "1") != "0"
+MAX_FILE_MB = int(os.getenv("WORKLOAD_MAX_MB", "50"))   # дальше файл уходит в workload.jsonl.1 (одна ротация)
+MAX_PENDING = 1000   # записей в очереди писателя; при переполнении новые отбрасываются, а не тормозят запросы
+MAX_SQL_CHARS = 4000
+
+# Агрегаты, которые можно досчитать из витрины более мелкого зерна (AVG — через сумму и количество)
+ADDITIVE = {"count", "count_star", "sum", "min", "max", "avg", "mean"}
+AGGREGATES = ADDITIVE | {
+    "median", "mode", "quantile", "quantile_cont", "quantile_disc", "approx_quantile", "approx_count_distinct",
+    "string_agg", "list", "array_agg", "first", "last", "any_value", "arg_min", "arg_max", "product",
+    "stddev", "stddev_samp", "stddev_pop", "variance", "var_samp", "var_pop", "bool_and", "bool_or", "histogram",
+}
+# Зерно даты по функции над колонкой: date_trunc('month', d), strftime(d, '%Y-%m'), year(d) ...
+GRAIN_FUNCTIONS = {"year": "year", "quarter": "quarter", "month": "month", "week": "week", "weekofyear": "week",
+                   "day": "day", "dayofmonth": "day", "dayofweek": "day", "dayofyear": "day"}
+GRAINS = ("day", "week", "month", "quarter", "year")
+
+
+def shape_fingerprint(sql: str) -> str:
+    """Отпечаток формы запроса: одинаковый для разных значений фильтров и форматирования"""
+    return hashlib.sha1(canonicalize_sql(sql, literals=False).encode("utf-8")).hexdigest()[:16]
+
+
+# --- РАЗБОР ФОРМЫ ЗАПРОСА (AST DuckDB: json_serialize_sql) ---
+def _nodes(node):
+    """Все словари дерева в прямом порядке"""
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _nodes(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _nodes(value)
+
+
+def _base_tables(from_table) -> list:
+    """Таблицы прямо в FROM/JOIN узла (без подзапросов)"""
+    if not isinstance(from_table, dict):
+        return []
+    if from_table.get("type") == "BASE_TABLE":
+        return [from_table]
+    if from_table.get("type") == "JOIN":
+        return _base_tables(from_table.get("left")) + _base_tables(from_table.get("right"))
+    return []
+
+
+def _is_aggregate(expr: dict) -> bool:
+    return expr.get("class") == "FUNCTION" and expr.get("function_name", "").lower() in AGGREGATES
+
+
+def _has_aggregate(expr) -> bool:
+    return any(_is_aggregate(n) for n in _nodes(expr) if n.get("class") != "SUBQUERY")
+
+
+def _column_refs(expr) -> list:
+    """COLUMN_REF выражения, не заходя в подзапросы и агрегаты"""
+    if isinstance(expr, list):
+        return [ref for e in expr for ref in _column_refs(e)]
+    if not isinstance(expr, dict) or expr.get("class") == "SUBQUERY" or _is_aggregate(expr):
+        return []
+    if expr.get("class") == "COLUMN_REF":
+        return [expr["column_names"]]
+    return [ref for value in expr.values() if isinstance(value, (dict, list)) for ref in _column_refs(value)]
+
+
+def _constant(expr: dict):
+    if isinstance(expr, dict) and expr.get("class") == "CONSTANT":
+        return expr["value"].get("value")
+    return None
+
+
+def _grain(expr: dict):
+    """Зерно даты, если выражение — функция усечения даты над одной колонкой"""
+    if expr.get("class") != "FUNCTION":
+        return None
+    name = expr.get("function_name", "").lower()
+    args = expr.get("children", [])
+    if name in ("date_trunc", "datetrunc", "time_bucket") and args:
+        part = str(_constant(args[0]) or "").lower()
+        return part if part in GRAINS else "day"
+    if name == "strftime" and len(args) == 2:
+        fmt = str(_constant(args[1]) or "")
+        if any(f in fmt for f in ("%d", "%j", "%a", "%A")):
+            return "day"
+        if any(f in fmt for f in ("%W", "%U", "%V")):
+            return "week"
+        return "month" if ("%m" in fmt or "%b" in fmt or "%B" in fmt) else "year"
+    return GRAIN_FUNCTIONS.get(name)
+
+
+class _Resolver:
+    """Колонка -> "таблица.колонка" по алиасам FROM и схеме базы"""
+
+    def __init__(self, aliases: dict, tables: list, schema: dict):
+        self.aliases = aliases
+        self.tables = tables
+        self.schema = schema
+
+    def column(self, names: list):
+        """None — не колонка таблицы (CURRENT_DATE, алиас из SELECT)"""
+        *qualifier, column = names
+        if qualifier:
+            table = self.aliases.get(qualifier[-1].lower(), qualifier[-1].lower())
+        else:
+            owners = [t for t in self.tables if any(c == column for c, _ in self.schema.get(t, []))]
+            table = owners[0] if owners else (self.tables[0] if len(self.tables) == 1 else "?")
+        if table in self.schema and not any(c == column for c, _ in self.schema[table]):
+            return None
+        return f"{table}.{column}"
+
+    def is_date(self, key: str) -> bool:
+        table, column = key.split(".", 1)
+        return any(c == column and str(t).upper().startswith(("DATE", "TIMESTAMP")) for c, t in self.schema.get(table, []))
+
+    def keys(self, expr: dict) -> list:
+        """Ключи разреза: "таблица.колонка" или "таблица.колонка@зерно" для дат"""
+        refs = _column_refs(expr)
+        grain = _grain(expr) if len(refs) == 1 else None
+        keys = []
+        for key in filter(None, map(self.column, refs)):
+            if grain:
+                key += f"@{grain}"
+            elif self.is_date(key):
+                key += "@day"
+            keys.append(key)
+        return keys
+
+
+def _measure(expr: dict, resolver: _Resolver) -> str:
+    name = expr.get("function_name", "").lower()
+    args = [a for a in expr.get("children", []) if a.get("class") != "CONSTANT" or name != "count"]
+    if name == "count_star" or (name == "count" and not args):
+        return "count"
+    if name not in ADDITIVE or len(args) != 1 or args[0].get("class") != "COLUMN_REF":
+        return f"other:{name}"
+    column = resolver.column(args[0]["column_names"])
+    if column is None:
+        return f"other:{name}"
+    if expr.get("distinct"):
+        return f"count_distinct:{column}" if name == "count" else f"other:{name}"
+    return f"{'avg' if name == 'mean' else name}:{column}"
+
+
+def parse_shape(con, sql: str, schema: dict = None) -> dict:
+    """{"tables", "group_by", "filters", "measures"} последнего запроса в тексте; None — не разобрать"""
+    try:
+        ast = json.loads(con.execute("SELECT json_serialize_sql(?::VARCHAR)", [sql]).fetchone()[0])
+    except duckdb.Error:
+        return None
+    if ast.get("error") or not ast.get("statements"):
+        return None
+    statement = ast["statements"][-1]
+    nodes = list(_nodes(statement))
+    ctes = {entry["key"].lower() for n in nodes if "cte_map" in n for entry in n["cte_map"].get("map", [])}
+    base = [n for n in nodes if n.get("type") == "BASE_TABLE" and n["table_name"].lower() not in ctes]
+    tables = sorted({n["table_name"].lower() for n in base})
+    aliases = {(n.get("alias") or n["table_name"]).lower(): n["table_name"].lower() for n in base}
+    shape = {"tables": tables, "group_by": [], "filters": [], "measures": []}
+
+    # Агрегирующий SELECT, читающий таблицы напрямую (внешние SELECT над CTE/подзапросами пропускаем)
+    select = next((n for n in nodes if n.get("type") == "SELECT_NODE"
+                   and any(t["table_name"].lower() not in ctes for t in _base_tables(n.get("from_table")))
+                   and (n.get("group_expressions") or n.get("aggregate_handling") == "FORCE_AGGREGATES"
+                        or any(_has_aggregate(e) for e in n.get("select_list", [])))), None)
+    if select is None:
+        return shape
+    direct = sorted({t["table_name"].lower() for t in _base_tables(select["from_table"])})
+    resolver = _Resolver(aliases, direct, schema or {})
+    select_list = select.get("select_list", [])
+    by_alias = {e["alias"].lower(): e for e in select_list if e.get("alias")}
+
+    groups = []
+    for expr in select.get("group_expressions", []):
+        position = _constant(expr)
+        if isinstance(position, int) and 0 < position <= len(select_list):
+            expr = select_list[position - 1]   # GROUP BY 1
+        elif expr.get("class") == "COLUMN_REF" and len(expr["column_names"]) == 1:
+            expr = by_alias.get(expr["column_names"][0].lower(), expr)   # GROUP BY алиас
+        groups.append(expr)
+    if select.get("aggregate_handling") == "FORCE_AGGREGATES":
+        groups = [e for e in select_list if not _has_aggregate(e)]   # GROUP BY ALL
+    shape["group_by"] = sorted({key for expr in groups for key in resolver.keys(expr)})
+
+    # Колонки фильтров (WHERE и FILTER у агрегатов) — тоже разрезы витрины; дата — в зерне группировки
+    date_grains = {key.split("@")[0]: key.split("@")[1] for key in shape["group_by"] if "@" in key}
+    aggregates = [n for e in select_list + [select.get("having") or {}] for n in _nodes(e) if _is_aggregate(n)]
+    conditions = [select.get("where_clause")] + [a["filter"] for a in aggregates if a.get("filter")]
+    filters = set()
+    for condition in filter(None, conditions):
+        for key in filter(None, map(resolver.column, _column_refs(condition))):
+            filters.add(f"{key}@{date_grains.get(key, 'day')}" if resolver.is_date(key) else key)
+    shape["filters"] = sorted(filters - set(shape["group_by"]))
+    shape["measures"] = sorted({_measure(a, resolver) for a in aggregates})
+    return shape
+
+
+# --- ЗАПИСЬ ---
+class _Writer:
+    """Фоновый писатель: разбор формы и запись не задерживают ответ на запрос"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=MAX_PENDING)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, entry: dict):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="workload-log", daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        con = duckdb.connect()  # только парсер, без данных
+        while True:
+            entry = self._queue.get()
+            try:
+                shape = parse_shape(con, entry["sql"], _schema(entry.pop("db_path")))
+                entry.update(shape or {"tables": [], "group_by": [], "filters": [], "measures": [], "unparsed": True})
+                self._write(entry)
+            except Exception as e:
+                print(f"🔸 WORKLOAD NOT LOGGED: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, entry: dict):
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if os.path.exists(self.path) and os.path.getsize(self.path) > MAX_FILE_MB * 1024 * 1024:
+            os.replace(self.path, self.path + ".1")
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def flush(self):
+        self._queue.join()
+
+
+def _schema(db_path: str) -> dict:
+    from sql_executor import get_schema  # sql_executor сам импортирует этот модуль
+    try:
+        return get_schema(db_path)
+    except Exception:
+        return {}
+
+
+_writer = _Writer(WORKLOAD_PATH)
+
+
+# --- API ---
+def record(sql: str, source: str, db_path: str, runtime_ms: float, rows=None, error: str = None,
+           cached: bool = False, queue_wait_ms: float = None):
+    """Запрос в журнал нагрузки (разбор и запись — в фоне)"""
+    if not WORKLOAD_LOG:
+        return
+    _writer.submit({
+        "ts": round(time.time(), 3), "source": source, "fingerprint": shape_fingerprint(sql),
+        "runtime_ms": round(runtime_ms, 1), "queue_wait_ms": queue_wait_ms, "rows": rows, "cached": cached,
+        "error": error[:200] if error else None, "sql": sql[:MAX_SQL_CHARS], "db_path": db_path,
+    })
+
+
+def flush():
+    """Дождаться записи всего, что уже в очереди (для скриптов и бенчмарков)"""
+    _writer.flush()
+
+
+def load(path: str = WORKLOAD_PATH, since_days: float = None, max_lines: int = 200000) -> pd.DataFrame:
+    """Записи журнала (последние max_lines строк, за since_days дней)"""
+    columns = ["ts", "source", "fingerprint", "tables", "group_by", "filters", "measures",
+               "runtime_ms", "rows", "cached", "error", "sql"]
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=columns)
+    with open(path, encoding="utf-8") as f:
+        lines = f.readlines()[-max_lines:]
+    rows = []
+    for line in lines:
+        try:
+            rows.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue  # строка, недописанная при падении процесса
+    df = pd.DataFrame(rows).reindex(columns=columns + ["unparsed"])
+    if since_days is not None and not df.empty:
+        df = df[df["ts"] >= time.time() - since_days * 86400]
+    return df.reset_index(drop=True)